@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark del reparto de direcciones de lib_address.
+Reparte bloques a N escenarios (con la mitad liberados y vueltos a pedir, para que haya
+huecos), busca el propietario de direcciones al azar y reparte las direcciones de una
+red grande entre sus nodos.
+
+Uso: python3 benchmarks/bench_address.py [número_de_escenarios] [nodos_por_red]
+"""
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib_address import BlockAllocator, HostAllocator
+
+
+def main():
+  scenarios = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+  hosts = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+  random.seed(1)
+
+  allocator = BlockAllocator("10.0.0.0/8")
+  start = time.perf_counter()
+  for i in range(scenarios):
+    allocator.allocate(f"e{i}", 20)
+  for i in range(0, scenarios, 2):
+    allocator.release(f"e{i}")
+  for i in range(0, scenarios, 2):
+    allocator.allocate(f"n{i}", 20)
+  allocated = time.perf_counter() - start
+
+  pool = ipaddress.ip_network("10.0.0.0/8")
+  addresses = [pool.network_address + random.randrange(pool.num_addresses) for _ in range(100000)]
+  start = time.perf_counter()
+  found = sum(allocator.owner_of(address) is not None for address in addresses)
+  lookup = time.perf_counter() - start
+
+  network = HostAllocator("10.0.0.0/16")
+  start = time.perf_counter()
+  for i in range(hosts):
+    network.allocate(f"s{i}", 11)
+  for i in range(hosts):
+    network.owner_of(network.address_of(f"s{i}"))
+  per_host = time.perf_counter() - start
+
+  print(f"Bloques /20: {scenarios + scenarios // 2} repartos y {scenarios // 2} liberaciones en {allocated * 1000:.2f} ms")
+  print(f"Propietario de {len(addresses)} direcciones ({found} ocupadas): {lookup * 1000:.2f} ms "
+        f"({lookup / len(addresses) * 1e6:.2f} us/consulta)")
+  print(f"Direcciones de nodo: {hosts} repartos y búsquedas en {per_host * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Benchmark del ciclo de vida completo de manage-p2.py (create, start, stop, destroy)
+sin hipervisor: hipervisor simulado ('hypervisor: fake') y comandos externos en modo
+'dry-run', cada uno con una duración simulada fija.
+Compara la ejecución secuencial (max_workers 1) con la paralela.
+
+Uso: python3 benchmarks/bench_lifecycle.py [número_de_servidores] [max_workers] [ms_por_comando]
+"""
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import lib_cmd as cmd
+from lib_vm import VM
+from bench_xml import SAMPLE_TEMPLATE
+
+PHASES = ("create", "start", "stop", "destroy")
+
+
+def load_manage():
+  spec = importlib.util.spec_from_file_location("manage_p2", os.path.join(ROOT, "manage-p2.py"))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  module.pause = lambda: None
+  return module
+
+
+def run(servers, workers, delay):
+  workdir = tempfile.mkdtemp(prefix="bench_lifecycle_")
+  cwd = os.getcwd()
+  try:
+    os.chdir(workdir)
+    with open("manage-p2.json", "w") as f:
+      json.dump({"number_of_servers": servers, "max_workers": workers, "hypervisor": "fake",
+                 "ready_timeout": 0, "dry_run_delay": delay, "address_registry": "addresses.json",
+                 "networks": {"lan1": "10.1.1.0/24", "lan2": "10.2.0.0/16"}}, f)
+    with open("plantilla-vm-pc1.xml", "w") as f:
+      f.write(SAMPLE_TEMPLATE)
+    open("cdps-vm-base-pc1.qcow2", "w").close()
+
+    manage = load_manage()
+    manage.configure_runner("dry-run")
+    # Sin terminales: las consolas no forman parte de lo que se mide
+    VM.show_console_vm = lambda vm: None
+
+    times = {}
+    for phase in PHASES:
+      start = time.perf_counter()
+      with contextlib.redirect_stdout(io.StringIO()):
+        getattr(manage, phase)()
+      times[phase] = time.perf_counter() - start
+    return times
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(workdir)
+    cmd.set_runner(cmd.Runner())
+
+
+def main():
+  servers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+  delay = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+  # Los errores esperados del hipervisor simulado (p. ej. destruir una VM ya apagada) no se muestran
+  logging.disable(logging.CRITICAL)
+
+  print(f"Servidores: {servers}, {delay * 1000:.0f} ms por comando simulado")
+  print(f"{'max_workers':>11} " + " ".join(f"{phase:>9}" for phase in PHASES) + f" {'total':>9}")
+  for n in sorted({1, workers}):
+    times = run(servers, n, delay)
+    print(f"{n:>11} " + " ".join(f"{times[phase]:>8.2f}s" for phase in PHASES) + f" {sum(times.values()):>8.2f}s")
+
+
+if __name__ == "__main__":
+  main()
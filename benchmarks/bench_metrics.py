@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark del exportador de métricas de lib_metrics.
+Convierte salidas de ejemplo de HAProxy (CSV de /stats;csv), de 'virsh domstats' y de
+'ovs-vsctl' para un escenario de N servidores en texto de Prometheus, sin necesitar las
+VMs: mide lo que cuesta cada lectura del exportador aparte de esperar a las fuentes.
+
+Uso: python3 benchmarks/bench_metrics.py [número_de_servidores] [repeticiones]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib_hypervisor import parse_domstats
+from lib_metrics import (parse_haproxy_csv, haproxy_samples, domain_samples, parse_ovs_tables,
+                         ovs_samples, render)
+
+CSV_FIELDS = ("pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,"
+              "wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,"
+              "sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,check_status,check_code,"
+              "check_duration,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,hanafail,"
+              "req_rate,req_rate_max,req_tot").split(",")
+
+
+def csv_row(**values):
+  return ",".join(str(values.get(field, "")) for field in CSV_FIELDS)
+
+
+def haproxy_fixture(servers):
+  rows = [csv_row(pxname="lb", svname="FRONTEND", scur=3, stot=5000, bin=400000, bout=9000000,
+                  status="OPEN", req_tot=5000, hrsp_2xx=4990, hrsp_5xx=10)]
+  for i in range(1, servers + 1):
+    rows.append(csv_row(pxname="webfarm", svname=f"s{i}", scur=i % 4, stot=100 + i, lbtot=100 + i,
+                        bin=8000 * i, bout=180000 * i, status="UP" if i % 10 else "DOWN",
+                        hrsp_2xx=100 + i, hrsp_4xx=1, hrsp_5xx=0, hrsp_1xx=0, hrsp_3xx=0, hrsp_other=0))
+  rows.append(csv_row(pxname="webfarm", svname="BACKEND", scur=3, stot=5000, status="UP",
+                      act=servers - servers // 10))
+  return "# " + ",".join(CSV_FIELDS) + "\n" + "\n".join(rows) + "\n"
+
+
+def domstats_fixture(names):
+  blocks = []
+  for i, name in enumerate(names):
+    blocks.append("\n".join([
+      f"Domain: '{name}'",
+      "  state.state=1", "  state.reason=1",
+      f"  cpu.time={1000000000 * (i + 1)}", "  cpu.user=400000000", "  cpu.system=200000000",
+      "  balloon.current=524288", "  balloon.maximum=524288", "  balloon.rss=310000",
+      "  net.count=1", f"  net.0.name=vnet{i}",
+      f"  net.0.rx.bytes={1000 * i}", f"  net.0.rx.pkts={10 * i}", "  net.0.rx.errs=0", "  net.0.rx.drop=0",
+      f"  net.0.tx.bytes={2000 * i}", f"  net.0.tx.pkts={20 * i}", "  net.0.tx.errs=0", "  net.0.tx.drop=0",
+    ]))
+  return "\n\n".join(blocks) + "\n"
+
+
+def ovs_fixture(bridges, ports_per_bridge):
+  bridge_rows, port_rows, iface_rows = [], [], []
+  for b, bridge in enumerate(bridges):
+    ports = []
+    for p in range(ports_per_bridge):
+      port, iface = f"p-{b}-{p}", f"i-{b}-{p}"
+      ports.append(["uuid", port])
+      port_rows.append([["uuid", port], ["uuid", iface]])
+      iface_rows.append([["uuid", iface], f"vnet{b * ports_per_bridge + p}",
+                         ["map", [["rx_bytes", 1000 * p], ["rx_packets", 10 * p], ["rx_dropped", 0],
+                                  ["tx_bytes", 2000 * p], ["tx_packets", 20 * p], ["tx_dropped", 0]]]])
+    bridge_rows.append([bridge, ["set", ports]])
+  tables = [{"data": bridge_rows, "headings": ["name", "ports"]},
+            {"data": port_rows, "headings": ["_uuid", "interfaces"]},
+            {"data": iface_rows, "headings": ["_uuid", "name", "statistics"]}]
+  return "\n".join(json.dumps(table) for table in tables) + "\n"
+
+
+def main():
+  servers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+  repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+  names = [f"s{i}" for i in range(1, servers + 1)] + ["lb", "c1"]
+  csv_text = haproxy_fixture(servers)
+  domstats_text = domstats_fixture(names)
+  ovs_text = ovs_fixture(["LAN1", "LAN2"], servers // 2 + 2)
+
+  timings = {}
+  start = time.perf_counter()
+  for _ in range(repeat):
+    haproxy = haproxy_samples(parse_haproxy_csv(csv_text), "lb")
+  timings["HAProxy CSV"] = time.perf_counter() - start
+  start = time.perf_counter()
+  for _ in range(repeat):
+    domains = domain_samples(parse_domstats(domstats_text), set(names))
+  timings["virsh domstats"] = time.perf_counter() - start
+  start = time.perf_counter()
+  for _ in range(repeat):
+    ports = ovs_samples(parse_ovs_tables(ovs_text), {"LAN1", "LAN2"})
+  timings["ovs-vsctl"] = time.perf_counter() - start
+  samples = haproxy + domains + ports
+  start = time.perf_counter()
+  for _ in range(repeat):
+    text = render(samples)
+  timings["texto Prometheus"] = time.perf_counter() - start
+
+  print(f"Servidores: {servers}, muestras: {len(samples)}, texto: {len(text)} bytes")
+  for name, elapsed in timings.items():
+    print(f"{name:17s} {elapsed / repeat * 1000:8.3f} ms/lectura")
+  print(f"{'total':17s} {sum(timings.values()) / repeat * 1000:8.3f} ms/lectura")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark de generación de la configuración de los nodos.
+Compara el método de ficheros temporales (escribir cada fichero en disco para después
+subirlo a la imagen) con los bundles en memoria de lib_render, y mide cuánto cuesta
+detectar en un segundo arranque que ningún nodo ha cambiado.
+
+Uso: python3 benchmarks/bench_render.py [número_de_servidores]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib_render import render_all
+from lib_topology import Topology, render_haproxy, render_interfaces
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  config = {"number_of_servers": count, "networks": {"lan1": "10.1.1.0/24", "lan2": "10.2.0.0/16"}}
+  topology = Topology.from_config(config)
+  nodes = list(topology.nodes.values())
+
+  # Método anterior: ficheros temporales por nodo y haproxy.cfg generado para cada balanceador
+  workdir = tempfile.mkdtemp(prefix="bench_render_")
+  try:
+    start = time.perf_counter()
+    for node in nodes:
+      files = {"hostname": node.name, "interfaces": render_interfaces(node)}
+      if node.role == "lb":
+        files["haproxy.cfg"] = render_haproxy(topology)
+      for name, content in files.items():
+        path = os.path.join(workdir, f"{node.name}-{name}")
+        with open(path, "w") as f:
+          f.write(content)
+        with open(path) as f:
+          f.read()
+        os.remove(path)
+    legacy = time.perf_counter() - start
+  finally:
+    shutil.rmtree(workdir)
+
+  # Bundles en memoria con su hash de contenido
+  start = time.perf_counter()
+  bundles = render_all(topology)
+  digests = {name: bundle.digest for name, bundle in bundles.items()}
+  in_memory = time.perf_counter() - start
+
+  # Segundo arranque: se vuelve a generar todo y solo se aplicaría lo que cambia
+  start = time.perf_counter()
+  changed = [name for name, bundle in render_all(topology).items() if bundle.digest != digests[name]]
+  rerender = time.perf_counter() - start
+
+  print(f"Nodos: {len(nodes)}")
+  print(f"ficheros temporales: {legacy * 1000:8.2f} ms ({legacy / len(nodes) * 1e6:7.1f} us/nodo)")
+  print(f"bundles en memoria:  {in_memory * 1000:8.2f} ms ({in_memory / len(nodes) * 1e6:7.1f} us/nodo)")
+  print(f"nueva generación:    {rerender * 1000:8.2f} ms, {len(changed)} nodos cambiados")
+
+
+if __name__ == "__main__":
+  main()
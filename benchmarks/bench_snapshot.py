@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark de las instantáneas de lib_snapshot.
+Crea N overlays de prueba (la mitad idénticos, como los de servidores recién creados),
+los guarda en una instantánea, los modifica y los restaura todos en paralelo. Con un
+sistema de ficheros que admite reflink (btrfs, XFS) la restauración no copia datos.
+
+Uso: python3 benchmarks/bench_snapshot.py [número_de_vms] [MiB_por_overlay] [hilos]
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib_snapshot import SnapshotStore
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+  limit = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+  logging.basicConfig(level=logging.WARNING)
+
+  workdir = tempfile.mkdtemp(prefix="bench_snapshot_")
+  try:
+    images = {}
+    shared = os.urandom(size * 2**20)
+    for i in range(count):
+      images[f"vm{i}"] = os.path.join(workdir, f"vm{i}.qcow2")
+      with open(images[f"vm{i}"], "wb") as f:
+        f.write(shared if i % 2 else os.urandom(size * 2**20))
+
+    store = SnapshotStore(os.path.join(workdir, "snapshots"))
+    vms = {name: {"image": path} for name, path in images.items()}
+    with store:
+      start = time.perf_counter()
+      store.capture("bench", vms, limit)
+      captured = time.perf_counter() - start
+
+    for path in images.values():
+      with open(path, "r+b") as f:
+        f.write(b"sucio")
+
+    with store:
+      start = time.perf_counter()
+      store.restore("bench", images, limit)
+      restored = time.perf_counter() - start
+      start = time.perf_counter()
+      store.delete("bench")
+      removed, freed = store.gc()
+      collected = time.perf_counter() - start
+
+    objects = len(removed) // 2
+    print(f"VMs: {count}, {size} MiB por overlay, {limit} hilos")
+    print(f"instantánea:  {captured * 1000:9.2f} ms ({objects} objetos para {count} overlays)")
+    print(f"restauración: {restored * 1000:9.2f} ms ({restored / count * 1000:.2f} ms/VM)")
+    print(f"limpieza:     {collected * 1000:9.2f} ms ({freed / 2**20:.0f} MiB liberados)")
+  finally:
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+  main()
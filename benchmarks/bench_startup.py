@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark del arranque de manage-p2.py.
+Ejecuta varias órdenes ligeras como procesos nuevos en un directorio de prueba (hipervisor
+simulado, modo --dry-run) y mide el tiempo de cada una, incluido el arranque del intérprete.
+Con '-X importtime' comprueba además que ninguna carga los módulos pesados que no usa
+(lxml para 'stop', lxml y asyncio para 'status'). Termina con código 1 si alguna orden
+supera el límite o carga un módulo de más, para detectar regresiones.
+
+Uso: python3 benchmarks/bench_startup.py [repeticiones] [límite_ms_status]
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SCRIPT = os.path.join(ROOT, "manage-p2.py")
+
+# Orden y módulos que no debe importar
+COMMANDS = [
+  (["--help"], ("lxml", "asyncio")),
+  (["status"], ("lxml", "asyncio")),
+  (["status", "--json"], ("lxml", "asyncio")),
+  (["--dry-run", "stop"], ("lxml",)),
+]
+
+
+def run(workdir, args, importtime=False):
+  cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + [SCRIPT] + args
+  start = time.perf_counter()
+  result = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True)
+  elapsed = time.perf_counter() - start
+  if result.returncode != 0:
+    raise RuntimeError(f"'{' '.join(args)}' terminó con código {result.returncode}: {result.stderr}")
+  return elapsed, result.stderr
+
+
+def interpreter(workdir):
+  # Arranque del intérprete sin nada más, para separar lo que cuesta manage-p2.py
+  start = time.perf_counter()
+  subprocess.run([sys.executable, "-c", "pass"], cwd=workdir, check=True)
+  return time.perf_counter() - start
+
+
+def imported(stderr):
+  # Líneas de -X importtime: "import time: propio | acumulado | módulo"
+  modules = set()
+  for line in stderr.splitlines():
+    if line.startswith("import time:") and "|" in line:
+      modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+  return modules
+
+
+def main():
+  repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  limit = float(sys.argv[2]) if len(sys.argv) > 2 else 250
+
+  workdir = tempfile.mkdtemp(prefix="bench_startup_")
+  try:
+    with open(os.path.join(workdir, "manage-p2.json"), "w") as f:
+      json.dump({"number_of_servers": 3, "hypervisor": "fake", "debug": False}, f)
+    baseline = statistics.median(interpreter(workdir) for _ in range(repeat))
+
+    failed = False
+    print(f"Repeticiones: {repeat}, intérprete vacío: {baseline * 1000:.1f} ms")
+    for args, forbidden in COMMANDS:
+      elapsed = statistics.median(run(workdir, args)[0] for _ in range(repeat))
+      extra = sorted(imported(run(workdir, args, importtime=True)[1]) & set(forbidden))
+      line = f"{' '.join(args):20s} {elapsed * 1000:8.1f} ms ({(elapsed - baseline) * 1000:+.1f} ms)"
+      if extra:
+        line += f"  IMPORTA {', '.join(extra)}"
+        failed = True
+      if args[0] == "status" and elapsed * 1000 > limit:
+        line += f"  SUPERA {limit:.0f} ms"
+        failed = True
+      print(line)
+  finally:
+    shutil.rmtree(workdir)
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+  main()
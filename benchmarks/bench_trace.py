@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark del coste de la instrumentación de lib_trace.
+Mide N spans anidados (paso y comando) con la traza desactivada y activada,
+frente al mismo bucle sin instrumentar.
+
+Uso: python3 benchmarks/bench_trace.py [número_de_spans]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib_trace as trace
+
+ARGV = ["sudo", "virsh", "start", "s1"]
+
+
+def bare(count):
+  start = time.perf_counter()
+  for _ in range(count):
+    pass
+  return time.perf_counter() - start
+
+
+def traced(count):
+  start = time.perf_counter()
+  for _ in range(count):
+    with trace.span("start", "s1"):
+      with trace.command(ARGV):
+        pass
+  return time.perf_counter() - start
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  base = bare(count)
+
+  trace.disable()
+  disabled = traced(count)
+
+  trace.enable()
+  enabled = traced(count)
+  trace.disable()
+
+  per_pair = lambda elapsed: (elapsed - base) / count * 1e9
+  print(f"Spans (paso + comando): {count}")
+  print(f"sin instrumentar:   {base * 1000:8.2f} ms")
+  print(f"traza desactivada:  {disabled * 1000:8.2f} ms ({per_pair(disabled):7.0f} ns por paso)")
+  print(f"traza activada:     {enabled * 1000:8.2f} ms ({per_pair(enabled):7.0f} ns por paso, {len(trace.events())} eventos)")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark de generación de XML de dominios.
+Genera el XML de N VMs con la plantilla en caché y lo compara con el método
+anterior (copiar la plantilla y volver a analizarla desde disco para cada VM).
+
+Uso: python3 benchmarks/bench_xml.py [número_de_vms] [plantilla.xml]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lxml import etree
+from lib_topology import Topology
+from lib_xml import DomainTemplate, to_string
+
+# Plantilla mínima para poder ejecutar el benchmark sin /lab/cdps
+SAMPLE_TEMPLATE = """<domain type="kvm">
+  <name>XXX</name>
+  <memory unit="MiB">512</memory>
+  <vcpu>1</vcpu>
+  <os><type arch="x86_64">hvm</type></os>
+  <devices>
+    <disk type="file" device="disk">
+      <driver name="qemu" type="qcow2"/>
+      <source file="XXX"/>
+      <target dev="vda" bus="virtio"/>
+    </disk>
+    <interface type="bridge">
+      <source bridge="XXX"/>
+      <model type="virtio"/>
+    </interface>
+    <serial type="pty"><target port="0"/></serial>
+    <console type="pty"><target type="serial" port="0"/></console>
+  </devices>
+</domain>
+"""
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  workdir = tempfile.mkdtemp(prefix="bench_xml_")
+  try:
+    if len(sys.argv) > 2:
+      template_path = os.path.abspath(sys.argv[2])
+    else:
+      template_path = os.path.join(workdir, "plantilla.xml")
+      with open(template_path, "w") as f:
+        f.write(SAMPLE_TEMPLATE)
+
+    config = {"number_of_servers": count, "networks": {"lan1": "10.1.1.0/24", "lan2": "10.2.0.0/16"}}
+    nodes = list(Topology.from_config(config).nodes.values())
+
+    # Método anterior: copia en disco y análisis del fichero por cada VM
+    start = time.perf_counter()
+    for node in nodes:
+      xml_name = os.path.join(workdir, f"{node.name}.xml")
+      shutil.copy(template_path, xml_name)
+      tree = etree.parse(xml_name)
+      root = tree.getroot()
+      root.find("name").text = node.name
+      root.find("./devices/disk/source").set("file", f"{node.name}.qcow2")
+      root.find("./devices/interface/source").set("bridge", node.networks[0].bridge)
+      tree.write(xml_name, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+    legacy = time.perf_counter() - start
+
+    # Plantilla en caché y copias en memoria
+    start = time.perf_counter()
+    for node in nodes:
+      to_string(DomainTemplate.load(template_path).render(node, f"{node.name}.qcow2"))
+    cached = time.perf_counter() - start
+
+    print(f"VMs: {len(nodes)}")
+    print(f"copia + parse por VM: {legacy * 1000:8.2f} ms ({legacy / len(nodes) * 1e6:7.1f} us/VM)")
+    print(f"plantilla en caché:   {cached * 1000:8.2f} ms ({cached / len(nodes) * 1e6:7.1f} us/VM)")
+  finally:
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+  main()
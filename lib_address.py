@@ -0,0 +1,220 @@
+import bisect
+import fcntl
+import ipaddress
+import json
+import logging
+import os
+
+from lib_state import atomic_write_json
+
+log = logging.getLogger('manage-p2')
+
+# Rango del que se reparten los bloques de los escenarios y tamaño de cada bloque y red
+DEFAULT_POOL = "10.0.0.0/8"
+DEFAULT_BLOCK_PREFIX = 20
+DEFAULT_NETWORK_PREFIX = 24
+# Propietario en el registro de los bloques del escenario sin nombre
+DEFAULT_SCENARIO = "default"
+
+
+class AddressError(ValueError):
+  pass
+
+
+class BlockAllocator:
+  """
+  Reparto de bloques de direcciones sin solapamientos. Los bloques se guardan ordenados
+  por su primera dirección, de modo que comprobar un solapamiento o buscar el propietario
+  de una dirección cuesta O(log n). Para cada tamaño de bloque se recuerda hasta dónde
+  está todo ocupado, de modo que cada reparto continúa donde acabó el anterior.
+  """
+  def __init__(self, pool=None):
+    self.pool = ipaddress.ip_network(pool) if pool else None
+    self._starts = []
+    self._blocks = []  # (primera, última, propietario, red), en el orden de _starts
+    self._hints = {}  # tamaño de bloque -> primera posición que puede estar libre
+    self.owners = {}
+
+  def _overlap(self, first, last):
+    # Los bloques no se solapan entre sí: basta mirar el último que empieza antes de 'last'
+    i = bisect.bisect_right(self._starts, last)
+    if i and self._blocks[i - 1][1] >= first:
+      return self._blocks[i - 1]
+    return None
+
+  def _insert(self, owner, network):
+    first, last = int(network.network_address), int(network.broadcast_address)
+    i = bisect.bisect_left(self._starts, first)
+    self._starts.insert(i, first)
+    self._blocks.insert(i, (first, last, owner, network))
+    self.owners.setdefault(owner, []).append(network)
+    return network
+
+  def reserve(self, owner, network):
+    """
+    Reserva una red concreta para 'owner'. Lanza AddressError si se solapa con la de otro.
+    La red puede estar fuera del rango: el rango solo limita los bloques que se reparten.
+    """
+    network = ipaddress.ip_network(network)
+    if network in self.owners.get(owner, []):
+      return network
+    hit = self._overlap(int(network.network_address), int(network.broadcast_address))
+    if hit is not None:
+      raise AddressError(f"La red {network} de {owner} se solapa con {hit[3]} de {hit[2]}")
+    return self._insert(owner, network)
+
+  def allocate(self, owner, prefixlen):
+    """
+    Devuelve el bloque /prefixlen de 'owner': el que ya tenía o el primer hueco libre del rango.
+    """
+    for network in self.owners.get(owner, []):
+      if network.prefixlen == prefixlen:
+        return network
+    if self.pool is None:
+      raise AddressError("No hay rango del que repartir direcciones")
+    if not self.pool.prefixlen <= prefixlen <= self.pool.max_prefixlen:
+      raise AddressError(f"No se puede repartir un bloque /{prefixlen} de {self.pool}")
+
+    size = 2 ** (self.pool.max_prefixlen - prefixlen)
+    end = int(self.pool.broadcast_address)
+    candidate = max(self._hints.get(size, 0), int(self.pool.network_address))
+    while candidate + size - 1 <= end:
+      hit = self._overlap(candidate, candidate + size - 1)
+      if hit is None:
+        network = ipaddress.ip_network((candidate, prefixlen))
+        self._hints[size] = candidate + size
+        log.debug(f"Bloque {network} asignado a {owner}")
+        return self._insert(owner, network)
+      # Siguiente posición alineada tras el bloque ocupado
+      candidate = -(-(hit[1] + 1) // size) * size
+    raise AddressError(f"No quedan bloques /{prefixlen} libres en {self.pool}")
+
+  def release(self, owner):
+    networks = self.owners.pop(owner, [])
+    for network in networks:
+      first = int(network.network_address)
+      i = bisect.bisect_left(self._starts, first)
+      del self._starts[i], self._blocks[i]
+      # El hueco que queda vuelve a estar disponible para los siguientes repartos
+      for size, hint in self._hints.items():
+        self._hints[size] = min(hint, first - first % size)
+    return networks
+
+  def owner_of(self, address):
+    value = int(ipaddress.ip_address(address))
+    hit = self._overlap(value, value)
+    return hit[2] if hit else None
+
+  def to_dict(self):
+    return {owner: [str(n) for n in networks] for owner, networks in sorted(self.owners.items())}
+
+  @classmethod
+  def from_dict(cls, data, pool=None):
+    allocator = cls(pool)
+    for owner, networks in data.items():
+      for network in networks:
+        # Lo ya repartido se respeta aunque el rango haya cambiado
+        allocator._insert(owner, ipaddress.ip_network(network))
+    return allocator
+
+
+class HostAllocator:
+  """
+  Reparto de las direcciones de una subred entre nodos. Cada dirección tiene un solo
+  propietario; las búsquedas por dirección o por propietario son accesos a diccionario
+  y cada reparto continúa donde acabó el anterior con el mismo punto de partida.
+  """
+  def __init__(self, subnet):
+    self.subnet = ipaddress.ip_network(subnet)
+    self._owners = {}
+    self._positions = {}
+    self._next = {}
+
+  def _address(self, n):
+    return self.subnet.network_address + n
+
+  def reserve(self, owner, n):
+    # n-ésima dirección de la subred (1 = primera dirección utilizable)
+    if not 0 < n < self.subnet.num_addresses - 1:
+      raise AddressError(f"La red {self.subnet} no tiene la dirección número {n}")
+    if self._owners.get(n, owner) != owner:
+      raise AddressError(f"La dirección {self._address(n)} ya es de {self._owners[n]}")
+    if self._positions.get(owner, n) != n:
+      raise AddressError(f"{owner} ya tiene la dirección {self._address(self._positions[owner])}")
+    self._owners[n] = owner
+    self._positions[owner] = n
+    return self._address(n)
+
+  def allocate(self, owner, start=1):
+    """
+    Devuelve la dirección de 'owner': la que ya tenía o la primera libre a partir de 'start'.
+    """
+    if owner in self._positions:
+      return self._address(self._positions[owner])
+    n = self._next.get(start, start)
+    while n in self._owners:
+      n += 1
+    if n >= self.subnet.num_addresses - 1:
+      raise AddressError(f"No quedan direcciones libres en {self.subnet}")
+    self._next[start] = n + 1
+    return self.reserve(owner, n)
+
+  def release(self, owner):
+    n = self._positions.pop(owner, None)
+    if n is None:
+      return
+    del self._owners[n]
+    for start, next_free in self._next.items():
+      if start <= n < next_free:
+        self._next[start] = n
+
+  def owner_of(self, address):
+    return self._owners.get(int(ipaddress.ip_address(address)) - int(self.subnet.network_address))
+
+  def address_of(self, owner):
+    n = self._positions.get(owner)
+    return self._address(n) if n is not None else None
+
+
+class Registry:
+  """
+  Bloques de direcciones de todos los escenarios del host, guardados en un fichero JSON
+  compartido. Se usa como contexto: el fichero queda bloqueado mientras se consulta o se
+  reparte un bloque, y los cambios se guardan de forma atómica al salir.
+  """
+  def __init__(self, path, pool=DEFAULT_POOL):
+    self.path = path
+    self.pool = pool
+    self.allocator = None
+    self._lock = None
+    self._saved = None
+
+  def __enter__(self):
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+    self._lock = open(f"{self.path}.lock", "a")
+    fcntl.flock(self._lock, fcntl.LOCK_EX)
+    self.allocator = self.read()
+    self._saved = self.allocator.to_dict()
+    return self.allocator
+
+  def read(self):
+    """
+    Devuelve los bloques guardados sin bloquear el fichero. Lo que se reparta en ellos no
+    se guarda: sirve a las órdenes que solo consultan el escenario.
+    """
+    data = {}
+    if os.path.exists(self.path):
+      with open(self.path) as f:
+        data = json.load(f)
+    return BlockAllocator.from_dict(data.get("blocks", {}), self.pool)
+
+  def __exit__(self, exc_type, exc, tb):
+    try:
+      blocks = self.allocator.to_dict()
+      if exc_type is None and blocks != self._saved:
+        atomic_write_json(self.path, {"pool": str(self.allocator.pool), "blocks": blocks})
+        log.debug(f"Bloques de direcciones guardados en {self.path}")
+    finally:
+      fcntl.flock(self._lock, fcntl.LOCK_UN)
+      self._lock.close()
+    return False
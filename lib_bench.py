@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+
+log = logging.getLogger('manage-p2')
+
+# Cada servidor devuelve "<h1>Server sN</h1>" en su index.html (o "t1-sN" con escenario)
+BACKEND_RE = re.compile(rb"Server ([^<\s]+)")
+
+
+class Stats:
+  def __init__(self):
+    self.latencies = []
+    self.backends = {}
+    self.errors = 0
+    self.status = {}
+
+  def record(self, latency, status, body):
+    self.latencies.append(latency)
+    self.status[status] = self.status.get(status, 0) + 1
+    match = BACKEND_RE.search(body)
+    backend = match.group(1).decode() if match else "desconocido"
+    self.backends[backend] = self.backends.get(backend, 0) + 1
+
+
+def percentile(sorted_values, p):
+  # Percentil por rango más cercano
+  if not sorted_values:
+    return None
+  rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+  return sorted_values[rank - 1]
+
+
+async def read_response(reader):
+  """
+  Lee una respuesta HTTP/1.1 completa. Devuelve (estado, cuerpo, mantener_conexión).
+  """
+  status_line = await reader.readline()
+  if not status_line:
+    raise ConnectionError("Conexión cerrada por el servidor")
+  status = int(status_line.split()[1])
+
+  headers = {}
+  while True:
+    line = await reader.readline()
+    if line in (b"\r\n", b"\n", b""):
+      break
+    key, _, value = line.decode("latin-1").partition(":")
+    headers[key.strip().lower()] = value.strip()
+
+  if headers.get("transfer-encoding", "").lower() == "chunked":
+    body = b""
+    while True:
+      size = int((await reader.readline()).split(b";")[0], 16)
+      if size == 0:
+        await reader.readline()
+        break
+      body += await reader.readexactly(size)
+      await reader.readline()
+  elif "content-length" in headers:
+    body = await reader.readexactly(int(headers["content-length"]))
+  else:
+    body = await reader.read()
+    return status, body, False
+
+  keep_alive = headers.get("connection", "").lower() != "close"
+  return status, body, keep_alive
+
+
+async def worker(host, port, path, stats, stop_at, budget):
+  request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n").encode()
+  reader = writer = None
+  while time.monotonic() < stop_at and budget.take():
+    try:
+      if writer is None:
+        reader, writer = await asyncio.open_connection(host, port)
+      start = time.perf_counter()
+      writer.write(request)
+      await writer.drain()
+      status, body, keep_alive = await read_response(reader)
+      stats.record(time.perf_counter() - start, status, body)
+      if not keep_alive:
+        writer.close()
+        writer = None
+    except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+      stats.errors += 1
+      if writer is not None:
+        writer.close()
+      writer = None
+      await asyncio.sleep(0.01)
+  if writer is not None:
+    writer.close()
+
+
+class Budget:
+  # Número máximo de peticiones compartido entre todas las conexiones (0 = sin límite)
+  def __init__(self, total):
+    self.remaining = total if total > 0 else None
+
+  def take(self):
+    if self.remaining is None:
+      return True
+    if self.remaining <= 0:
+      return False
+    self.remaining -= 1
+    return True
+
+
+async def run_load(host, port=80, path="/", connections=16, duration=10.0, requests=0):
+  """
+  Genera carga HTTP con 'connections' conexiones keep-alive concurrentes durante 'duration'
+  segundos o hasta completar 'requests' peticiones. Devuelve el resumen de resultados.
+  """
+  stats = Stats()
+  budget = Budget(requests)
+  start = time.perf_counter()
+  stop_at = time.monotonic() + duration
+  await asyncio.gather(*(worker(host, port, path, stats, stop_at, budget) for _ in range(connections)))
+  elapsed = time.perf_counter() - start
+  return summarize(stats, elapsed, host, port, connections)
+
+
+def summarize(stats, elapsed, host, port, connections):
+  latencies = sorted(stats.latencies)
+  ms = lambda v: round(v * 1000, 3) if v is not None else None
+  return {
+    "target": f"{host}:{port}",
+    "connections": connections,
+    "duration_s": round(elapsed, 3),
+    "requests": len(latencies),
+    "errors": stats.errors,
+    "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0,
+    "latency_ms": {
+      "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+      "p50": ms(percentile(latencies, 50)),
+      "p95": ms(percentile(latencies, 95)),
+      "p99": ms(percentile(latencies, 99)),
+      "max": ms(latencies[-1]) if latencies else None,
+    },
+    "status": {str(k): v for k, v in sorted(stats.status.items())},
+    "backends": dict(sorted(stats.backends.items())),
+  }
+
+
+def save_result(result, directory):
+  """
+  Guarda el resultado en <directory>/<fecha>.json y lo compara con la ejecución anterior.
+  Devuelve la ruta del fichero creado.
+  """
+  os.makedirs(directory, exist_ok=True)
+  previous = sorted(f for f in os.listdir(directory) if f.endswith(".json"))
+  path = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".json")
+  result = dict(result, timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+  with open(path, "w") as f:
+    json.dump(result, f, indent=4)
+
+  if previous:
+    with open(os.path.join(directory, previous[-1])) as f:
+      last = json.load(f)
+    log.info(f"Comparación con {previous[-1]}: "
+             f"{last.get('throughput_rps')} -> {result['throughput_rps']} peticiones/s, "
+             f"p99 {last.get('latency_ms', {}).get('p99')} -> {result['latency_ms']['p99']} ms")
+  return path
+
+
+def report(result):
+  lat = result["latency_ms"]
+  log.info(f"{result['requests']} peticiones a {result['target']} en {result['duration_s']} s "
+           f"({result['throughput_rps']} peticiones/s, {result['errors']} errores)")
+  log.info(f"Latencia (ms): p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} máx={lat['max']}")
+  total = sum(result["backends"].values()) or 1
+  for backend, count in result["backends"].items():
+    log.info(f"  {backend}: {count} peticiones ({100 * count / total:.1f}%)")
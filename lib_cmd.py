@@ -0,0 +1,248 @@
+import asyncio
+import collections
+import json
+import logging
+import re
+import subprocess
+import threading
+import time
+
+import lib_trace as trace
+
+log = logging.getLogger('manage-p2')
+
+# Modos de ejecución: 'run' ejecuta los comandos, 'dry-run' solo los registra en el log,
+# 'record' los ejecuta y guarda su resultado, 'replay' devuelve los resultados grabados
+MODES = ("run", "dry-run", "record", "replay")
+
+# Tiempo máximo por programa (s); el resto usa DEFAULT_TIMEOUT
+DEFAULT_TIMEOUT = 120
+TIMEOUTS = {
+  "cp": 1800,
+  "qemu-img": 300,
+  "guestfish": 600,
+  "virsh": 60,
+  "ovs-vsctl": 30,
+  "ip": 30,
+  "ssh": 60,
+}
+
+# Errores pasajeros de libvirt y libguestfs tras los que merece la pena reintentar
+TRANSIENT_RE = re.compile(
+  r"cannot acquire state change lock|Timed out during operation|Failed to connect socket|"
+  r"Resource temporarily unavailable|Device or resource busy|Connection reset by peer|"
+  r"failed to connect to the hypervisor|guestfs_launch failed|could not create appliance",
+  re.IGNORECASE)
+
+KILL_GRACE = 5.0
+MAX_BACKOFF = 10.0
+
+
+class CommandError(subprocess.CalledProcessError):
+  """
+  Fallo de un comando externo. Hereda de CalledProcessError para que el código que ya
+  captura los errores de subprocess siga funcionando.
+  """
+  def __str__(self):
+    detail = (self.stderr or "").strip().splitlines()
+    suffix = f": {detail[-1]}" if detail else ""
+    return f"'{' '.join(str(a) for a in self.cmd)}' ha fallado con código {self.returncode}{suffix}"
+
+
+class CommandTimeout(CommandError):
+  def __init__(self, cmd, timeout, output="", stderr=""):
+    super().__init__(-1, cmd, output, stderr)
+    self.timeout = timeout
+
+  def __str__(self):
+    return f"'{' '.join(str(a) for a in self.cmd)}' no ha terminado en {self.timeout} s"
+
+
+class Result:
+  def __init__(self, argv, returncode, stdout="", stderr="", elapsed=0.0, attempts=1):
+    self.argv = argv
+    self.returncode = returncode
+    self.stdout = stdout
+    self.stderr = stderr
+    self.elapsed = elapsed
+    self.attempts = attempts
+
+  def check(self):
+    if self.returncode != 0:
+      raise CommandError(self.returncode, self.argv, self.stdout, self.stderr)
+    return self
+
+
+def program(argv):
+  # Nombre del programa sin 'sudo' ('sudo virsh start s1' -> 'virsh')
+  args = [str(a) for a in argv]
+  if args and args[0] == "sudo" and len(args) > 1:
+    args = args[1:]
+  return args[0].rsplit("/", 1)[-1] if args else ""
+
+
+class Runner:
+  """
+  Punto único de ejecución de comandos externos: tiempo máximo por comando, reintentos
+  con espera exponencial ante errores pasajeros, captura de stdout/stderr, medición con
+  lib_trace y modos de simulación ('dry-run') y grabación/reproducción ('record'/'replay').
+  """
+  def __init__(self, mode="run", timeouts=None, retries=2, backoff=0.5, recording=None, delay=0.0):
+    if mode not in MODES:
+      raise ValueError(f"Modo de ejecución no válido: {mode} (válidos: {', '.join(MODES)})")
+    if mode in ("record", "replay") and not recording:
+      raise ValueError(f"El modo '{mode}' necesita un fichero de grabación")
+    self.mode = mode
+    self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+    self.retries = max(0, int(retries))
+    self.backoff = backoff
+    self.recording = recording
+    # Duración simulada de cada comando en 'dry-run' y 'replay' (para benchmarks)
+    self.delay = delay
+    self._lock = threading.Lock()
+    self._replay = None
+    if mode == "replay":
+      self._replay = collections.defaultdict(collections.deque)
+      with open(recording) as f:
+        for line in f:
+          entry = json.loads(line)
+          self._replay[self._key(entry["argv"], entry.get("input"))].append(entry)
+
+  @property
+  def simulated(self):
+    # En los modos simulados los comandos no tienen efecto: no se crean ficheros ni dominios
+    return self.mode in ("dry-run", "replay")
+
+  def timeout_for(self, argv):
+    return self.timeouts.get(program(argv), self.timeouts.get("default", DEFAULT_TIMEOUT))
+
+  @staticmethod
+  def _key(argv, input):
+    return json.dumps([[str(a) for a in argv], input])
+
+  async def run_async(self, argv, input=None, timeout=None, retries=None, check=True):
+    """
+    Ejecuta un comando y devuelve su Result. Con 'check' un código distinto de 0 lanza
+    CommandError; los errores pasajeros se reintentan hasta 'retries' veces.
+    """
+    argv = [str(a) for a in argv]
+    timeout = timeout or self.timeout_for(argv)
+    retries = self.retries if retries is None else retries
+    start = time.perf_counter()
+
+    attempt = 0
+    while True:
+      attempt += 1
+      with trace.command(argv) as span:
+        result = await self._execute(argv, input, timeout)
+        span.set(returncode=result.returncode, attempt=attempt)
+      result.attempts = attempt
+      result.elapsed = time.perf_counter() - start
+      if result.returncode == 0 or attempt > retries or not TRANSIENT_RE.search(result.stderr or ""):
+        break
+      delay = min(self.backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+      log.warning(f"'{' '.join(argv)}' ha fallado por un error pasajero; reintento {attempt}/{retries} en {delay:.1f} s")
+      await asyncio.sleep(delay)
+
+    if result.returncode != 0:
+      log.debug(f"'{' '.join(argv)}' terminó con código {result.returncode}: {(result.stderr or '').strip()}")
+    if check:
+      result.check()
+    return result
+
+  async def _execute(self, argv, input, timeout):
+    if self.simulated:
+      return await self._simulate(argv, input)
+
+    process = await asyncio.create_subprocess_exec(
+      *argv,
+      stdin=subprocess.PIPE if input is not None else None,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+      stdout, stderr = await asyncio.wait_for(
+        process.communicate(input.encode() if input is not None else None), timeout)
+    except asyncio.TimeoutError:
+      await self._stop(process)
+      log.error(f"'{' '.join(argv)}' cancelado tras {timeout} s")
+      raise CommandTimeout(argv, timeout)
+
+    result = Result(argv, process.returncode,
+                    stdout.decode(errors="replace"), stderr.decode(errors="replace"))
+    if self.mode == "record":
+      self._record(argv, input, result)
+    return result
+
+  async def _stop(self, process):
+    # SIGTERM primero: 'sudo' lo reenvía al comando, mientras que SIGKILL solo mata a 'sudo'
+    try:
+      process.terminate()
+      await asyncio.wait_for(process.wait(), KILL_GRACE)
+    except asyncio.TimeoutError:
+      process.kill()
+      await process.wait()
+    except ProcessLookupError:
+      pass
+
+  async def _simulate(self, argv, input):
+    if self.delay:
+      await asyncio.sleep(self.delay)
+    if self.mode == "dry-run":
+      log.info(f"[dry-run] {' '.join(argv)}")
+      return Result(argv, 0)
+    with self._lock:
+      queue = self._replay.get(self._key(argv, input))
+      entry = queue.popleft() if queue else None
+    if entry is None:
+      return Result(argv, 127, stderr=f"Comando no grabado en {self.recording}")
+    return Result(argv, entry["returncode"], entry.get("stdout", ""), entry.get("stderr", ""))
+
+  def _record(self, argv, input, result):
+    entry = {"argv": argv, "input": input, "returncode": result.returncode,
+             "stdout": result.stdout, "stderr": result.stderr}
+    with self._lock:
+      with open(self.recording, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+  def run(self, argv, input=None, timeout=None, retries=None, check=True):
+    # Versión síncrona para el código que se ejecuta en los hilos del ejecutor
+    return asyncio.run(self.run_async(argv, input, timeout, retries, check))
+
+  async def run_many_async(self, commands, limit=None, check=True):
+    semaphore = asyncio.Semaphore(limit or len(commands) or 1)
+
+    async def one(argv):
+      async with semaphore:
+        return await self.run_async(argv, check=check)
+
+    return await asyncio.gather(*(one(argv) for argv in commands))
+
+  def run_many(self, commands, limit=None, check=True):
+    """
+    Ejecuta varios comandos a la vez (como mucho 'limit' simultáneos).
+    Devuelve sus Result en el mismo orden.
+    """
+    return asyncio.run(self.run_many_async(list(commands), limit, check))
+
+
+_runner = Runner()
+
+
+def get_runner():
+  return _runner
+
+
+def set_runner(runner):
+  global _runner
+  _runner = runner
+  return runner
+
+
+def run(argv, input=None, timeout=None, retries=None, check=True):
+  """
+  Ejecuta un comando con el runner configurado. Devuelve su Result.
+  """
+  return _runner.run(argv, input, timeout, retries, check)
+
+
+def run_many(commands, limit=None, check=True):
+  return _runner.run_many(commands, limit, check)
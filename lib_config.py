@@ -0,0 +1,130 @@
+import hashlib
+import json
+
+from lib_state import atomic_write_json
+
+CONFIG_FILE = "manage-p2.json"
+
+INT = (int,)
+NUMBER = (int, float)
+TEXT = (str,)
+
+# Opciones conocidas: tipos admitidos y valor mínimo (None si no se comprueba). Los valores
+# de una lista cerrada (hypervisor, consoles, haproxy...) los comprueba el módulo que los usa.
+OPTIONS = {
+  "debug": ((bool,), None),
+  "headless": ((bool,), None),
+  "xml_files": ((bool,), None),
+  "scenario": (TEXT, None),
+  "number_of_servers": (INT, 0),
+  "number_of_balancers": (INT, 1),
+  "max_workers": (INT, 1),
+  "hypervisor": (TEXT, None),
+  "libvirt_uri": (TEXT, None),
+  "base_image_placement": ((list,), None),
+  "networks": ((dict,), None),
+  "client_network": (TEXT, None),
+  "server_networks": ((list,), None),
+  "address_pool": (TEXT, None),
+  "address_registry": (TEXT, None),
+  "address_block": (INT, 1),
+  "network_prefix": (INT, 1),
+  "haproxy": ((dict,), None),
+  "bench": ((dict,), None),
+  "ready_timeout": (NUMBER, 0),
+  "ready_check": (TEXT, None),
+  "stop_grace": (NUMBER, 0),
+  "command_timeouts": ((dict,), None),
+  "command_retries": (INT, 0),
+  "dry_run_delay": (NUMBER, 0),
+  "consoles": (TEXT, None),
+  "console_dir": (TEXT, None),
+  "console_max_bytes": (INT, 1),
+  "console_backups": (INT, 0),
+  "trace_dir": (TEXT, None),
+  "snapshot_dir": (TEXT, None),
+  "metrics_address": (TEXT, None),
+  "metrics_port": (INT, 1),
+  "metrics_interval": (NUMBER, 0),
+  "metrics_timeout": (NUMBER, 0),
+}
+
+
+class ConfigError(ValueError):
+  pass
+
+
+def check_option(key, value):
+  """
+  Comprueba el tipo y el mínimo de una opción conocida. Lanza ConfigError si no es válida.
+  """
+  if key not in OPTIONS or value is None:
+    return
+  types, minimum = OPTIONS[key]
+  # En Python un bool también es un int: solo se admite donde se pide un bool
+  if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+    names = " o ".join(t.__name__ for t in types)
+    raise ConfigError(f"La opción {key} debe ser {names}: {value!r}")
+  if minimum is not None and value < minimum:
+    raise ConfigError(f"La opción {key} debe ser al menos {minimum}: {value}")
+
+
+class Config:
+  """
+  Configuración del escenario (manage-p2.json). Se lee y se comprueba una sola vez por
+  orden; las opciones se consultan después en memoria sin volver a abrir el fichero.
+  """
+  def __init__(self, data=None, path=CONFIG_FILE, found=True):
+    self.path = path
+    self.data = dict(data or {})
+    self.found = found
+
+  @classmethod
+  def load(cls, path=CONFIG_FILE):
+    """
+    Lee y comprueba la configuración. Sin fichero se usa la configuración por defecto.
+    Lanza ConfigError si el fichero no es JSON válido o alguna opción no lo es.
+    """
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      return cls({}, path, found=False)
+    except ValueError as e:
+      raise ConfigError(f"{path} no es un JSON válido: {e}") from e
+    if not isinstance(data, dict):
+      raise ConfigError(f"{path} debe contener un objeto JSON con las opciones")
+    config = cls(data, path)
+    config.validate()
+    return config
+
+  def validate(self):
+    for key, value in self.data.items():
+      check_option(key, value)
+
+  def unknown(self):
+    # Opciones que no usa ninguna orden (probablemente mal escritas)
+    return sorted(key for key in self.data if key not in OPTIONS)
+
+  def get(self, key, default=None):
+    return self.data.get(key, default)
+
+  def override(self, key, value):
+    """
+    Cambia una opción solo en memoria, para esta orden, sin guardar el fichero.
+    """
+    check_option(key, value)
+    self.data[key] = value
+
+  def set(self, key, value):
+    """
+    Cambia una opción y guarda el fichero de forma atómica.
+    """
+    check_option(key, value)
+    self.data[key] = value
+    atomic_write_json(self.path, self.data)
+    self.found = True
+
+  def digest(self):
+    # Hash de la configuración: una orden interrumpida solo se reanuda si no ha cambiado
+    return hashlib.sha256(json.dumps(self.data, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,294 @@
+import asyncio
+import codecs
+import collections
+import logging
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+
+log = logging.getLogger('manage-p2')
+
+# Formas de mostrar las consolas serie de las VMs
+CONSOLE_MODES = ("xterm", "log", "none")
+DEFAULT_DIR = "consoles"
+READ_SIZE = 4096
+STOP_GRACE = 2.0
+
+# Límites de cada consola: tamaño de cada fichero antes de rotarlo, ficheros antiguos que
+# se conservan, líneas recientes en memoria y longitud máxima de una línea
+MAX_BYTES = 1024 * 1024
+BACKUPS = 3
+TAIL_LINES = 200
+MAX_LINE = 4096
+
+# Marcas de progreso del arranque que se buscan en la salida de cada consola
+MARKERS = {
+  "login": re.compile(r"\blogin:\s*$"),
+  "apache": re.compile(r"(Started|Starting) .*(Apache|apache2)|apache2.*(started|\bok\b)", re.IGNORECASE),
+  "haproxy": re.compile(r"(Started|Starting) .*HAProxy|haproxy.*(started|\bok\b)", re.IGNORECASE),
+}
+# Marcas que indican que cada rol ha terminado de arrancar
+ROLE_MARKERS = {
+  "server": ("apache", "login"),
+  "lb": ("haproxy", "login"),
+  "client": ("login",),
+}
+
+# Secuencias de escape del terminal, que no se guardan en los ficheros
+ESCAPE_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x1b[()][A-Za-z0-9]|\r")
+
+
+def timestamp():
+  now = time.time()
+  return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)) + f".{int(now % 1 * 1000):03d}"
+
+
+class RotatingLog:
+  """
+  Fichero de log que se rota al superar max_bytes: <fichero> pasa a <fichero>.1, este a
+  <fichero>.2... y se conservan como mucho 'backups' ficheros antiguos.
+  """
+  def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.file = open(path, "a", encoding="utf-8")
+    self.size = self.file.tell()
+
+  def write(self, text):
+    data = text.encode("utf-8")
+    if self.size and self.size + len(data) > self.max_bytes:
+      self.rotate()
+    self.file.write(text)
+    self.file.flush()
+    self.size += len(data)
+
+  def rotate(self):
+    self.file.close()
+    for i in range(self.backups - 1, 0, -1):
+      if os.path.exists(f"{self.path}.{i}"):
+        os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+    if self.backups:
+      os.replace(self.path, f"{self.path}.1")
+    else:
+      os.remove(self.path)
+    self.file = open(self.path, "a", encoding="utf-8")
+    self.size = 0
+
+  def close(self):
+    self.file.close()
+
+
+class Console:
+  """
+  Salida de la consola de una VM: la divide en líneas, las guarda con fecha en su fichero,
+  conserva en memoria las últimas y anota cuándo aparece cada marca de arranque.
+  """
+  def __init__(self, name, writer, tail_lines=TAIL_LINES):
+    self.name = name
+    self.writer = writer
+    self.lines = collections.deque(maxlen=tail_lines)
+    self.partial = ""
+    self.started = time.monotonic()
+    self.markers = {}
+    self.events = collections.defaultdict(asyncio.Event)
+    self.listeners = []
+    self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+  def feed(self, data):
+    text = self.partial + ESCAPE_RE.sub("", self.decoder.decode(data))
+    lines = text.split("\n")
+    self.partial = lines.pop()
+    if len(self.partial) > MAX_LINE:
+      lines.append(self.partial)
+      self.partial = ""
+    for line in lines:
+      self.line(line[:MAX_LINE])
+    # El prompt de login no termina en salto de línea: también se busca en la línea a medias
+    self.detect(self.partial)
+
+  def line(self, text):
+    stamped = f"{timestamp()} {text}"
+    self.writer.write(stamped + "\n")
+    self.lines.append(stamped)
+    for listener in self.listeners:
+      listener.put(stamped)
+    self.detect(text)
+
+  def detect(self, text):
+    for marker, pattern in MARKERS.items():
+      if marker not in self.markers and pattern.search(text):
+        self.markers[marker] = time.monotonic() - self.started
+        self.events[marker].set()
+        log.debug(f"VM {self.name}: '{marker}' a los {self.markers[marker]:.2f} s del arranque")
+
+  def close(self):
+    if self.partial:
+      self.line(self.partial)
+      self.partial = ""
+    self.writer.close()
+
+
+class ConsoleCollector:
+  """
+  Lector único de las consolas serie de las VMs: un solo bucle de eventos, en su propio
+  hilo, lee a la vez la salida de todas las consolas y la guarda con fecha en
+  <directorio>/<vm>.log, rotado por tamaño. Detecta en la salida las marcas de arranque,
+  de modo que se sabe cuándo está lista cada VM sin consultarla periódicamente.
+  """
+  def __init__(self, hypervisor, directory=DEFAULT_DIR, max_bytes=MAX_BYTES, backups=BACKUPS,
+               tail_lines=TAIL_LINES):
+    self.hypervisor = hypervisor
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.tail_lines = tail_lines
+    self.loop = None
+    self.thread = None
+    self.readers = {}
+    self.processes = {}
+    self.consoles = {}
+
+  def _ensure_loop(self):
+    if self.loop is None:
+      self.loop = asyncio.new_event_loop()
+      self.thread = threading.Thread(target=self.loop.run_forever, name="consoles", daemon=True)
+      self.thread.start()
+
+  def _call(self, coroutine):
+    self._ensure_loop()
+    return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+  def attach(self, name):
+    """
+    Empieza a leer la consola de una VM (se puede llamar desde cualquier hilo).
+    """
+    self._call(self._attach(name))
+
+  async def _attach(self, name):
+    if name in self.readers:
+      return
+    os.makedirs(self.directory, exist_ok=True)
+    path = log_path(self.directory, name)
+    self.consoles[name] = Console(name, RotatingLog(path, self.max_bytes, self.backups), self.tail_lines)
+    self.readers[name] = asyncio.create_task(self._read(name))
+    log.info(f"Consola de VM {name} guardándose en {path}")
+
+  async def _read(self, name):
+    console = self.consoles[name]
+    argv = self.hypervisor.console_command(name)
+    if argv is None:
+      log.debug(f"El hipervisor no ofrece consola para {name}")
+      return
+
+    # 'virsh console' exige un terminal: se le da un pty que nadie escribe
+    master, slave = os.openpty()
+    try:
+      process = await asyncio.create_subprocess_exec(
+        *argv, stdin=slave, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+      log.error(f"No se pudo abrir la consola de {name}: {e}")
+      os.close(master)
+      return
+    finally:
+      os.close(slave)
+    self.processes[name] = process
+
+    try:
+      while True:
+        chunk = await process.stdout.read(READ_SIZE)
+        if not chunk:
+          break
+        console.feed(chunk)
+    finally:
+      os.close(master)
+      log.debug(f"Consola de VM {name} cerrada")
+
+  def follow(self, name):
+    """
+    Lee la consola de una VM y devuelve una cola (queue.Queue) con cada nueva línea.
+    """
+    lines = queue.Queue()
+    self.attach(name)
+    self.loop.call_soon_threadsafe(self.consoles[name].listeners.append, lines)
+    return lines
+
+  def tail(self, name):
+    # Últimas líneas leídas de la consola de una VM (en memoria)
+    console = self.consoles.get(name)
+    return list(console.lines) if console else []
+
+  def boot_times(self):
+    # {vm: {marca: segundos desde que se empezó a leer su consola}}
+    return {name: dict(console.markers) for name, console in self.consoles.items()}
+
+  async def _wait_markers(self, expected, timeout):
+    async def one(name, markers):
+      console = self.consoles.get(name)
+      if console is None:
+        return None
+      try:
+        await asyncio.wait_for(asyncio.gather(*(console.events[m].wait() for m in markers)), timeout)
+      except asyncio.TimeoutError:
+        return None
+      return max((console.markers[m] for m in markers), default=0.0)
+
+    names = list(expected)
+    times = await asyncio.gather(*(one(name, expected[name]) for name in names))
+    return dict(zip(names, times))
+
+  def wait_markers(self, expected, timeout):
+    """
+    Espera, sin sondeos, a que cada VM muestre sus marcas de arranque.
+    'expected' es {vm: [marcas]}. Devuelve {vm: segundos hasta la última marca, o None}.
+    """
+    return self._call(self._wait_markers(expected, timeout))
+
+  async def _close(self):
+    for process in self.processes.values():
+      if process.returncode is None:
+        try:
+          process.terminate()
+        except ProcessLookupError:
+          pass
+    for process in self.processes.values():
+      try:
+        await asyncio.wait_for(process.wait(), STOP_GRACE)
+      except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+    await asyncio.gather(*self.readers.values(), return_exceptions=True)
+    for console in self.consoles.values():
+      console.close()
+
+  def close(self):
+    """
+    Cierra todas las consolas y para el bucle de lectura.
+    """
+    if self.loop is None:
+      return
+    self._call(self._close())
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    self.loop.close()
+    self.loop = None
+
+
+def log_path(directory, name):
+  return os.path.join(directory, f"{name}.log")
+
+
+def read_tail(directory, name, lines=50, backups=BACKUPS):
+  """
+  Últimas líneas guardadas de la consola de una VM, incluidos los ficheros ya rotados.
+  """
+  path = log_path(directory, name)
+  tail = collections.deque(maxlen=lines)
+  for candidate in [f"{path}.{i}" for i in range(backups, 0, -1)] + [path]:
+    if os.path.exists(candidate):
+      with open(candidate, encoding="utf-8", errors="replace") as f:
+        tail.extend(line.rstrip("\n") for line in f)
+  return list(tail)
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import re
+import shlex
+
+import lib_cmd as cmd
+
+log = logging.getLogger('manage-p2')
+
+
+class GuestBatch:
+  """
+  Conjunto de modificaciones sobre el sistema de ficheros de una imagen qcow2.
+  Las operaciones se acumulan y se aplican después en una única sesión de libguestfs,
+  en lugar de lanzar un virt-copy-in o virt-edit por cada fichero.
+  """
+  def __init__(self, image):
+    self.image = image
+    self.ops = []
+
+  def write(self, path, content):
+    # Sustituye el contenido completo del fichero
+    self.ops.append(("write", path, content))
+    return self
+
+  def edit(self, path, expr):
+    # Expresión de sustitución estilo sed (s/patrón/reemplazo/)
+    self.ops.append(("edit", path, expr))
+    return self
+
+  def cat(self, path):
+    # Lee el fichero al final de la sesión (para comprobaciones en el log)
+    self.ops.append(("cat", path))
+    return self
+
+  @property
+  def digest(self):
+    # Identifica el contenido: si no cambia, no hace falta volver a aplicarlo
+    return ops_digest(self.ops)
+
+  def apply(self, backend):
+    log.debug(f"Aplicando {len(self.ops)} operaciones sobre {self.image} en una sola sesión")
+    return backend.apply(self)
+
+
+def ops_digest(ops):
+  return hashlib.sha256(json.dumps(ops, separators=(",", ":")).encode()).hexdigest()
+
+
+def guestfish_quote(text):
+  # Cadena entre comillas dobles con los escapes que entiende guestfish
+  text = text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\t", "\\t")
+  return f'"{text}"'
+
+
+class GuestfishBackend:
+  """
+  Aplica un GuestBatch con un único proceso guestfish (un solo arranque del appliance).
+  """
+  def script(self, batch):
+    lines = []
+    for op in batch.ops:
+      if op[0] == "write":
+        lines.append(f"write {op[1]} {guestfish_quote(op[2])}")
+      elif op[0] == "edit":
+        command = f"sed -i -e {shlex.quote(op[2])} {shlex.quote(op[1])}"
+        lines.append(f"sh {guestfish_quote(command)}")
+      elif op[0] == "cat":
+        lines.append(f"cat {op[1]}")
+      else:
+        raise ValueError(f"Operación desconocida: {op[0]}")
+    return "\n".join(lines) + "\n"
+
+  def apply(self, batch):
+    script = self.script(batch)
+    log.debug(f"Script guestfish para {batch.image}:\n{script}")
+    return cmd.run(["sudo", "guestfish", "--rw", "-a", batch.image, "-i"], input=script).stdout
+
+
+class FakeGuestBackend:
+  """
+  Backend en memoria que registra las sesiones y simula el sistema de ficheros del invitado.
+  Permite probar la personalización de imágenes sin libguestfs.
+  """
+  def __init__(self, files=None):
+    self.sessions = []
+    self.files = {}
+    for image, content in (files or {}).items():
+      self.files[image] = dict(content)
+
+  def apply(self, batch):
+    self.sessions.append((batch.image, list(batch.ops)))
+    fs = self.files.setdefault(batch.image, {})
+    output = []
+    for op in batch.ops:
+      if op[0] == "write":
+        fs[op[1]] = op[2]
+      elif op[0] == "edit":
+        fs[op[1]] = sed_substitute(op[2], fs.get(op[1], ""))
+      elif op[0] == "cat":
+        output.append(fs.get(op[1], ""))
+    return "".join(output)
+
+
+def sed_substitute(expr, text):
+  # Interpreta una expresión s<d>patrón<d>reemplazo<d> simple como haría sed línea a línea
+  delim = expr[1]
+  _, pattern, replacement, _ = expr.split(delim, 3)
+  replacement = replacement.replace("\\n", "\n")
+  regex = re.compile(pattern)
+  return "\n".join(regex.sub(lambda m: replacement, line, count=1) for line in text.split("\n"))
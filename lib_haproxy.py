@@ -0,0 +1,272 @@
+import logging
+import os
+import re
+import shutil
+import socket
+import tempfile
+
+import lib_cmd as cmd
+
+log = logging.getLogger('manage-p2')
+
+ALGORITHMS = ("roundrobin", "static-rr", "leastconn", "first", "source", "uri")
+HTTP_REUSE = ("never", "safe", "aggressive", "always")
+HASH_TYPES = ("map-based", "consistent")
+TIME_RE = re.compile(r"^\d+(us|ms|s|m|h|d)?$")
+STATS_URI = "/stats"
+# Socket local de la API de administración en el balanceador (el de Debian por defecto)
+ADMIN_SOCKET = "/run/haproxy/admin.sock"
+HAPROXY_CFG = "/etc/haproxy/haproxy.cfg"
+# Sustitución de haproxy.cfg en el balanceador: se valida antes de ponerla en uso y se
+# recarga HAProxy de forma ordenada (el proceso nuevo sustituye al anterior con -sf sin
+# cortar las conexiones en curso)
+RELOAD_SCRIPT = (f"cat > {HAPROXY_CFG}.new && haproxy -c -q -f {HAPROXY_CFG}.new && "
+                 f"mv {HAPROXY_CFG}.new {HAPROXY_CFG} && "
+                 f"(systemctl reload haproxy || service haproxy reload)")
+
+# Valores por defecto de la sección 'haproxy' de manage-p2.json
+DEFAULTS = {
+  "balance": "roundrobin",
+  "hash_type": None,
+  "maxconn": 4096,
+  "nbthread": None,
+  "server_maxconn": None,
+  "weights": {},
+  "keep_alive": True,
+  "http_reuse": "safe",
+  "check_inter": "2s",
+  "check_rise": 2,
+  "check_fall": 3,
+  "runtime_api_port": 9999,
+  "stats_port": 8404,
+  "ssh_user": "root",
+  "timeouts": {
+    "connect": "5s",
+    "client": "30s",
+    "server": "30s",
+    "http-keep-alive": "10s",
+  },
+}
+
+
+def options_from_config(config):
+  """
+  Combina la sección 'haproxy' de la configuración con los valores por defecto y la valida.
+  """
+  options = dict(DEFAULTS)
+  options.update(config or {})
+  options["timeouts"] = dict(DEFAULTS["timeouts"], **(config or {}).get("timeouts", {}))
+  validate_options(options)
+  return options
+
+
+def validate_options(options):
+  unknown = set(options) - set(DEFAULTS)
+  if unknown:
+    raise ValueError(f"Opciones de HAProxy desconocidas: {sorted(unknown)}")
+  if options["balance"] not in ALGORITHMS:
+    raise ValueError(f"Algoritmo de balanceo no válido: {options['balance']} (válidos: {', '.join(ALGORITHMS)})")
+  if options["hash_type"] not in (None,) + HASH_TYPES:
+    raise ValueError(f"hash_type no válido: {options['hash_type']}")
+  if options["http_reuse"] not in HTTP_REUSE:
+    raise ValueError(f"http_reuse no válido: {options['http_reuse']}")
+  for key in ("maxconn", "nbthread", "server_maxconn", "check_rise", "check_fall", "runtime_api_port", "stats_port"):
+    value = options[key]
+    if value is not None and (not isinstance(value, int) or value < 1):
+      raise ValueError(f"{key} debe ser un entero positivo: {value}")
+  if not isinstance(options["ssh_user"], str) or not options["ssh_user"]:
+    raise ValueError(f"ssh_user no válido: {options['ssh_user']}")
+  for key, value in [("check_inter", options["check_inter"])] + list(options["timeouts"].items()):
+    if not TIME_RE.match(str(value)):
+      raise ValueError(f"Tiempo no válido para {key}: {value}")
+  for name, weight in options["weights"].items():
+    if not isinstance(weight, int) or not 0 <= weight <= 256:
+      raise ValueError(f"Peso no válido para {name}: {weight} (0-256)")
+
+
+def render(servers, options, api_address=None, api_clients=()):
+  """
+  Genera haproxy.cfg con exactamente los servidores indicados como backends.
+  'servers' es una lista de (nombre, dirección, puerto). La API de administración
+  ('runtime_api_port') y la página de estadísticas ('stats_port') solo escuchan en
+  'api_address' y solo aceptan conexiones desde 'api_clients'.
+  """
+  unknown = set(options["weights"]) - {name for name, _, _ in servers}
+  if unknown:
+    raise ValueError(f"Pesos definidos para servidores que no existen: {sorted(unknown)}")
+  if (options["runtime_api_port"] or options["stats_port"]) and (api_address is None or not api_clients):
+    raise ValueError("La API de administración y las estadísticas de HAProxy necesitan su dirección "
+                     "y la de sus clientes")
+  # Solo en la dirección indicada y solo para los clientes indicados (el host), no para
+  # el resto de equipos de las redes del balanceador
+  clients = " ".join(str(client) for client in api_clients)
+
+  lines = ["global", f"    maxconn {options['maxconn']}"]
+  if options["nbthread"]:
+    lines.append(f"    nbthread {options['nbthread']}")
+  if options["runtime_api_port"]:
+    # API de administración para cambiar los backends sin reiniciar HAProxy. Solo es
+    # accesible localmente; el frontend 'runtime_api' la publica para el host
+    lines.append(f"    stats socket {ADMIN_SOCKET} mode 600 level admin")
+
+  lines += ["", "defaults", "    mode http"]
+  for name, value in options["timeouts"].items():
+    lines.append(f"    timeout {name} {value}")
+  if options["keep_alive"]:
+    lines.append("    option http-keep-alive")
+  else:
+    lines.append("    option httpclose")
+
+  if options["stats_port"]:
+    # Página de estadísticas (también en CSV en /stats;csv) para 'metrics'
+    lines += ["",
+              "frontend stats",
+              f"    bind {api_address}:{options['stats_port']}",
+              "    mode http",
+              f"    tcp-request connection reject unless {{ src {clients} }}",
+              "    stats enable",
+              f"    stats uri {STATS_URI}",
+              "    stats refresh 10s"]
+
+  if options["runtime_api_port"]:
+    lines += ["",
+              "frontend runtime_api",
+              f"    bind {api_address}:{options['runtime_api_port']}",
+              "    mode tcp",
+              f"    tcp-request connection reject unless {{ src {clients} }}",
+              "    default_backend runtime_api",
+              "",
+              "backend runtime_api",
+              "    mode tcp",
+              f"    server admin {ADMIN_SOCKET}"]
+
+  lines += ["",
+            "frontend lb",
+            "    bind *:80",
+            "    mode http",
+            "    default_backend webservers",
+            "",
+            "backend webservers",
+            "    mode http",
+            f"    balance {options['balance']}"]
+  if options["hash_type"]:
+    lines.append(f"    hash-type {options['hash_type']}")
+  if options["keep_alive"]:
+    lines.append(f"    http-reuse {options['http_reuse']}")
+  lines.append(f"    default-server inter {options['check_inter']} rise {options['check_rise']} fall {options['check_fall']}")
+
+  for name, address, port in servers:
+    lines.append(f"    server {name} {address}:{port} {server_args(name, options)}")
+
+  text = "\n".join(lines) + "\n"
+  check_backends(text, [name for name, _, _ in servers])
+  return text
+
+
+def server_args(name, options):
+  args = "check"
+  if name in options["weights"]:
+    args += f" weight {options['weights'][name]}"
+  if options["server_maxconn"]:
+    args += f" maxconn {options['server_maxconn']}"
+  return args
+
+
+def backend_servers(text, backend="webservers"):
+  # Nombres de los servidores declarados en una sección 'backend' de la configuración
+  names, section = [], None
+  for line in text.splitlines():
+    if line and not line[0].isspace():
+      section = line.split()
+    elif section == ["backend", backend]:
+      match = re.match(r"\s+server\s+(\S+)\s", line)
+      if match:
+        names.append(match.group(1))
+  return names
+
+
+def check_backends(text, expected):
+  found = backend_servers(text)
+  if found != list(expected):
+    raise ValueError(f"La configuración de HAProxy declara {found} en lugar de {list(expected)}")
+
+
+def check_with_haproxy(text):
+  """
+  Valida la configuración con 'haproxy -c' si el binario está instalado.
+  Devuelve None si no se pudo comprobar, o (válida, mensajes).
+  """
+  binary = shutil.which("haproxy")
+  if binary is None:
+    log.debug("haproxy no está instalado, solo se hace la validación interna.")
+    return None
+  with tempfile.NamedTemporaryFile("w", suffix=".cfg", delete=False) as f:
+    f.write(text)
+  try:
+    result = cmd.run([binary, "-c", "-f", f.name], check=False)
+    return result.returncode == 0, (result.stdout + result.stderr).strip()
+  finally:
+    os.remove(f.name)
+
+
+class RuntimeAPI:
+  """
+  Cliente de la API de administración de HAProxy (frontend 'runtime_api' de render).
+  Permite añadir y quitar servidores del backend sin recargar la configuración.
+  """
+  def __init__(self, host, port, backend="webservers", timeout=5.0):
+    self.host = host
+    self.port = port
+    self.backend = backend
+    self.timeout = timeout
+
+  def command(self, line):
+    with socket.create_connection((self.host, self.port), self.timeout) as sock:
+      sock.sendall(line.encode() + b"\n")
+      chunks = []
+      while True:
+        data = sock.recv(65536)
+        if not data:
+          break
+        chunks.append(data)
+    output = b"".join(chunks).decode(errors="replace").strip()
+    log.debug(f"HAProxy '{line}': {output}")
+    return output
+
+  def _check(self, line):
+    output = self.command(line)
+    if any(word in output.lower() for word in ("unknown", "error", "not found", "require", "invalid")):
+      raise RuntimeError(f"HAProxy rechaza '{line}': {output}")
+    return output
+
+  def add_server(self, name, address, port, options):
+    # Los servidores añadidos en caliente arrancan en mantenimiento y sin comprobaciones de salud
+    target = f"{self.backend}/{name}"
+    self._check(f"add server {target} {address}:{port} {server_args(name, options)} "
+                f"inter {options['check_inter']} rise {options['check_rise']} fall {options['check_fall']}")
+    self._check(f"enable health {target}")
+    self._check(f"enable server {target}")
+
+  def remove_server(self, name):
+    target = f"{self.backend}/{name}"
+    self._check(f"disable server {target}")
+    self.command(f"shutdown sessions server {target}")
+    self._check(f"del server {target}")
+
+  def servers(self):
+    # Nombres de los servidores del backend según 'show servers state'
+    names = []
+    for line in self.command(f"show servers state {self.backend}").splitlines():
+      fields = line.split()
+      if len(fields) > 3 and not line.startswith("#") and fields[1] == self.backend:
+        names.append(fields[3])
+    return names
+
+
+def reload(host, text, user="root"):
+  """
+  Sustituye haproxy.cfg en el balanceador por ssh y recarga HAProxy sin reiniciarlo. Es la
+  alternativa a RuntimeAPI cuando la API no responde. Lanza CommandError si falla.
+  """
+  cmd.run(["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=5", f"{user}@{host}", RELOAD_SCRIPT],
+          input=text)
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+import lib_cmd as cmd
+import lib_trace as trace
+from lib_cmd import CommandError, CommandTimeout
+
+log = logging.getLogger('manage-p2')
+
+# Estados de dominio comunes a todos los backends
+RUNNING = "running"
+PAUSED = "paused"
+SHUTOFF = "shut off"
+OTHER = "other"
+
+# Grupos de 'virsh domstats' que usa 'metrics'
+DOMSTATS_GROUPS = ("--state", "--cpu-total", "--balloon", "--interface")
+
+# Segundos entre las líneas de la consola simulada del backend 'fake'
+FAKE_BOOT_STEP = 0.05
+
+
+# Mensajes de virsh, libvirt y el backend 'fake' cuando el dominio no existe
+NOT_FOUND_RE = re.compile(r"domain not found|failed to get domain|no domain with matching|dominio no encontrado",
+                          re.IGNORECASE)
+
+
+class HypervisorError(Exception):
+  pass
+
+
+def not_found(error):
+  # True si el error indica que el dominio no existe
+  return bool(NOT_FOUND_RE.search(str(error)))
+
+
+class VirshBackend:
+  """
+  Backend basado en 'sudo virsh': un proceso (y una conexión a libvirt) por operación.
+  Mantiene el comportamiento original del script.
+  """
+  def _virsh(self, *args, input=None):
+    try:
+      return cmd.run(["sudo", "virsh", *args], input=input).stdout
+    except CommandTimeout as e:
+      raise HypervisorError(str(e)) from e
+    except CommandError as e:
+      raise HypervisorError(f"virsh {args[0]} ha fallado: {(e.stderr or '').strip() or e}") from e
+
+  def define(self, name, xml, path=None):
+    # Como hasta ahora: se elimina la definición anterior y se vuelve a definir
+    try:
+      self._virsh("undefine", name)
+    except HypervisorError:
+      log.debug(f"VM {name} no estaba previamente definida, omitiendo undefine.")
+    if path:
+      self._virsh("define", path)
+    else:
+      self._virsh("define", "/dev/stdin", input=xml)
+
+  def undefine(self, name):
+    self._virsh("undefine", name)
+
+  def start(self, name):
+    self._virsh("start", name)
+
+  def shutdown(self, name):
+    self._virsh("shutdown", name)
+
+  def destroy(self, name):
+    self._virsh("destroy", name)
+
+  def state(self, name):
+    try:
+      return normalize_state(self._virsh("domstate", name).strip())
+    except HypervisorError:
+      return None
+
+  def list_domains(self):
+    # Todos los dominios definidos con su estado, en una sola llamada
+    output = self._virsh("list", "--all")
+    domains = {}
+    for line in output.splitlines()[2:]:
+      fields = line.split(None, 2)
+      if len(fields) == 3:
+        domains[fields[1]] = normalize_state(fields[2].strip())
+    return domains
+
+  def console_command(self, name):
+    # Comando que muestra la consola serie del dominio por su salida estándar
+    return ["sudo", "virsh", "console", "--force", name]
+
+  def domain_stats(self):
+    # Estado, CPU, memoria e interfaces de todos los dominios en una sola llamada
+    return parse_domstats(self._virsh("domstats", *DOMSTATS_GROUPS))
+
+
+class LibvirtBackend:
+  """
+  Backend basado en libvirt-python con una única conexión compartida por todas las VMs.
+  'define' es idempotente: crea el dominio o actualiza su definición si ya existe.
+  """
+  _connections = {}
+  _lock = threading.Lock()
+
+  def __init__(self, uri="qemu:///system"):
+    self.uri = uri
+
+  @property
+  def conn(self):
+    with self._lock:
+      conn = self._connections.get(self.uri)
+      if conn is None or not conn.isAlive():
+        try:
+          import libvirt
+        except ImportError as e:
+          raise HypervisorError("El backend 'libvirt' necesita el paquete libvirt-python") from e
+        log.debug(f"Abriendo conexión con libvirt: {self.uri}")
+        try:
+          conn = libvirt.open(self.uri)
+        except libvirt.libvirtError as e:
+          raise HypervisorError(f"No se pudo conectar con {self.uri}: {e}") from e
+        self._connections[self.uri] = conn
+      return conn
+
+  def _call(self, action, name, func):
+    import libvirt
+    try:
+      with trace.span(f"libvirt {action}"):
+        return func(self.conn.lookupByName(name))
+    except libvirt.libvirtError as e:
+      raise HypervisorError(f"{action} de {name} ha fallado: {e}") from e
+
+  def define(self, name, xml, path=None):
+    import libvirt
+    try:
+      with trace.span("libvirt define"):
+        self.conn.defineXML(xml)
+    except libvirt.libvirtError as e:
+      raise HypervisorError(f"define de {name} ha fallado: {e}") from e
+
+  def undefine(self, name):
+    self._call("undefine", name, lambda dom: dom.undefine())
+
+  def start(self, name):
+    self._call("start", name, lambda dom: dom.create())
+
+  def shutdown(self, name):
+    self._call("shutdown", name, lambda dom: dom.shutdown())
+
+  def destroy(self, name):
+    self._call("destroy", name, lambda dom: dom.destroy())
+
+  def state(self, name):
+    try:
+      return self._call("state", name, lambda dom: libvirt_state(dom.state()[0]))
+    except HypervisorError:
+      return None
+
+  def list_domains(self):
+    return {dom.name(): libvirt_state(dom.state()[0]) for dom in self.conn.listAllDomains()}
+
+  def console_command(self, name):
+    return ["sudo", "virsh", "-c", self.uri, "console", "--force", name]
+
+  def domain_stats(self):
+    import libvirt
+    groups = (libvirt.VIR_DOMAIN_STATS_STATE | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+              libvirt.VIR_DOMAIN_STATS_BALLOON | libvirt.VIR_DOMAIN_STATS_INTERFACE)
+    try:
+      with trace.span("libvirt domstats"):
+        return {dom.name(): stats for dom, stats in self.conn.getAllDomainStats(groups)}
+    except libvirt.libvirtError as e:
+      raise HypervisorError(f"domstats ha fallado: {e}") from e
+
+
+class FakeBackend:
+  """
+  Hipervisor en memoria: registra las llamadas y simula el ciclo de vida de los dominios.
+  Con 'path' el estado se guarda en un fichero JSON para compartirlo entre ejecuciones del script.
+  """
+  def __init__(self, path=None):
+    self.path = path
+    self.calls = []
+    self.domains = {}
+    self._lock = threading.Lock()
+    if path and os.path.exists(path):
+      with open(path) as f:
+        self.domains = json.load(f)
+
+  def _record(self, action, name):
+    self.calls.append((action, name))
+    log.debug(f"[fake] {action} {name}")
+
+  def _save(self):
+    if self.path:
+      with open(self.path, "w") as f:
+        json.dump(self.domains, f, indent=4)
+
+  def _domain(self, name):
+    if name not in self.domains:
+      raise HypervisorError(f"Dominio no encontrado: {name}")
+    return self.domains[name]
+
+  def define(self, name, xml, path=None):
+    with self._lock:
+      self._record("define", name)
+      domain = self.domains.setdefault(name, {"state": SHUTOFF})
+      domain["xml"] = xml
+      self._save()
+
+  def undefine(self, name):
+    with self._lock:
+      self._record("undefine", name)
+      self._domain(name)
+      del self.domains[name]
+      self._save()
+
+  def start(self, name):
+    with self._lock:
+      self._record("start", name)
+      domain = self._domain(name)
+      if domain["state"] == RUNNING:
+        raise HypervisorError(f"El dominio {name} ya está arrancado")
+      domain["state"] = RUNNING
+      self._save()
+
+  def shutdown(self, name):
+    with self._lock:
+      self._record("shutdown", name)
+      domain = self._domain(name)
+      if domain["state"] != RUNNING:
+        raise HypervisorError(f"El dominio {name} no está arrancado")
+      domain["state"] = SHUTOFF
+      self._save()
+
+  def destroy(self, name):
+    with self._lock:
+      self._record("destroy", name)
+      domain = self._domain(name)
+      # Como en libvirt, también se puede forzar el apagado de un dominio en pausa
+      if domain["state"] not in (RUNNING, PAUSED):
+        raise HypervisorError(f"El dominio {name} no está arrancado")
+      domain["state"] = SHUTOFF
+      self._save()
+
+  def state(self, name):
+    with self._lock:
+      domain = self.domains.get(name)
+      return domain["state"] if domain else None
+
+  def list_domains(self):
+    with self._lock:
+      return {name: domain["state"] for name, domain in self.domains.items()}
+
+  def console_command(self, name):
+    # Consola simulada: un arranque breve con las marcas de todos los roles y el prompt de login
+    script = (f"import sys, time\n"
+              f"for line in ['Booting {name}', 'Starting HAProxy: haproxy.', 'Starting Apache httpd web server: apache2.']:\n"
+              f"  print(line, flush=True); time.sleep({FAKE_BOOT_STEP})\n"
+              f"sys.stdout.write('{name} login: '); sys.stdout.flush(); time.sleep(3600)\n")
+    return [sys.executable, "-c", script]
+
+  def domain_stats(self):
+    # Mismas claves que 'virsh domstats', sin consumo simulado
+    with self._lock:
+      return {name: {"state.state": 1 if domain["state"] == RUNNING else 5, "cpu.time": 0,
+                     "balloon.current": 0, "balloon.rss": 0, "net.count": 0}
+              for name, domain in self.domains.items()}
+
+
+def normalize_state(text):
+  if text == "running":
+    return RUNNING
+  if text == "paused":
+    return PAUSED
+  if text in ("shut off", "shutoff"):
+    return SHUTOFF
+  return OTHER
+
+
+def parse_domstats(text):
+  """
+  Convierte la salida de 'virsh domstats' en {dominio: {clave: valor}}, con los valores
+  numéricos como int o float.
+  """
+  stats = {}
+  current = None
+  for line in text.splitlines():
+    line = line.strip()
+    if line.startswith("Domain:"):
+      current = stats.setdefault(line.split(":", 1)[1].strip().strip("'"), {})
+    elif current is not None and "=" in line:
+      key, _, value = line.partition("=")
+      current[key] = number(value)
+  return stats
+
+
+def number(value):
+  for kind in (int, float):
+    try:
+      return kind(value)
+    except ValueError:
+      pass
+  return value
+
+
+def libvirt_state(code):
+  # Constantes VIR_DOMAIN_* de libvirt
+  return {1: RUNNING, 3: PAUSED, 5: SHUTOFF}.get(code, OTHER)
+
+
+def get_backend(kind="virsh", uri="qemu:///system", fake_path=None):
+  if kind == "virsh":
+    return VirshBackend()
+  if kind == "libvirt":
+    return LibvirtBackend(uri)
+  if kind == "fake":
+    return FakeBackend(fake_path)
+  raise ValueError(f"Backend de hipervisor desconocido: {kind}")
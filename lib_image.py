@@ -0,0 +1,290 @@
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+import lib_cmd as cmd
+import lib_trace as trace
+from lib_guest import GuestBatch, GuestfishBackend
+
+log = logging.getLogger('manage-p2')
+
+GOLDEN_DIR = "golden"
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Formas de colocar la imagen base en el directorio de trabajo, por orden de preferencia.
+# 'symlink' no está por defecto: la imagen seguiría leyéndose desde el almacenamiento compartido
+PLACEMENTS = ("reflink", "hardlink", "symlink", "copy")
+DEFAULT_PLACEMENT = ("reflink", "hardlink", "copy")
+
+# ioctl de Linux para clonar un fichero compartiendo sus bloques (btrfs, XFS)
+FICLONE = 0x40049409
+
+PROGRESS_INTERVAL = 5.0
+
+
+class ImageError(Exception):
+  pass
+
+
+def file_digest(path):
+  """
+  Devuelve el sha256 del contenido de un fichero.
+  El resultado se guarda junto al fichero (<fichero>.sha256) y solo se recalcula
+  si cambian su tamaño o su fecha de modificación.
+  """
+  st = os.stat(path)
+  memo_path = f"{path}.sha256"
+  try:
+    with open(memo_path) as f:
+      memo = json.load(f)
+    if memo["size"] == st.st_size and memo["mtime_ns"] == st.st_mtime_ns:
+      return memo["sha256"]
+  except (OSError, ValueError, KeyError):
+    pass
+
+  log.debug(f"Calculando hash de {path} ({st.st_size} bytes)")
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+      h.update(chunk)
+  digest = h.hexdigest()
+
+  try:
+    with open(memo_path, "w") as f:
+      json.dump({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}, f)
+  except OSError as e:
+    log.debug(f"No se pudo guardar el hash de {path}: {e}")
+  return digest
+
+
+def backing_chain(image):
+  # Cadena de imágenes de un overlay, empezando por él mismo ([] en modo 'dry-run')
+  info = cmd.run(["qemu-img", "info", "--backing-chain", "--output=json", image]).stdout
+  return json.loads(info) if info else []
+
+
+def check_backing_chain(image, base):
+  """
+  Comprueba que la cadena de imágenes de 'image' es qcow2 de principio a fin y termina en 'base'.
+  Lanza ImageError si falta alguna imagen o la cadena no lleva a 'base'.
+  """
+  try:
+    chain = backing_chain(image)
+  except cmd.CommandError as e:
+    raise ImageError(f"No se pudo leer la cadena de imágenes de {image}: {e}") from e
+  if not chain:
+    return
+  for entry in chain:
+    if entry.get("format") != "qcow2":
+      raise ImageError(f"{entry.get('filename')} no es qcow2 ({entry.get('format')})")
+    backing = entry.get("full-backing-filename")
+    if backing and not os.path.exists(backing):
+      raise ImageError(f"Falta {backing}, imagen base de {entry.get('filename')}")
+  last = os.path.realpath(chain[-1].get("filename", ""))
+  if last != os.path.realpath(base):
+    raise ImageError(f"La cadena de {image} termina en {last} en lugar de {base}")
+
+
+def backing_file(image):
+  # Imagen base de un overlay qcow2 (None si no tiene)
+  info = cmd.run(["qemu-img", "info", "--output=json", image]).stdout
+  if not info:
+    # Modo 'dry-run': el comando no se ejecuta
+    return None
+  return json.loads(info).get("full-backing-filename")
+
+
+def reflink(source, dest):
+  with open(source, "rb") as src, open(dest, "wb") as dst:
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def stream_copy(source, dest):
+  """
+  Copia por bloques mostrando el progreso y calculando el sha256 a la vez.
+  Conserva la fecha de modificación del original. Devuelve el hash.
+  """
+  st = os.stat(source)
+  h = hashlib.sha256()
+  copied = 0
+  start = last_report = time.monotonic()
+  with open(source, "rb") as src, open(dest, "wb") as dst:
+    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+      dst.write(chunk)
+      h.update(chunk)
+      copied += len(chunk)
+      now = time.monotonic()
+      if now - last_report >= PROGRESS_INTERVAL:
+        last_report = now
+        rate = copied / (now - start) / 2**20
+        log.info(f"Copiando {os.path.basename(source)}: {100 * copied / max(st.st_size, 1):.0f}% "
+                 f"({copied / 2**30:.2f} de {st.st_size / 2**30:.2f} GiB, {rate:.0f} MiB/s)")
+  os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+  log.info(f"{os.path.basename(source)} copiada: {copied / 2**30:.2f} GiB en {time.monotonic() - start:.1f} s")
+  return h.hexdigest()
+
+
+def place(source, dest, methods=DEFAULT_PLACEMENT):
+  """
+  Coloca 'source' en 'dest' con el primer método que admita el sistema de ficheros.
+  Se prepara con un nombre temporal y se renombra al final. Devuelve (método, sha256 o None).
+  """
+  tmp = f"{dest}.tmp"
+  for method in methods:
+    if method not in PLACEMENTS:
+      raise ValueError(f"Método de colocación desconocido: {method} (válidos: {', '.join(PLACEMENTS)})")
+    if os.path.lexists(tmp):
+      os.remove(tmp)
+    digest = None
+    try:
+      if method == "reflink":
+        reflink(source, tmp)
+      elif method == "hardlink":
+        os.link(source, tmp)
+      elif method == "symlink":
+        os.symlink(os.path.abspath(source), tmp)
+      else:
+        digest = stream_copy(source, tmp)
+    except OSError as e:
+      if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.EACCES):
+        raise
+      log.debug(f"No se puede usar '{method}' para {dest}: {e}")
+      continue
+    os.replace(tmp, dest)
+    return method, digest
+  raise ImageError(f"No se pudo colocar {source} en {dest} con {', '.join(methods)}")
+
+
+def ensure_image(source, dest, methods=DEFAULT_PLACEMENT):
+  """
+  Garantiza que 'dest' es una copia íntegra y al día de 'source'. Se vuelve a colocar si
+  falta, si el original ha cambiado (tamaño o fecha) o si su hash no coincide con el
+  registrado al colocarla (<dest>.placement.json). El hash de 'dest' solo se recalcula
+  cuando cambian su tamaño o su fecha, así que en el caso normal no se lee la imagen.
+  Devuelve True si la imagen se ha colocado de nuevo.
+  """
+  manifest_path = f"{dest}.placement.json"
+  try:
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+  except (OSError, ValueError):
+    manifest = None
+
+  source_st = os.stat(source) if os.path.exists(source) else None
+  reason = None
+  if not os.path.exists(dest):
+    reason = "no existe"
+  elif source_st is not None and manifest is None and os.stat(dest).st_size != source_st.st_size:
+    reason = "no coincide con el original"
+  elif source_st is not None and manifest is not None and \
+      (manifest["size"], manifest["mtime_ns"]) != (source_st.st_size, source_st.st_mtime_ns):
+    reason = "el original ha cambiado"
+  elif manifest is not None and file_digest(dest) != manifest["sha256"]:
+    reason = "está dañada (hash distinto)"
+
+  if reason is None:
+    if manifest is None and source_st is not None:
+      # Imagen colocada antes de registrar su hash: se adopta tal cual
+      manifest = {"source": os.path.abspath(source), "method": "adopted", "size": source_st.st_size,
+                  "mtime_ns": source_st.st_mtime_ns, "sha256": file_digest(dest)}
+      with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    log.debug(f"{dest} al día ({manifest['method'] if manifest else 'sin original accesible'})")
+    return False
+
+  if source_st is None:
+    raise ImageError(f"{dest} {reason} y el original {source} no está accesible")
+  if cmd.get_runner().simulated:
+    log.info(f"[dry-run] colocar {source} en {dest} ({reason})")
+    return False
+
+  log.info(f"Colocando {dest} desde {source}: {reason}")
+  with trace.span("place_image"):
+    method, digest = place(source, dest, methods)
+    if digest is not None:
+      # Hash calculado durante la copia: se guarda para no volver a leer la imagen
+      st = os.stat(dest)
+      with open(f"{dest}.sha256", "w") as f:
+        json.dump({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}, f)
+    else:
+      digest = file_digest(dest)
+  with open(manifest_path, "w") as f:
+    json.dump({"source": os.path.abspath(source), "method": method, "size": source_st.st_size,
+               "mtime_ns": source_st.st_mtime_ns, "sha256": digest}, f, indent=4)
+  log.info(f"{dest} colocada con '{method}'")
+  return True
+
+
+class GoldenImages:
+  """
+  Caché de imágenes preconfiguradas por rol (server, lb, client).
+  Cada imagen dorada es un overlay sobre la imagen base con la configuración común
+  del rol ya aplicada, identificado por el hash de la imagen base y de esa configuración.
+  """
+  def __init__(self, base, directory=GOLDEN_DIR, guest=None):
+    self.base = os.path.abspath(base)
+    self.directory = os.path.abspath(directory)
+    self.guest = guest or GuestfishBackend()
+
+  def key(self, role, ops):
+    h = hashlib.sha256()
+    h.update(file_digest(self.base).encode())
+    h.update(role.encode())
+    h.update(json.dumps(ops).encode())
+    return h.hexdigest()[:16]
+
+  def path(self, role, ops):
+    return os.path.join(self.directory, f"{role}-{self.key(role, ops)}.qcow2")
+
+  def build(self, role, ops):
+    """
+    Devuelve la imagen dorada del rol, construyéndola solo si no está en caché.
+    """
+    path = self.path(role, ops)
+    if os.path.exists(path):
+      # Solo es un acierto si su cadena de imágenes sigue llevando a la imagen base
+      try:
+        check_backing_chain(path, self.base)
+        log.info(f"Imagen dorada de '{role}' en caché: {path}")
+        return path
+      except ImageError as e:
+        log.warning(f"Imagen dorada de '{role}' no válida, se reconstruye: {e}")
+
+    log.info(f"Construyendo imagen dorada de '{role}': {path}")
+    os.makedirs(self.directory, exist_ok=True)
+    # Se construye con un nombre temporal para que una construcción interrumpida no cuente como acierto
+    tmp_path = f"{path}.tmp"
+    with trace.span("golden", role=role):
+      cmd.run(["qemu-img", "create", "-F", "qcow2", "-f", "qcow2", "-b", self.base, tmp_path])
+      if ops:
+        batch = GuestBatch(tmp_path)
+        batch.ops = list(ops)
+        batch.apply(self.guest)
+    if cmd.get_runner().simulated:
+      # Los comandos no se han ejecutado: no hay imagen que guardar en la caché
+      return path
+    os.replace(tmp_path, path)
+    log.debug(f"Imagen dorada {path} construida con {len(ops)} operaciones")
+    return path
+
+  def evict(self, keep=()):
+    """
+    Elimina las imágenes doradas que no están en 'keep'.
+    Devuelve la lista de ficheros eliminados.
+    """
+    keep = {os.path.abspath(p) for p in keep}
+    removed = []
+    if not os.path.isdir(self.directory):
+      return removed
+    for entry in sorted(os.listdir(self.directory)):
+      path = os.path.join(self.directory, entry)
+      if path in keep or not (entry.endswith(".qcow2") or entry.endswith(".tmp")):
+        continue
+      os.remove(path)
+      removed.append(path)
+      log.info(f"Imagen dorada eliminada: {path}")
+    return removed
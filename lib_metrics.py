@@ -0,0 +1,343 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import time
+
+import lib_cmd as cmd
+from lib_bench import read_response
+from lib_haproxy import STATS_URI
+
+log = logging.getLogger('manage-p2')
+
+DEFAULT_PORT = 9101
+DEFAULT_INTERVAL = 5.0
+DEFAULT_TIMEOUT = 2.0
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Métricas exportadas: nombre -> (tipo, descripción)
+METRICS = {
+  "haproxy_frontend_current_sessions": ("gauge", "Sesiones abiertas en el frontend"),
+  "haproxy_frontend_sessions_total": ("counter", "Sesiones atendidas por el frontend"),
+  "haproxy_frontend_requests_total": ("counter", "Peticiones HTTP recibidas por el frontend"),
+  "haproxy_frontend_bytes_in_total": ("counter", "Bytes recibidos por el frontend"),
+  "haproxy_frontend_bytes_out_total": ("counter", "Bytes enviados por el frontend"),
+  "haproxy_backend_active_servers": ("gauge", "Servidores activos en el backend"),
+  "haproxy_server_up": ("gauge", "1 si el servidor está UP según las comprobaciones de salud"),
+  "haproxy_server_current_sessions": ("gauge", "Sesiones abiertas con el servidor"),
+  "haproxy_server_sessions_total": ("counter", "Sesiones enviadas al servidor"),
+  "haproxy_server_loadbalanced_total": ("counter", "Veces que el balanceo eligió el servidor"),
+  "haproxy_server_bytes_in_total": ("counter", "Bytes enviados al servidor"),
+  "haproxy_server_bytes_out_total": ("counter", "Bytes recibidos del servidor"),
+  "haproxy_server_http_responses_total": ("counter", "Respuestas HTTP del servidor por clase de código"),
+  "libvirt_domain_up": ("gauge", "1 si el dominio está arrancado"),
+  "libvirt_domain_cpu_seconds_total": ("counter", "Tiempo de CPU consumido por el dominio"),
+  "libvirt_domain_memory_bytes": ("gauge", "Memoria asignada al dominio (balloon)"),
+  "libvirt_domain_memory_rss_bytes": ("gauge", "Memoria residente del proceso del dominio"),
+  "libvirt_domain_interface_receive_bytes_total": ("counter", "Bytes recibidos por la interfaz del dominio"),
+  "libvirt_domain_interface_transmit_bytes_total": ("counter", "Bytes enviados por la interfaz del dominio"),
+  "libvirt_domain_interface_receive_packets_total": ("counter", "Paquetes recibidos por la interfaz del dominio"),
+  "libvirt_domain_interface_transmit_packets_total": ("counter", "Paquetes enviados por la interfaz del dominio"),
+  "ovs_interface_receive_bytes_total": ("counter", "Bytes recibidos por el puerto del bridge"),
+  "ovs_interface_transmit_bytes_total": ("counter", "Bytes enviados por el puerto del bridge"),
+  "ovs_interface_receive_packets_total": ("counter", "Paquetes recibidos por el puerto del bridge"),
+  "ovs_interface_transmit_packets_total": ("counter", "Paquetes enviados por el puerto del bridge"),
+  "ovs_interface_receive_dropped_total": ("counter", "Paquetes descartados al recibir en el puerto del bridge"),
+  "ovs_interface_transmit_dropped_total": ("counter", "Paquetes descartados al enviar por el puerto del bridge"),
+  "manage_p2_scrape_success": ("gauge", "1 si la última lectura de la fuente fue correcta"),
+  "manage_p2_scrape_duration_seconds": ("gauge", "Duración de la última lectura de la fuente"),
+}
+
+# Columnas del CSV de HAProxy -> métricas, por tipo de fila
+FRONTEND_FIELDS = {
+  "scur": "haproxy_frontend_current_sessions",
+  "stot": "haproxy_frontend_sessions_total",
+  "req_tot": "haproxy_frontend_requests_total",
+  "bin": "haproxy_frontend_bytes_in_total",
+  "bout": "haproxy_frontend_bytes_out_total",
+}
+SERVER_FIELDS = {
+  "scur": "haproxy_server_current_sessions",
+  "stot": "haproxy_server_sessions_total",
+  "lbtot": "haproxy_server_loadbalanced_total",
+  "bin": "haproxy_server_bytes_in_total",
+  "bout": "haproxy_server_bytes_out_total",
+}
+HTTP_CODES = ("1xx", "2xx", "3xx", "4xx", "5xx", "other")
+
+# Contadores de OVS -> métricas
+OVS_FIELDS = {
+  "rx_bytes": "ovs_interface_receive_bytes_total",
+  "tx_bytes": "ovs_interface_transmit_bytes_total",
+  "rx_packets": "ovs_interface_receive_packets_total",
+  "tx_packets": "ovs_interface_transmit_packets_total",
+  "rx_dropped": "ovs_interface_receive_dropped_total",
+  "tx_dropped": "ovs_interface_transmit_dropped_total",
+}
+
+# Tablas y columnas de OVSDB que se leen, en una sola llamada a ovs-vsctl
+OVS_TABLES = (("Bridge", ("name", "ports")),
+              ("Port", ("_uuid", "interfaces")),
+              ("Interface", ("_uuid", "name", "statistics")))
+OVS_COMMAND = ["sudo", "ovs-vsctl", "--format=json"] + [
+  arg for table, columns in OVS_TABLES for arg in ("--", f"--columns={','.join(columns)}", "list", table)]
+
+
+def value(text):
+  # Valor numérico de un campo; los campos vacíos no se exportan
+  if text in (None, ""):
+    return None
+  try:
+    return int(text)
+  except ValueError:
+    try:
+      return float(text)
+    except ValueError:
+      return None
+
+
+def parse_haproxy_csv(text):
+  """
+  Filas de la página de estadísticas de HAProxy en CSV (/stats;csv o 'show stat').
+  """
+  text = text.lstrip()
+  if text.startswith("# "):
+    text = text[2:]
+  return [row for row in csv.DictReader(io.StringIO(text)) if row.get("pxname")]
+
+
+def haproxy_samples(rows, lb):
+  """
+  Muestras (métrica, etiquetas, valor) de las filas del CSV de HAProxy del balanceador 'lb'.
+  """
+  samples = []
+  for row in rows:
+    kind = row.get("svname")
+    if kind == "FRONTEND":
+      labels = {"lb": lb, "frontend": row["pxname"]}
+      samples += [(metric, labels, value(row.get(field))) for field, metric in FRONTEND_FIELDS.items()]
+    elif kind == "BACKEND":
+      samples.append(("haproxy_backend_active_servers", {"lb": lb, "backend": row["pxname"]}, value(row.get("act"))))
+    else:
+      labels = {"lb": lb, "backend": row["pxname"], "server": kind}
+      samples.append(("haproxy_server_up", labels, int((row.get("status") or "").startswith("UP"))))
+      samples += [(metric, labels, value(row.get(field))) for field, metric in SERVER_FIELDS.items()]
+      samples += [("haproxy_server_http_responses_total", dict(labels, code=code), value(row.get(f"hrsp_{code}")))
+                  for code in HTTP_CODES]
+  return [sample for sample in samples if sample[2] is not None]
+
+
+def domain_samples(stats, names=None):
+  """
+  Muestras de las estadísticas de los dominios ({dominio: {clave: valor}}, con las claves
+  de 'virsh domstats'). Con 'names' solo se exportan esos dominios.
+  """
+  samples = []
+  for domain, values in stats.items():
+    if names is not None and domain not in names:
+      continue
+    labels = {"domain": domain}
+    # Un valor ilegible no se exporta, pero no impide exportar el resto
+    numbers = {key: val for key, val in values.items() if isinstance(val, (int, float))}
+    samples.append(("libvirt_domain_up", labels, int(numbers.get("state.state") == 1)))
+    if "cpu.time" in numbers:
+      samples.append(("libvirt_domain_cpu_seconds_total", labels, numbers["cpu.time"] / 1e9))
+    if "balloon.current" in numbers:
+      samples.append(("libvirt_domain_memory_bytes", labels, numbers["balloon.current"] * 1024))
+    if "balloon.rss" in numbers:
+      samples.append(("libvirt_domain_memory_rss_bytes", labels, numbers["balloon.rss"] * 1024))
+    for i in range(int(numbers.get("net.count", 0))):
+      iface = dict(labels, interface=str(values.get(f"net.{i}.name", i)))
+      for key, metric in (("rx.bytes", "receive_bytes"), ("tx.bytes", "transmit_bytes"),
+                          ("rx.pkts", "receive_packets"), ("tx.pkts", "transmit_packets")):
+        if f"net.{i}.{key}" in numbers:
+          samples.append((f"libvirt_domain_interface_{metric}_total", iface, numbers[f"net.{i}.{key}"]))
+  return samples
+
+
+def ovsdb_list(item):
+  # Valores de OVSDB en JSON: ["uuid", u], ["set", [...]], ["map", [[k, v], ...]] o un valor simple
+  if isinstance(item, list) and item and item[0] == "set":
+    return [ovsdb_value(i) for i in item[1]]
+  return [ovsdb_value(item)]
+
+
+def ovsdb_value(item):
+  if isinstance(item, list) and item and item[0] == "uuid":
+    return item[1]
+  if isinstance(item, list) and item and item[0] == "map":
+    return {key: val for key, val in item[1]}
+  return item
+
+
+def parse_ovs_tables(text):
+  """
+  Convierte la salida de OVS_COMMAND (varias tablas JSON seguidas) en
+  {bridge: {interfaz: {contador: valor}}}. Lanza ValueError si la salida no tiene las
+  tablas y columnas de OVS_TABLES.
+  """
+  decoder = json.JSONDecoder()
+  tables = []
+  position = 0
+  text = text.strip()
+  while position < len(text):
+    table, position = decoder.raw_decode(text, position)
+    tables.append(table)
+    while position < len(text) and text[position].isspace():
+      position += 1
+  if len(tables) != len(OVS_TABLES):
+    raise ValueError(f"ovs-vsctl ha devuelto {len(tables)} tablas en lugar de {len(OVS_TABLES)}")
+  rows = []
+  for table, (name, columns) in zip(tables, OVS_TABLES):
+    if (not isinstance(table, dict) or not isinstance(table.get("data"), list)
+        or table.get("headings") != list(columns)):
+      raise ValueError(f"ovs-vsctl no ha devuelto la tabla {name} con las columnas {', '.join(columns)}")
+    if any(not isinstance(row, list) or len(row) != len(columns) for row in table["data"]):
+      raise ValueError(f"Fila incompleta en la tabla {name} de ovs-vsctl")
+    rows.append([dict(zip(columns, row)) for row in table["data"]])
+  bridges, ports, interfaces = rows
+
+  port_interfaces = {ovsdb_value(p["_uuid"]): ovsdb_list(p["interfaces"]) for p in ports}
+  by_uuid = {ovsdb_value(i["_uuid"]): i for i in interfaces}
+  stats = {}
+  for bridge in bridges:
+    counters = stats.setdefault(bridge["name"], {})
+    for port in ovsdb_list(bridge["ports"]):
+      for uuid in port_interfaces.get(port, []):
+        iface = by_uuid.get(uuid)
+        if iface is not None:
+          counters[iface["name"]] = ovsdb_value(iface["statistics"]) or {}
+  return stats
+
+
+def ovs_samples(stats, bridges=None):
+  samples = []
+  for bridge, interfaces in stats.items():
+    if bridges is not None and bridge not in bridges:
+      continue
+    for iface, counters in interfaces.items():
+      labels = {"bridge": bridge, "interface": iface}
+      samples += [(metric, labels, counters[key]) for key, metric in OVS_FIELDS.items() if key in counters]
+  return samples
+
+
+def escape(text):
+  return str(text).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(samples):
+  """
+  Texto en el formato de exposición de Prometheus, con HELP y TYPE de cada métrica.
+  """
+  by_metric = {}
+  for metric, labels, sample in samples:
+    by_metric.setdefault(metric, []).append((labels, sample))
+  lines = []
+  for metric, values in by_metric.items():
+    kind, description = METRICS.get(metric, ("untyped", metric))
+    lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+    for labels, sample in values:
+      label_text = ",".join(f'{key}="{escape(val)}"' for key, val in labels.items())
+      lines.append(f"{metric}{{{label_text}}} {sample}" if label_text else f"{metric} {sample}")
+  return "\n".join(lines) + "\n"
+
+
+async def fetch_haproxy(host, port, timeout=DEFAULT_TIMEOUT):
+  # CSV de la página de estadísticas de HAProxy
+  async def get():
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+      writer.write(f"GET {STATS_URI};csv HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+      await writer.drain()
+      status, body, _ = await read_response(reader)
+    finally:
+      writer.close()
+    if status != 200:
+      raise RuntimeError(f"HAProxy ha respondido {status} en {host}:{port}{STATS_URI};csv")
+    return body.decode(errors="replace")
+  return await asyncio.wait_for(get(), timeout)
+
+
+class Exporter:
+  """
+  Exportador de métricas del escenario en formato Prometheus. Cada 'interval' segundos lee
+  a la vez las estadísticas de HAProxy de todos los balanceadores, las de todos los
+  dominios (una sola llamada al hipervisor) y los contadores de los puertos de los bridges
+  (una sola llamada a ovs-vsctl). Cada petición de Prometheus recibe el último resultado
+  ya generado, así que servirla no cuesta ninguna lectura.
+  """
+  def __init__(self, topology, hypervisor, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    self.topology = topology
+    self.hypervisor = hypervisor
+    self.interval = interval
+    self.timeout = timeout
+    self.page = b""
+
+  async def _source(self, name, coroutine, samples):
+    start = time.perf_counter()
+    ok = 1
+    try:
+      samples += await coroutine
+    except Exception as e:
+      ok = 0
+      log.warning(f"No se pudieron leer las métricas de {name}: {e}")
+    labels = {"source": name}
+    samples.append(("manage_p2_scrape_success", labels, ok))
+    samples.append(("manage_p2_scrape_duration_seconds", labels, round(time.perf_counter() - start, 6)))
+
+  async def _haproxy(self, lb, port):
+    return haproxy_samples(parse_haproxy_csv(await fetch_haproxy(str(lb.address), port, self.timeout)), lb.name)
+
+  async def _domains(self):
+    stats = await asyncio.wait_for(asyncio.to_thread(self.hypervisor.domain_stats), self.timeout)
+    return domain_samples(stats, set(self.topology.nodes))
+
+  async def _ovs(self):
+    result = await cmd.get_runner().run_async(OVS_COMMAND, timeout=self.timeout, retries=0)
+    return ovs_samples(parse_ovs_tables(result.stdout), {net.bridge for net in self.topology.networks.values()})
+
+  async def collect(self):
+    """
+    Lee todas las fuentes a la vez y devuelve el texto para Prometheus.
+    """
+    sources = []
+    port = self.topology.haproxy["stats_port"]
+    if port:
+      sources += [(f"haproxy:{lb.name}", self._haproxy(lb, port)) for lb in self.topology.balancers]
+    sources += [("libvirt", self._domains()), ("ovs", self._ovs())]
+    results = [[] for _ in sources]
+    await asyncio.gather(*(self._source(name, coroutine, samples)
+                           for (name, coroutine), samples in zip(sources, results)))
+    return render([sample for samples in results for sample in samples])
+
+  async def _handle(self, reader, writer):
+    try:
+      request = await asyncio.wait_for(reader.readline(), self.timeout)
+      while (await asyncio.wait_for(reader.readline(), self.timeout)) not in (b"\r\n", b"\n", b""):
+        pass
+      path = request.split()[1].decode() if len(request.split()) > 1 else ""
+      if path.split("?")[0] == "/metrics":
+        head = f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\n"
+        body = self.page
+      else:
+        head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+        body = b"Not found\n"
+      writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+      await writer.drain()
+    except (OSError, asyncio.TimeoutError):
+      pass
+    finally:
+      writer.close()
+
+  async def serve(self, address="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Sirve /metrics en address:port y renueva las métricas cada 'interval' segundos.
+    """
+    self.page = (await self.collect()).encode()
+    server = await asyncio.start_server(self._handle, address, port)
+    log.info(f"Métricas en http://{address}:{port}/metrics (cada {self.interval} s)")
+    async with server:
+      while True:
+        await asyncio.sleep(self.interval)
+        self.page = (await self.collect()).encode()
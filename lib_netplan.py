@@ -0,0 +1,120 @@
+import logging
+
+import lib_cmd as cmd
+import lib_trace as trace
+
+log = logging.getLogger('manage-p2')
+
+
+def subprocess_runner(argv, input=None):
+  cmd.run(argv, input=input)
+
+
+class FakeRunner:
+  """
+  Runner que solo registra los comandos (y su entrada) sin ejecutarlos.
+  """
+  def __init__(self):
+    self.commands = []
+
+  def __call__(self, argv, input=None):
+    self.commands.append((list(argv), input))
+
+
+class NetPlan:
+  """
+  Plan de red del escenario: bridges, puertos, direcciones y rutas.
+  Todas las operaciones de Open vSwitch se aplican en una sola transacción de ovs-vsctl
+  y las de direcciones/rutas en una sola invocación de 'ip -batch'.
+  Las operaciones son idempotentes (--may-exist/--if-exists, 'ip ... replace').
+  """
+  def __init__(self, runner=None):
+    self.runner = runner or subprocess_runner
+    self.ovs = []
+    self.ip = []
+
+  def add_bridge(self, bridge):
+    self.ovs.append(["--may-exist", "add-br", bridge])
+    return self
+
+  def del_bridge(self, bridge):
+    self.ovs.append(["--if-exists", "del-br", bridge])
+    return self
+
+  def add_port(self, bridge, port):
+    self.ovs.append(["--may-exist", "add-port", bridge, port])
+    return self
+
+  def del_port(self, bridge, port):
+    self.ovs.append(["--if-exists", "del-port", bridge, port])
+    return self
+
+  def add_address(self, dev, cidr):
+    self.ip.append(f"addr replace {cidr} dev {dev}")
+    return self
+
+  def link_up(self, dev):
+    self.ip.append(f"link set dev {dev} up")
+    return self
+
+  def add_route(self, subnet, via):
+    self.ip.append(f"route replace {subnet} via {via}")
+    return self
+
+  def ovs_command(self):
+    if not self.ovs:
+      return None
+    argv = ["sudo", "ovs-vsctl"]
+    for i, op in enumerate(self.ovs):
+      if i:
+        argv.append("--")
+      argv += op
+    return argv
+
+  def ip_script(self):
+    return "\n".join(self.ip) + "\n" if self.ip else None
+
+  def apply(self):
+    """
+    Aplica el plan: primero la transacción de OVS y después el lote de 'ip'.
+    """
+    with trace.span("netplan", ovs=len(self.ovs), ip=len(self.ip)):
+      argv = self.ovs_command()
+      if argv:
+        log.debug(f"Transacción OVS: {' '.join(argv)}")
+        self.runner(argv)
+      script = self.ip_script()
+      if script:
+        log.debug(f"Lote de 'ip':\n{script}")
+        self.runner(["sudo", "ip", "-batch", "-"], input=script)
+    log.info(f"Plan de red aplicado: {len(self.ovs)} operaciones OVS, {len(self.ip)} operaciones de 'ip'.")
+
+
+def scenario_plan(topology, runner=None):
+  # Bridges del escenario con la dirección de red asignada a cada uno
+  plan = NetPlan(runner)
+  for net in topology.networks.values():
+    plan.add_bridge(net.bridge)
+  for net in topology.networks.values():
+    plan.add_address(net.bridge, str(net.subnet))
+    plan.link_up(net.bridge)
+  return plan
+
+
+def host_plan(topology, runner=None):
+  # Dirección del host en la red del cliente y rutas hacia el resto a través del balanceador
+  plan = NetPlan(runner)
+  host = topology.host_interface
+  for net in topology.networks.values():
+    plan.link_up(net.bridge)
+  plan.add_address(host.network.bridge, f"{host.address}/{host.network.subnet.prefixlen}")
+  for subnet, gateway in topology.host_routes:
+    plan.add_route(subnet, gateway)
+  return plan
+
+
+def teardown_plan(topology, runner=None):
+  plan = NetPlan(runner)
+  for net in topology.networks.values():
+    plan.del_bridge(net.bridge)
+  return plan
@@ -0,0 +1,123 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import lib_trace as trace
+
+log = logging.getLogger('manage-p2')
+
+
+class Task:
+  def __init__(self, name, func, deps=()):
+    self.name = name
+    self.func = func
+    self.deps = list(deps)
+    self.started = None
+    self.elapsed = None
+    self.status = "pending"
+
+
+class Executor:
+  """
+  Ejecutor de tareas con dependencias sobre un pool de hilos.
+  Cada tarea se lanza en cuanto todas sus dependencias han terminado bien;
+  si una tarea falla, las que dependen de ella se omiten.
+  """
+  def __init__(self, max_workers=4):
+    self.max_workers = max(1, int(max_workers))
+    self.tasks = {}
+    self.started = None
+
+  def add(self, name, func, deps=()):
+    if name in self.tasks:
+      raise ValueError(f"Tarea duplicada: {name}")
+    self.tasks[name] = Task(name, func, deps)
+    return name
+
+  def _check(self):
+    for task in self.tasks.values():
+      for dep in task.deps:
+        if dep not in self.tasks:
+          raise ValueError(f"La tarea {task.name} depende de una tarea desconocida: {dep}")
+
+    # Detectar ciclos con un recorrido topológico
+    pending = {name: len(task.deps) for name, task in self.tasks.items()}
+    ready = [name for name, n in pending.items() if n == 0]
+    seen = 0
+    while ready:
+      current = ready.pop()
+      seen += 1
+      for task in self.tasks.values():
+        if current in task.deps:
+          pending[task.name] -= 1
+          if pending[task.name] == 0:
+            ready.append(task.name)
+    if seen != len(self.tasks):
+      raise ValueError("Dependencias cíclicas entre tareas")
+
+  def _timed(self, task):
+    log.debug(f"Tarea {task.name} iniciada")
+    # En la traza cada tarea va en el carril de la VM o red sobre la que actúa ('image:s1' -> s1)
+    kind, _, target = task.name.partition(":")
+    start = time.perf_counter()
+    task.started = start
+    try:
+      with trace.span(f"task:{kind}", lane=target or task.name, task=task.name):
+        task.func()
+    finally:
+      task.elapsed = time.perf_counter() - start
+
+  def run(self):
+    """
+    Ejecuta todas las tareas respetando sus dependencias.
+    Devuelve True si todas terminaron correctamente.
+    """
+    self._check()
+    wall_start = self.started = time.perf_counter()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      while True:
+        for task in self.tasks.values():
+          if task.status != "pending":
+            continue
+          states = [self.tasks[dep].status for dep in task.deps]
+          if any(s in ("failed", "skipped") for s in states):
+            task.status = "skipped"
+            log.error(f"Tarea {task.name} omitida: ha fallado una de sus dependencias.")
+          elif all(s == "done" for s in states):
+            task.status = "running"
+            running[pool.submit(self._timed, task)] = task
+
+        if not running:
+          break
+
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+          task = running.pop(future)
+          try:
+            future.result()
+            task.status = "done"
+            log.info(f"Tarea {task.name} completada en {task.elapsed:.2f} s")
+          except Exception as e:
+            task.status = "failed"
+            log.error(f"Tarea {task.name} fallida tras {task.elapsed:.2f} s: {e}")
+
+    wall = time.perf_counter() - wall_start
+    busy = sum(t.elapsed for t in self.tasks.values() if t.elapsed is not None)
+    log.info(f"{len(self.tasks)} tareas ejecutadas en {wall:.2f} s "
+             f"(tiempo acumulado {busy:.2f} s, {self.max_workers} hilos)")
+    for task in sorted(self.tasks.values(), key=lambda t: -(t.elapsed or 0)):
+      if task.elapsed is not None:
+        log.debug(f"  {task.name}: {task.elapsed:.2f} s ({task.status})")
+
+    return all(t.status == "done" for t in self.tasks.values())
+
+  def timings(self):
+    """
+    Momento de inicio (desde el comienzo de run), duración y estado de cada tarea.
+    """
+    return {task.name: {"status": task.status,
+                        "start": round(task.started - self.started, 3) if task.started is not None else None,
+                        "elapsed": round(task.elapsed, 3) if task.elapsed is not None else None}
+            for task in self.tasks.values()}
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+
+from lib_hypervisor import RUNNING
+
+log = logging.getLogger('manage-p2')
+
+INITIAL_DELAY = 0.2
+MAX_DELAY = 5.0
+CONNECT_TIMEOUT = 2.0
+
+
+def backoff(delay):
+  return min(delay * 2, MAX_DELAY)
+
+
+async def wait_tcp(host, port, deadline):
+  """
+  Intenta conectar con host:port con espera exponencial entre intentos.
+  Devuelve el momento (time.monotonic) en que aceptó la conexión, o None si vence el plazo.
+  """
+  delay = INITIAL_DELAY
+  while True:
+    try:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return None
+      _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), min(CONNECT_TIMEOUT, remaining))
+      writer.close()
+      try:
+        await writer.wait_closed()
+      except OSError:
+        pass
+      return time.monotonic()
+    except (OSError, asyncio.TimeoutError):
+      pass
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      return None
+    await asyncio.sleep(min(delay, remaining))
+    delay = backoff(delay)
+
+
+async def wait_domains(hypervisor, names, deadline):
+  """
+  Consulta el estado de todos los dominios con una sola llamada por intento.
+  Devuelve {nombre: momento en que se vio arrancado, o None}.
+  """
+  ready = {name: None for name in names}
+  delay = INITIAL_DELAY
+  while True:
+    try:
+      states = await asyncio.to_thread(hypervisor.list_domains)
+    except Exception as e:
+      log.debug(f"No se pudo consultar el estado de los dominios: {e}")
+      states = {}
+    now = time.monotonic()
+    for name in names:
+      if ready[name] is None and states.get(name) == RUNNING:
+        ready[name] = now
+    remaining = deadline - time.monotonic()
+    if all(ready.values()) or remaining <= 0:
+      return ready
+    await asyncio.sleep(min(delay, remaining))
+    delay = backoff(delay)
+
+
+async def wait_ready(probes, timeout, hypervisor=None):
+  """
+  Espera a que todos los nodos estén listos.
+  'probes' es {nodo: [(host, puerto), ...]}: un nodo está listo cuando su dominio está
+  arrancado (si hay hipervisor) y acepta conexiones en todos sus puertos.
+  Devuelve {nodo: segundos hasta estar listo, o None si no lo estuvo antes del plazo}.
+  """
+  start = time.monotonic()
+  deadline = start + timeout
+
+  tcp_tasks = {}
+  for name, endpoints in probes.items():
+    for host, port in endpoints:
+      tcp_tasks[(name, host, port)] = asyncio.create_task(wait_tcp(host, port, deadline))
+
+  domains = {}
+  if hypervisor is not None:
+    domains = await wait_domains(hypervisor, list(probes), deadline)
+
+  tcp_results = dict(zip(tcp_tasks, await asyncio.gather(*tcp_tasks.values())))
+
+  results = {}
+  for name, endpoints in probes.items():
+    times = [tcp_results[(name, host, port)] for host, port in endpoints]
+    if hypervisor is not None:
+      times.append(domains[name])
+    if any(t is None for t in times):
+      results[name] = None
+    else:
+      results[name] = max(times, default=start) - start
+  return results
+
+
+def scenario_probes(topology):
+  # Servidores web y frontend del balanceador en el puerto 80; el cliente solo necesita estar arrancado
+  probes = {}
+  for node in topology.nodes.values():
+    if node.role in ("server", "lb"):
+      probes[node.name] = [(str(node.address), 80)]
+    else:
+      probes[node.name] = []
+  return probes
+
+
+def report(results):
+  """
+  Escribe en el log el tiempo hasta estar listo de cada nodo. Devuelve True si todos lo están.
+  """
+  for name, elapsed in results.items():
+    if elapsed is None:
+      log.error(f"{name} no está listo dentro del plazo.")
+    else:
+      log.info(f"{name} listo en {elapsed:.2f} s")
+  return all(elapsed is not None for elapsed in results.values())
+
+
+def wait_scenario(topology, hypervisor, timeout, results=None):
+  # Con 'results' se devuelve además en ese diccionario el tiempo de cada nodo
+  measured = asyncio.run(wait_ready(scenario_probes(topology), timeout, hypervisor))
+  if results is not None:
+    results.update(measured)
+  ok = report(measured)
+  if ok:
+    slowest = max(measured.values(), default=0)
+    log.info(f"Escenario completamente operativo en {slowest:.2f} s")
+  return ok
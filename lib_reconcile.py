@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+
+import lib_cmd as cmd
+from lib_hypervisor import RUNNING
+
+log = logging.getLogger('manage-p2')
+
+
+class Actual:
+  """
+  Estado real del escenario obtenido con consultas en bloque:
+  dominios y su estado, bridges de OVS, direcciones IP del host y overlays presentes.
+  """
+  def __init__(self, domains=None, bridges=None, addresses=None, images=None):
+    self.domains = domains or {}
+    self.bridges = set(bridges or ())
+    self.addresses = set(addresses or ())
+    self.images = set(images or ())
+
+
+def observe(hypervisor, image_names=()):
+  try:
+    domains = hypervisor.list_domains()
+  except Exception as e:
+    log.debug(f"No se pudo consultar la lista de dominios: {e}")
+    domains = {}
+
+  # Bridges y direcciones del host se consultan a la vez
+  try:
+    br_result, addr_result = cmd.run_many([["sudo", "ovs-vsctl", "list-br"], ["ip", "-j", "addr", "show"]],
+                                          check=False)
+  except OSError as e:
+    log.debug(f"No se pudo consultar la red del host: {e}")
+    br_result = addr_result = None
+
+  bridges = []
+  if br_result is not None and br_result.returncode == 0:
+    bridges = br_result.stdout.split()
+  elif br_result is not None:
+    log.debug(f"No se pudo consultar la lista de bridges: {br_result.stderr.strip()}")
+
+  addresses = []
+  try:
+    for link in json.loads(addr_result.stdout) if addr_result is not None and addr_result.returncode == 0 else []:
+      for info in link.get("addr_info", []):
+        addresses.append((link["ifname"], f"{info['local']}/{info['prefixlen']}"))
+  except (ValueError, KeyError) as e:
+    log.debug(f"No se pudo consultar las direcciones del host: {e}")
+
+  images = [name for name in image_names if os.path.exists(name)]
+  return Actual(domains, bridges, addresses, images)
+
+
+class Change:
+  def __init__(self, kind, name, reason):
+    self.kind = kind
+    self.name = name
+    self.reason = reason
+
+  def __repr__(self):
+    return f"{self.kind}:{self.name} ({self.reason})"
+
+
+def diff(topology, recorded, actual, golden_for_role, xml_hash_for):
+  """
+  Compara el estado deseado (topología) con el real y el registrado en el estado.
+  'recorded' es {vm: {"backing": ..., "xml_hash": ...}} de la última ejecución;
+  'golden_for_role(rol)' devuelve la imagen dorada actual (None si no se puede calcular)
+  y 'xml_hash_for(nodo)' el hash del XML que le corresponde.
+  Devuelve la lista de cambios necesarios, vacía si el escenario ya está al día.
+  """
+  changes = []
+
+  # Redes: bridges y direcciones de cada bridge
+  for net in topology.networks.values():
+    if net.bridge not in actual.bridges:
+      changes.append(Change("nets", net.name, "bridge inexistente"))
+      break
+    cidr = f"{net.subnet.network_address}/{net.subnet.prefixlen}"
+    if (net.bridge, cidr) not in actual.addresses:
+      changes.append(Change("nets", net.name, f"falta la dirección {cidr}"))
+      break
+
+  host = topology.host_interface
+  host_cidr = f"{host.address}/{host.network.subnet.prefixlen}"
+  if (host.network.bridge, host_cidr) not in actual.addresses:
+    changes.append(Change("host", "host", f"falta la dirección {host_cidr}"))
+
+  for node in topology.nodes.values():
+    data = recorded.get(node.name, {})
+    image = f"{node.name}.qcow2"
+    golden = golden_for_role(node.role)
+    state = actual.domains.get(node.name)
+
+    image_changed = False
+    if image not in actual.images:
+      image_changed = True
+      changes.append(Change("image", node.name, "overlay inexistente"))
+    elif golden is None or data.get("backing") != golden:
+      image_changed = True
+      changes.append(Change("image", node.name, "imagen dorada distinta"))
+
+    if state is None:
+      changes.append(Change("define", node.name, "dominio no definido"))
+    elif data.get("xml_hash") != xml_hash_for(node):
+      changes.append(Change("define", node.name, "XML modificado"))
+
+    if image_changed or state != RUNNING:
+      changes.append(Change("start", node.name, "imagen nueva" if image_changed else f"estado '{state}'"))
+
+  return changes
+
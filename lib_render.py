@@ -0,0 +1,54 @@
+import logging
+
+from lib_guest import GuestBatch
+from lib_topology import render_interfaces, render_haproxy
+
+log = logging.getLogger('manage-p2')
+
+
+class Bundle(GuestBatch):
+  """
+  Ficheros y ediciones propios de un nodo, generados en memoria y listos para aplicarse
+  en una sola sesión sobre su imagen. Las operaciones y su 'digest' son los de GuestBatch.
+  """
+  def __init__(self, name):
+    super().__init__(f"{name}.qcow2")
+    self.name = name
+
+  def batch(self, image=None, extra_ops=()):
+    # Copia para aplicar sobre 'image', con operaciones añadidas que no cambian el bundle
+    batch = GuestBatch(image or self.image)
+    batch.ops = list(self.ops) + list(extra_ops)
+    return batch
+
+
+def render_node(node, haproxy_cfg=None):
+  # Modificaciones propias de cada VM (nombre, direcciones y backends del balanceador);
+  # lo común al rol va en la imagen dorada
+  bundle = Bundle(node.name)
+  bundle.write("/etc/hostname", node.name)
+  bundle.write("/etc/network/interfaces", render_interfaces(node))
+  bundle.edit("/etc/hosts", f"s/127.0.1.1.*/127.0.1.1 {node.name}/")
+
+  # Página personalizada de cada servidor
+  if node.role == "server":
+    bundle.write("/var/www/html/index.html", f"<html><body><h1>Server {node.name}</h1></body></html>")
+
+  # HAProxy con los servidores actuales de la topología. Se escribe en cada arranque para
+  # que los cambios de escala no obliguen a reconstruir la imagen dorada
+  if node.role == "lb":
+    bundle.write("/etc/haproxy/haproxy.cfg", haproxy_cfg)
+  return bundle
+
+
+def render_all(topology, names=None):
+  """
+  Genera los bundles de todos los nodos (o de los indicados) de una vez.
+  haproxy.cfg se genera una vez por balanceador: solo cambia la dirección de su API de
+  administración. Devuelve {nombre: Bundle}.
+  """
+  nodes = [topology.nodes[name] for name in names] if names is not None else list(topology.nodes.values())
+  haproxy_cfgs = {node.name: render_haproxy(topology, node) for node in nodes if node.role == "lb"}
+  bundles = {node.name: render_node(node, haproxy_cfgs.get(node.name)) for node in nodes}
+  log.debug(f"{len(bundles)} bundles generados")
+  return bundles
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+
+from lib_hypervisor import PAUSED, RUNNING, SHUTOFF
+
+log = logging.getLogger('manage-p2')
+
+# Intervalo entre consultas del estado de todos los dominios (una sola llamada por consulta)
+POLL_INTERVAL = 0.5
+FIRST_POLL = 0.05
+
+# Forma en que se apagó cada dominio
+ACPI = "acpi"
+FORCED = "destroy"
+ALREADY_OFF = "ya apagada"
+MISSING = "no definida"
+FAILED = "fallida"
+
+
+class Shutdown:
+  def __init__(self, name):
+    self.name = name
+    self.method = None
+    self.elapsed = None
+    self.error = None
+
+  @property
+  def off(self):
+    return self.method in (ACPI, FORCED, ALREADY_OFF, MISSING)
+
+  def done(self, method, start):
+    self.method = method
+    self.elapsed = time.monotonic() - start
+
+
+async def list_domains(hypervisor):
+  try:
+    return await asyncio.to_thread(hypervisor.list_domains)
+  except Exception as e:
+    log.debug(f"No se pudo consultar el estado de los dominios: {e}")
+    return None
+
+
+async def call_all(func, names, limit):
+  """
+  Llama a func(nombre) para todos los dominios a la vez (como mucho 'limit' simultáneos).
+  Devuelve {nombre: excepción o None}.
+  """
+  semaphore = asyncio.Semaphore(max(1, limit))
+
+  async def one(name):
+    async with semaphore:
+      try:
+        await asyncio.to_thread(func, name)
+        return None
+      except Exception as e:
+        return e
+
+  errors = await asyncio.gather(*(one(name) for name in names))
+  return dict(zip(names, errors))
+
+
+async def shutdown_all(hypervisor, names, grace=60.0, limit=8, poll=POLL_INTERVAL):
+  """
+  Apaga los dominios indicados: envía el apagado ACPI a todos a la vez, consulta su estado
+  en bloque hasta que están apagados y, al vencer 'grace' segundos, fuerza con 'destroy'
+  los que sigan encendidos. Devuelve {nombre: Shutdown}.
+  """
+  start = time.monotonic()
+  results = {name: Shutdown(name) for name in names}
+  states = await list_domains(hypervisor)
+
+  # Si no se puede consultar el estado se intenta apagar todo
+  pending = []
+  for name in names:
+    if states is not None and name not in states:
+      results[name].done(MISSING, start)
+    elif states is not None and states[name] == SHUTOFF:
+      results[name].done(ALREADY_OFF, start)
+    else:
+      pending.append(name)
+  states = states or {}
+
+  # Un dominio en pausa no atiende el apagado ACPI: se fuerza directamente
+  forced = [name for name in pending if states.get(name) == PAUSED]
+  acpi = [name for name in pending if name not in forced]
+
+  for name, error in (await call_all(hypervisor.shutdown, acpi, limit)).items():
+    if error is not None:
+      log.warning(f"No se pudo enviar el apagado a {name}: {error}")
+      forced.append(name)
+  waiting = {name for name in acpi if name not in forced}
+
+  # Primera consulta inmediata y después cada vez más espaciadas, hasta 'poll' segundos
+  deadline = start + grace
+  delay = FIRST_POLL
+  while waiting:
+    states = await list_domains(hypervisor)
+    for name in list(waiting) if states is not None else []:
+      if states.get(name, SHUTOFF) == SHUTOFF:
+        results[name].done(ACPI, start)
+        waiting.discard(name)
+    remaining = deadline - time.monotonic()
+    if not waiting or remaining <= 0:
+      break
+    await asyncio.sleep(min(delay, remaining))
+    delay = min(delay * 2, poll)
+
+  if waiting:
+    log.warning(f"{len(waiting)} VMs siguen encendidas tras {grace} s: se fuerza su apagado.")
+  forced += sorted(waiting)
+
+  for name, error in (await call_all(hypervisor.destroy, forced, limit)).items():
+    if error is None:
+      results[name].done(FORCED, start)
+    else:
+      results[name].done(FAILED, start)
+      results[name].error = error
+
+  # Solo se da por apagado lo que el hipervisor confirma
+  states = await list_domains(hypervisor)
+  if states is not None:
+    for name, result in results.items():
+      if states.get(name) in (RUNNING, PAUSED):
+        result.method = FAILED
+        result.error = f"sigue en estado '{states[name]}'"
+      elif result.method == FAILED:
+        # 'destroy' falló porque el dominio ya estaba apagado
+        result.method = ALREADY_OFF
+  return results
+
+
+def report(results):
+  """
+  Escribe en el log cómo y en cuánto tiempo se apagó cada VM. Devuelve True si todas están apagadas.
+  """
+  for result in results.values():
+    if result.off:
+      log.info(f"VM {result.name} apagada en {result.elapsed:.2f} s ({result.method})")
+    else:
+      log.error(f"VM {result.name} no se ha podido apagar: {result.error}")
+  stopped = [r for r in results.values() if r.method in (ACPI, FORCED)]
+  if stopped:
+    slowest = max(stopped, key=lambda r: r.elapsed)
+    log.info(f"{len(stopped)} VMs apagadas en {slowest.elapsed:.2f} s (la más lenta: {slowest.name}), "
+             f"{sum(r.method == FORCED for r in stopped)} forzadas con destroy")
+  return all(result.off for result in results.values())
@@ -0,0 +1,226 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+
+import lib_trace as trace
+from lib_image import file_digest, place
+from lib_state import atomic_write_json
+
+log = logging.getLogger('manage-p2')
+
+SNAPSHOT_DIR = "snapshots"
+# Un enlace duro compartiría el fichero con la VM: sus escrituras cambiarían la instantánea
+SNAPSHOT_PLACEMENT = ("reflink", "copy")
+TAG_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class SnapshotError(Exception):
+  pass
+
+
+def save_digest(path, digest):
+  # Hash ya conocido de un fichero, guardado como lo haría file_digest para no volver a leerlo
+  st = os.stat(path)
+  with open(f"{path}.sha256", "w") as f:
+    json.dump({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}, f)
+
+
+async def run_all(func, items, limit):
+  """
+  Llama a func(elemento) en hilos, como mucho 'limit' a la vez. Devuelve {elemento: resultado}
+  y lanza la primera excepción si alguna llamada falla.
+  """
+  semaphore = asyncio.Semaphore(max(1, limit))
+
+  async def one(item):
+    async with semaphore:
+      return await asyncio.to_thread(func, item)
+
+  results = await asyncio.gather(*(one(item) for item in items), return_exceptions=True)
+  for result in results:
+    if isinstance(result, BaseException):
+      raise result
+  return dict(zip(items, results))
+
+
+class SnapshotStore:
+  """
+  Instantáneas de los overlays de las VMs. Cada overlay se guarda una sola vez en
+  <directorio>/objects/<sha256>.qcow2, de modo que los overlays idénticos (p.ej. los de
+  todos los servidores recién creados) ocupan lo de uno. Una etiqueta es un fichero
+  <directorio>/tags/<escenario>/<etiqueta>.json (<directorio>/tags/<etiqueta>.json en el
+  escenario por defecto) que indica el objeto de cada VM y los datos del estado que le
+  corresponden. Los objetos que ninguna etiqueta usa se eliminan.
+  """
+  def __init__(self, directory=SNAPSHOT_DIR, scenario=""):
+    self.directory = directory
+    self.scenario = scenario
+    self.objects = os.path.join(directory, "objects")
+    # Un directorio por escenario: las etiquetas de uno nunca coinciden con las de otro
+    self.tags_root = os.path.join(directory, "tags")
+    self.tags_dir = os.path.join(self.tags_root, scenario) if scenario else self.tags_root
+    self._lock = None
+
+  def __enter__(self):
+    # Evita que la limpieza de otro escenario borre un objeto antes de que se guarde su etiqueta
+    os.makedirs(self.objects, exist_ok=True)
+    os.makedirs(self.tags_dir, exist_ok=True)
+    self._lock = open(os.path.join(self.directory, ".lock"), "a")
+    fcntl.flock(self._lock, fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    fcntl.flock(self._lock, fcntl.LOCK_UN)
+    self._lock.close()
+    return False
+
+  def object_path(self, digest):
+    return os.path.join(self.objects, f"{digest}.qcow2")
+
+  def tag_path(self, tag):
+    if not TAG_RE.match(tag):
+      raise SnapshotError(f"Etiqueta no válida: '{tag}' (letras, números, '.', '_' y '-')")
+    return os.path.join(self.tags_dir, f"{tag}.json")
+
+  def tags(self):
+    """
+    Etiquetas del escenario: {etiqueta: manifiesto}.
+    """
+    found = {}
+    if not os.path.isdir(self.tags_dir):
+      return found
+    for entry in sorted(os.listdir(self.tags_dir)):
+      if entry.endswith(".json"):
+        manifest = self._read(os.path.join(self.tags_dir, entry))
+        if manifest is not None and manifest.get("scenario", "") == self.scenario:
+          found[manifest["tag"]] = manifest
+    return found
+
+  def _read(self, path):
+    try:
+      with open(path) as f:
+        return json.load(f)
+    except (OSError, ValueError) as e:
+      log.warning(f"No se pudo leer la etiqueta {path}: {e}")
+      return None
+
+  def load(self, tag):
+    path = self.tag_path(tag)
+    if not os.path.exists(path):
+      raise SnapshotError(f"No existe la instantánea '{tag}'")
+    manifest = self._read(path)
+    if manifest is None:
+      raise SnapshotError(f"La instantánea '{tag}' está dañada")
+    return manifest
+
+  def capture(self, tag, vms, limit=4):
+    """
+    Guarda los overlays de las VMs con la etiqueta 'tag' (la reemplaza si ya existía).
+    'vms' es {vm: datos del estado}, con la ruta del overlay en 'image'. Los hashes y la
+    copia de los objetos nuevos se hacen en paralelo; un objeto ya guardado no se copia.
+    Devuelve el manifiesto de la etiqueta.
+    """
+    path = self.tag_path(tag)
+    start = time.monotonic()
+    with trace.span("snapshot", tag=tag):
+      digests = asyncio.run(run_all(lambda name: file_digest(vms[name]["image"]), list(vms), limit))
+      sources = {}
+      for name, digest in digests.items():
+        if not os.path.exists(self.object_path(digest)):
+          sources.setdefault(digest, vms[name]["image"])
+      asyncio.run(run_all(lambda digest: self._store(sources[digest], digest), list(sources), limit))
+
+    manifest = {"tag": tag, "scenario": self.scenario, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "vms": {name: {"object": digests[name], "size": os.stat(self.object_path(digests[name])).st_size,
+                               **{key: facts.get(key) for key in ("backing", "xml_hash", "bundle_hash")}}
+                        for name, facts in vms.items()}}
+    atomic_write_json(path, manifest)
+    log.info(f"Instantánea '{tag}' de {len(vms)} VMs guardada en {time.monotonic() - start:.2f} s "
+             f"({len(sources)} objetos nuevos, {len(set(digests.values()))} distintos)")
+    return manifest
+
+  def _store(self, image, digest):
+    dest = self.object_path(digest)
+    method, _ = place(image, dest, SNAPSHOT_PLACEMENT)
+    os.chmod(dest, 0o444)
+    save_digest(dest, digest)
+    log.debug(f"{image} guardado como {dest} ({method})")
+
+  def restore(self, tag, images, limit=4):
+    """
+    Devuelve los overlays 'images' ({vm: ruta}) al contenido de la etiqueta 'tag', todos
+    en paralelo. Antes de tocar ninguno comprueba que existen todos los objetos y sus
+    imágenes base. Devuelve el manifiesto de la etiqueta.
+    """
+    manifest = self.load(tag)
+    missing = sorted(set(images) - set(manifest["vms"]))
+    if missing:
+      raise SnapshotError(f"La instantánea '{tag}' no incluye {', '.join(missing)}")
+    for name in images:
+      entry = manifest["vms"][name]
+      if not os.path.exists(self.object_path(entry["object"])):
+        raise SnapshotError(f"Falta el objeto de {name} en la instantánea '{tag}'")
+      if entry.get("backing") and not os.path.exists(entry["backing"]):
+        raise SnapshotError(f"Falta {entry['backing']}, imagen base de {name} en la instantánea '{tag}'")
+
+    def one(name):
+      digest = manifest["vms"][name]["object"]
+      method, _ = place(self.object_path(digest), images[name], SNAPSHOT_PLACEMENT)
+      os.chmod(images[name], 0o644)
+      save_digest(images[name], digest)
+      log.debug(f"{images[name]} restaurado desde la instantánea '{tag}' ({method})")
+
+    start = time.monotonic()
+    with trace.span("restore", tag=tag):
+      asyncio.run(run_all(one, list(images), limit))
+    log.info(f"{len(images)} overlays restaurados desde '{tag}' en {time.monotonic() - start:.2f} s")
+    return manifest
+
+  def delete(self, tag):
+    path = self.tag_path(tag)
+    if not os.path.exists(path):
+      raise SnapshotError(f"No existe la instantánea '{tag}'")
+    os.remove(path)
+    log.info(f"Instantánea '{tag}' eliminada")
+
+  def referenced(self):
+    """
+    Objetos e imágenes base que usa alguna etiqueta, de cualquier escenario.
+    """
+    objects, backings = set(), set()
+    for directory, _, entries in os.walk(self.tags_root):
+      for entry in entries:
+        if not entry.endswith(".json"):
+          continue
+        manifest = self._read(os.path.join(directory, entry))
+        if manifest is None:
+          continue
+        for facts in manifest.get("vms", {}).values():
+          objects.add(facts["object"])
+          if facts.get("backing"):
+            backings.add(facts["backing"])
+    return objects, backings
+
+  def gc(self):
+    """
+    Elimina los objetos que ya no usa ninguna etiqueta y las copias interrumpidas.
+    Devuelve (ficheros eliminados, bytes liberados).
+    """
+    used, _ = self.referenced()
+    removed, freed = [], 0
+    if not os.path.isdir(self.objects):
+      return removed, freed
+    for entry in sorted(os.listdir(self.objects)):
+      digest = entry.split(".", 1)[0]
+      if digest in used and not entry.endswith(".tmp"):
+        continue
+      path = os.path.join(self.objects, entry)
+      freed += os.stat(path).st_size
+      os.remove(path)
+      removed.append(path)
+      log.debug(f"Objeto de instantánea sin usar eliminado: {path}")
+    return removed, freed
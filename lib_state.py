@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger('manage-p2')
+
+VERSION = 2
+SECTIONS = ("vms", "networks", "run", "steps")
+
+# Número de cambios en el diario a partir del cual se reescribe el fichero principal
+COMPACT_EVERY = 500
+
+
+def now():
+  return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def atomic_write_json(path, data):
+  # Se escribe en un temporal del mismo directorio y se renombra: el fichero nunca queda a medias
+  tmp = f"{path}.tmp"
+  with open(tmp, "w") as f:
+    json.dump(data, f, indent=4)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, path)
+
+
+def merge(target, fields):
+  # Actualización superficial, salvo los diccionarios anidados (p. ej. 'steps'), que se combinan
+  for key, value in fields.items():
+    if isinstance(value, dict) and isinstance(target.get(key), dict):
+      target[key].update(value)
+    else:
+      target[key] = value
+
+
+class StateStore:
+  """
+  Estado persistente del escenario: datos de cada VM y red (imagen, hashes, direcciones,
+  fase y fecha de cada paso) y pasos completados por la orden en curso, para reanudarla
+  si se interrumpe.
+  Cada cambio se añade como una línea JSON a un diario (<fichero>.journal); cada
+  COMPACT_EVERY cambios, y al guardar, el estado completo se reescribe de forma atómica
+  en el fichero principal y el diario se vacía.
+  """
+  def __init__(self, path, compact_every=COMPACT_EVERY):
+    self.path = path
+    self.journal_path = f"{path}.journal"
+    self.compact_every = compact_every
+    self.lock = threading.RLock()
+    self.data = {section: {} for section in SECTIONS}
+    self.journal = None
+    self.pending = 0
+
+  @property
+  def vms(self):
+    return self.data["vms"]
+
+  @property
+  def networks(self):
+    return self.data["networks"]
+
+  @property
+  def run(self):
+    return self.data["run"]
+
+  def exists(self):
+    return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+  def load(self):
+    """
+    Lee el fichero principal y aplica encima los cambios del diario.
+    Una última línea incompleta (escritura interrumpida) se descarta y se corta del diario,
+    para que el siguiente cambio no se escriba a continuación de ella.
+    """
+    with self.lock:
+      self.data = {section: {} for section in SECTIONS}
+      if os.path.exists(self.path):
+        with open(self.path) as f:
+          snapshot = json.load(f)
+        if "version" not in snapshot:
+          # Formato anterior: {nombre: {"name": nombre, ...}}
+          snapshot = {"vms": {name: {k: v for k, v in data.items() if k != "name"}
+                              for name, data in snapshot.items()}}
+        for section in SECTIONS:
+          self.data[section] = snapshot.get(section, {})
+
+      self.pending = 0
+      if os.path.exists(self.journal_path):
+        valid = 0
+        with open(self.journal_path, "rb") as f:
+          for number, line in enumerate(f, 1):
+            try:
+              # Cada cambio se escribe con su salto de línea: sin él, la escritura no terminó
+              if not line.endswith(b"\n"):
+                raise ValueError("sin salto de línea")
+              self._apply(json.loads(line))
+            except (ValueError, KeyError):
+              log.warning(f"Línea {number} de {self.journal_path} incompleta, se descarta.")
+              break
+            valid += len(line)
+            self.pending += 1
+        if valid < os.path.getsize(self.journal_path):
+          os.truncate(self.journal_path, valid)
+      log.debug(f"Estado cargado: {len(self.vms)} VMs, {len(self.networks)} redes, "
+                f"{self.pending} cambios en el diario")
+    return self
+
+  def _apply(self, record):
+    section = self.data[record["section"]]
+    if record["op"] == "update":
+      merge(section.setdefault(record["name"], {}) if record["name"] else section, record["fields"])
+    elif record["op"] == "delete":
+      if record["name"]:
+        section.pop(record["name"], None)
+      else:
+        section.clear()
+
+  def _append(self, record):
+    with self.lock:
+      self._apply(record)
+      if self.journal is None:
+        self.journal = open(self.journal_path, "a")
+      self.journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+      self.journal.flush()
+      self.pending += 1
+      if self.pending >= self.compact_every:
+        self.compact()
+
+  def update(self, section, name=None, **fields):
+    # Sin 'name' los campos se aplican a la sección completa (como en 'run')
+    self._append({"op": "update", "section": section, "name": name, "fields": fields})
+
+  def delete(self, section, name=None):
+    self._append({"op": "delete", "section": section, "name": name})
+
+  def record(self, section, name, phase, **fields):
+    """
+    Guarda los datos de una VM o red junto con su fase actual y la fecha en que la alcanzó.
+    """
+    self.update(section, name, phase=phase, steps={phase: now()}, **fields)
+
+  def compact(self):
+    with self.lock:
+      data = dict(self.data, version=VERSION)
+      atomic_write_json(self.path, data)
+      if self.journal is not None:
+        self.journal.close()
+        self.journal = None
+      if os.path.exists(self.journal_path):
+        os.remove(self.journal_path)
+      log.debug(f"Estado compactado en {self.path} ({self.pending} cambios del diario)")
+      self.pending = 0
+
+  def clear(self):
+    with self.lock:
+      if self.journal is not None:
+        self.journal.close()
+        self.journal = None
+      for path in (self.path, self.journal_path):
+        if os.path.exists(path):
+          os.remove(path)
+      self.data = {section: {} for section in SECTIONS}
+      self.pending = 0
+
+  def begin(self, command, config):
+    """
+    Empieza una orden. Si la última ejecución de la misma orden con la misma configuración
+    quedó a medias, se reanuda y se devuelve True; si no, se descartan sus pasos.
+    """
+    run = self.run
+    if run.get("command") == command and run.get("config") == config and not run.get("finished"):
+      log.info(f"Reanudando '{command}' iniciado el {run.get('started')}: "
+               f"{len(self.data['steps'])} pasos ya completados.")
+      return True
+    self.delete("steps")
+    self.delete("run")
+    self.update("run", command=command, config=config, started=now(), finished=None)
+    return False
+
+  def done(self, step):
+    return step in self.data["steps"]
+
+  def mark(self, step):
+    self.update("steps", **{step: now()})
+
+  def finish(self):
+    self.update("run", finished=now())
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+
+from lib_hypervisor import PAUSED, RUNNING, not_found
+from lib_shutdown import call_all, list_domains
+
+log = logging.getLogger('manage-p2')
+
+
+def owned_files(names, recorded=None):
+  """
+  Ficheros que pertenecen al escenario: el overlay y el XML de cada VM, más los que
+  el estado registra para ellas. Nunca incluye la imagen base, la plantilla ni las imágenes doradas.
+  """
+  files = []
+  for name in names:
+    files += [f"{name}.qcow2", f"{name}.qcow2.sha256", f"{name}.xml"]
+  for facts in (recorded or {}).values():
+    files += [facts[key] for key in ("image", "xml") if facts.get(key)]
+  return list(dict.fromkeys(files))
+
+
+def remove_files(paths, protected=()):
+  """
+  Elimina los ficheros indicados, sin recorrer el directorio. Los ficheros protegidos
+  no se tocan aunque aparezcan en la lista. Devuelve los ficheros eliminados.
+  """
+  protected = {os.path.abspath(p) for p in protected}
+  removed = []
+  for path in paths:
+    if os.path.abspath(path) in protected:
+      log.warning(f"{path} está protegido y no se elimina.")
+      continue
+    try:
+      os.remove(path)
+      removed.append(path)
+      log.debug(f"Archivo eliminado: {path}")
+    except FileNotFoundError:
+      pass
+    except OSError as e:
+      log.error(f"No se pudo eliminar {path}: {e}")
+  return removed
+
+
+async def remove_domains(hypervisor, names, limit=8):
+  """
+  Apaga a la fuerza y elimina la definición de los dominios indicados, todos a la vez.
+  Con una sola consulta inicial se omiten los que ya están apagados o no existen.
+  Devuelve {nombre: error} de los que no se pudieron eliminar; un dominio que ya no existe
+  no cuenta como error.
+  """
+  states = await list_domains(hypervisor)
+  if states is None:
+    defined, active = list(names), list(names)
+  else:
+    defined = [name for name in names if name in states]
+    active = [name for name in defined if states[name] in (RUNNING, PAUSED)]
+
+  failed = {}
+  for name, error in (await call_all(hypervisor.destroy, active, limit)).items():
+    # Sin estado inicial no se sabe si estaba encendido: el error de destroy no es definitivo
+    if error is not None and states is not None:
+      log.error(f"Error al destruir VM {name}: {error}")
+  for name, error in (await call_all(hypervisor.undefine, defined, limit)).items():
+    if error is None:
+      log.info(f"VM {name} eliminada.")
+    elif not_found(error):
+      # Sin estado inicial se intenta con todas: las que no existen ya están eliminadas
+      log.debug(f"VM {name} no estaba definida.")
+    else:
+      failed[name] = error
+      log.error(f"Error al eliminar la definición de VM {name}: {error}")
+  return failed
+
+
+def remove_scenario_domains(hypervisor, names, limit=8):
+  return asyncio.run(remove_domains(hypervisor, names, limit))
@@ -0,0 +1,269 @@
+import ipaddress
+import logging
+import re
+
+import lib_haproxy as haproxy
+from lib_address import BlockAllocator, HostAllocator, DEFAULT_BLOCK_PREFIX, DEFAULT_NETWORK_PREFIX, DEFAULT_SCENARIO
+
+log = logging.getLogger('manage-p2')
+
+# Escenario por defecto: cliente en lan1, servidores en lan2 y el balanceador entre ambas
+DEFAULT_NETWORKS = {"lan1": "10.1.1.0/24", "lan2": "10.1.2.0/24"}
+DEFAULT_CLIENT_NETWORK = "lan1"
+DEFAULT_SERVER_NETWORKS = ["lan2"]
+
+# Prefijo de los nombres de VMs, bridges y ficheros de un escenario ('scenario' en la configuración)
+SCENARIO_RE = re.compile(r"[a-z][a-z0-9]*")
+# Longitud máxima del nombre de una interfaz de red en Linux (bridges incluidos)
+MAX_BRIDGE_NAME = 15
+
+# Posición de cada dirección dentro de su subred
+GATEWAY_HOST = 1
+CLIENT_HOST = 2
+HOST_HOST = 3
+FIRST_SERVER_HOST = 11
+
+
+class Network:
+  def __init__(self, name, subnet, bridge=None):
+    self.name = name
+    self.subnet = ipaddress.ip_network(subnet)
+    self.bridge = bridge or name
+
+  @property
+  def netmask(self):
+    return str(self.subnet.netmask)
+
+  def host(self, n):
+    # n-ésima dirección de la subred (1 = primera dirección utilizable)
+    if not 0 < n < self.subnet.num_addresses - 1:
+      raise ValueError(f"La red {self.name} ({self.subnet}) no tiene la dirección número {n}")
+    return self.subnet.network_address + n
+
+  def __repr__(self):
+    return f"Network({self.name}, {self.subnet})"
+
+
+class Interface:
+  def __init__(self, device, network, address, gateway=None):
+    self.device = device
+    self.network = network
+    self.address = ipaddress.ip_address(address)
+    self.gateway = ipaddress.ip_address(gateway) if gateway else None
+
+  @property
+  def mask(self):
+    return self.network.netmask
+
+  def __repr__(self):
+    return f"Interface({self.device}, {self.network.name}, {self.address})"
+
+
+class Node:
+  def __init__(self, name, role):
+    self.name = name
+    self.role = role
+    self.interfaces = []
+
+  def add_interface(self, network, address, gateway=None):
+    iface = Interface(f"eth{len(self.interfaces)}", network, address, gateway)
+    self.interfaces.append(iface)
+    return iface
+
+  @property
+  def networks(self):
+    return [i.network for i in self.interfaces]
+
+  @property
+  def address(self):
+    return self.interfaces[0].address
+
+  def __repr__(self):
+    return f"Node({self.name}, {self.role}, {self.interfaces})"
+
+
+class Topology:
+  """
+  Modelo del escenario: redes, nodos, interfaces, roles y direcciones.
+  Se construye una sola vez a partir de manage-p2.json y de él se generan
+  los XML de las VMs, los ficheros de red y la configuración de HAProxy.
+  """
+  def __init__(self, scenario=""):
+    if scenario and not SCENARIO_RE.fullmatch(scenario):
+      raise ValueError(f"Nombre de escenario no válido: {scenario} (minúsculas y dígitos, empezando por letra)")
+    self.scenario = scenario
+    self.networks = {}
+    self.nodes = {}
+    self.host_interface = None
+    self.host_routes = []
+    self.haproxy = haproxy.options_from_config({})
+    # Subredes del escenario (sin solapamientos) y reparto de direcciones dentro de cada una
+    self.subnets = BlockAllocator()
+    self.hosts = {}
+
+  def prefixed(self, name):
+    return f"{self.scenario}-{name}" if self.scenario else name
+
+  def add_network(self, name, subnet):
+    if name in self.networks:
+      raise ValueError(f"Red duplicada: {name}")
+    bridge = self.prefixed(name)
+    if len(bridge) > MAX_BRIDGE_NAME:
+      raise ValueError(f"El nombre del bridge {bridge} supera {MAX_BRIDGE_NAME} caracteres")
+    network = Network(name, subnet, bridge)
+    self.subnets.reserve(name, network.subnet)
+    self.networks[name] = network
+    self.hosts[name] = HostAllocator(network.subnet)
+    return network
+
+  def add_node(self, name, role):
+    if name in self.nodes:
+      raise ValueError(f"Nodo duplicado: {name}")
+    self.nodes[name] = Node(name, role)
+    return self.nodes[name]
+
+  def connect(self, node, network, start, gateway=None):
+    # Conecta el nodo a la red con la primera dirección libre a partir de la posición 'start'
+    return node.add_interface(network, self.hosts[network.name].allocate(node.name, start), gateway)
+
+  def node_at(self, address):
+    # Nodo que tiene la dirección indicada, o None
+    network = self.subnets.owner_of(address)
+    owner = self.hosts[network].owner_of(address) if network else None
+    return self.nodes.get(owner)
+
+  def by_role(self, role):
+    return [node for node in self.nodes.values() if node.role == role]
+
+  @property
+  def servers(self):
+    return self.by_role("server")
+
+  @property
+  def balancers(self):
+    return self.by_role("lb")
+
+  @property
+  def clients(self):
+    return self.by_role("client")
+
+  @classmethod
+  def from_config(cls, config, allocator=None):
+    """
+    Construye la topología a partir de la configuración:
+      scenario: prefijo de los nombres de VMs, bridges y ficheros (vacío por defecto).
+      number_of_servers: número de servidores web.
+      number_of_balancers: número de balanceadores ('lb', o 'lb1', 'lb2'... si hay varios).
+      networks: {nombre: subred} de los bridges del escenario.
+      client_network: red del cliente y del host.
+      server_networks: redes entre las que se reparten los servidores.
+      address_block, network_prefix: tamaño del bloque del escenario y de cada red
+        cuando las subredes se reparten desde 'allocator'.
+      haproxy: opciones de balanceo de lib_haproxy.
+    Con 'allocator' (un BlockAllocator compartido por los escenarios del host), un escenario
+    con nombre y sin 'networks' recibe un bloque libre y sus redes salen de él; las redes
+    indicadas explícitamente se reservan para que ningún otro escenario las use.
+    """
+    topo = cls(config.get("scenario", ""))
+    topo.haproxy = haproxy.options_from_config(config.get("haproxy", {}))
+    client_name = config.get("client_network", DEFAULT_CLIENT_NETWORK)
+    server_names = config.get("server_networks", DEFAULT_SERVER_NETWORKS)
+    for name, subnet in scenario_networks(config, [client_name] + list(server_names), allocator).items():
+      topo.add_network(name, subnet)
+
+    client_net = topo.networks[client_name]
+    server_nets = [topo.networks[n] for n in server_names]
+    if not server_nets:
+      raise ValueError("Se necesita al menos una red de servidores")
+    if client_net in server_nets:
+      raise ValueError(f"La red {client_net.name} no puede ser a la vez de cliente y de servidores")
+
+    number_of_servers = int(config.get("number_of_servers", 0))
+    number_of_balancers = int(config.get("number_of_balancers", 1))
+    if number_of_balancers < 1:
+      raise ValueError(f"Se necesita al menos un balanceador: {number_of_balancers}")
+
+    # Balanceadores conectados a todas las redes, desde la primera dirección de cada una
+    balancers = []
+    for i in range(1, number_of_balancers + 1):
+      lb = topo.add_node(topo.prefixed("lb" if number_of_balancers == 1 else f"lb{i}"), "lb")
+      for net in [client_net] + server_nets:
+        topo.connect(lb, net, GATEWAY_HOST)
+      balancers.append(lb)
+
+    # El primero es la puerta de enlace de cada red
+    gateways = {iface.network.name: iface.address for iface in balancers[0].interfaces}
+
+    # Servidores repartidos entre sus redes, con el balanceador como puerta de enlace
+    for i in range(1, number_of_servers + 1):
+      net = server_nets[(i - 1) % len(server_nets)]
+      node = topo.add_node(topo.prefixed(f"s{i}"), "server")
+      topo.connect(node, net, FIRST_SERVER_HOST, gateways[net.name])
+
+    c1 = topo.add_node(topo.prefixed("c1"), "client")
+    topo.connect(c1, client_net, CLIENT_HOST, gateways[client_net.name])
+
+    # El host se conecta a la red del cliente y llega al resto a través del balanceador.
+    # Se usa una única ruta que engloba todas las redes (como la 10.1.0.0/16 original), menos
+    # específica que las rutas directas de los bridges del host
+    topo.host_interface = Interface("host", client_net, topo.hosts[client_net.name].allocate("host", HOST_HOST))
+    topo.host_routes = [(supernet(topo.networks.values()), gateways[client_net.name])]
+
+    # Orden de siempre: servidores, balanceadores y cliente
+    topo.nodes = {node.name: node for node in topo.servers + topo.balancers + topo.clients}
+
+    log.debug(f"Topología: {len(topo.networks)} redes, {len(topo.nodes)} nodos")
+    return topo
+
+
+def scenario_networks(config, names, allocator=None):
+  """
+  Subredes del escenario: las de 'networks' o, para un escenario con nombre y un
+  'allocator', redes /network_prefix consecutivas dentro del bloque que le corresponde.
+  El bloque que engloba las redes queda reservado a nombre del escenario en 'allocator'.
+  """
+  scenario = config.get("scenario", "")
+  networks = config.get("networks")
+  if networks is None and scenario and allocator is not None:
+    block = allocator.allocate(scenario, int(config.get("address_block", DEFAULT_BLOCK_PREFIX)))
+    prefix = int(config.get("network_prefix", DEFAULT_NETWORK_PREFIX))
+    if prefix < block.prefixlen or 2 ** (prefix - block.prefixlen) < len(names):
+      raise ValueError(f"El bloque {block} no tiene sitio para {len(names)} redes /{prefix}")
+    return {name: str(subnet) for name, subnet in zip(names, block.subnets(new_prefix=prefix))}
+
+  networks = networks or DEFAULT_NETWORKS
+  if allocator is not None:
+    allocator.reserve(scenario or DEFAULT_SCENARIO,
+                      supernet([Network(name, subnet) for name, subnet in networks.items()]))
+  return networks
+
+
+def supernet(networks):
+  # Menor subred que contiene a todas las redes dadas
+  subnets = [net.subnet for net in networks]
+  candidate = subnets[0]
+  while not all(subnet.subnet_of(candidate) for subnet in subnets):
+    candidate = candidate.supernet()
+  return candidate
+
+
+def render_interfaces(node):
+  # Contenido de /etc/network/interfaces para un nodo
+  lines = ["auto lo", "iface lo inet loopback"]
+  for iface in node.interfaces:
+    lines += ["", f"auto {iface.device}",
+              f"iface {iface.device} inet static",
+              f"    address {iface.address}",
+              f"    netmask {iface.mask}"]
+    if iface.gateway:
+      lines.append(f"    gateway {iface.gateway}")
+  return "\n".join(lines) + "\n"
+
+
+def render_haproxy(topology, lb=None):
+  # Configuración de HAProxy de un balanceador (el primero si no se indica) con exactamente
+  # los servidores del escenario como backends. Su API de administración escucha en su
+  # dirección de la red del host y solo admite al host
+  lb = lb or topology.balancers[0]
+  servers = [(server.name, server.address, 80) for server in topology.servers]
+  return haproxy.render(servers, topology.haproxy, lb.address, [topology.host_interface.address])
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger('manage-p2')
+
+# Desactivado por defecto: span() devuelve siempre el mismo objeto vacío y no mide nada
+_enabled = False
+_events = []
+_lock = threading.Lock()
+_local = threading.local()
+_origin = 0.0
+
+
+class NullSpan:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def set(self, **args):
+    pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+  """
+  Intervalo medido de un paso o de un comando externo. Los spans abiertos dentro de otro
+  en el mismo hilo quedan anidados y heredan su carril (la VM o tarea a la que pertenecen).
+  """
+  __slots__ = ("name", "category", "lane", "args", "start")
+
+  def __init__(self, name, category, lane, args):
+    self.name = name
+    self.category = category
+    self.lane = lane
+    self.args = args
+    self.start = None
+
+  def __enter__(self):
+    stack = _stack()
+    if self.lane is None:
+      self.lane = stack[-1].lane if stack else threading.current_thread().name
+    stack.append(self)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    end = time.perf_counter()
+    _stack().pop()
+    if exc_type is not None:
+      self.args["error"] = str(exc) or exc_type.__name__
+    with _lock:
+      _events.append((self.name, self.category, self.lane, self.start, end - self.start, self.args))
+    return False
+
+  def set(self, **args):
+    self.args.update(args)
+
+
+def _stack():
+  try:
+    return _local.stack
+  except AttributeError:
+    _local.stack = []
+    return _local.stack
+
+
+def enable():
+  global _enabled, _origin
+  with _lock:
+    _events.clear()
+  _origin = time.perf_counter()
+  _enabled = True
+
+
+def disable():
+  global _enabled
+  _enabled = False
+
+
+def enabled():
+  return _enabled
+
+
+def span(name, lane=None, **args):
+  """
+  Mide un paso lógico ('with span("define", vm.name): ...'). 'lane' agrupa los pasos
+  en la línea temporal; si no se indica, se hereda del span que lo contiene.
+  """
+  if not _enabled:
+    return NULL_SPAN
+  return Span(name, "step", lane, args)
+
+
+def command(argv):
+  # Mide un comando externo; se agrupa por programa y subcomando ('virsh define', 'qemu-img create')
+  if not _enabled:
+    return NULL_SPAN
+  return Span(command_name(argv), "cmd", None, {"argv": " ".join(str(a) for a in argv)})
+
+
+def command_name(argv):
+  args = [str(a) for a in argv]
+  if args and args[0] == "sudo":
+    args = args[1:]
+  if not args:
+    return "?"
+  name = os.path.basename(args[0])
+  if len(args) > 1 and not args[1].startswith("-"):
+    name += f" {args[1]}"
+  return name
+
+
+def events():
+  with _lock:
+    return list(_events)
+
+
+def summary():
+  """
+  Agrupa los spans por nombre. Devuelve filas (nombre, categoría, veces, total, máximo)
+  ordenadas por tiempo acumulado.
+  """
+  rows = {}
+  for name, category, _, _, duration, _ in events():
+    row = rows.setdefault(name, [name, category, 0, 0.0, 0.0])
+    row[2] += 1
+    row[3] += duration
+    row[4] = max(row[4], duration)
+  return sorted((tuple(row) for row in rows.values()), key=lambda row: -row[3])
+
+
+def report(limit=25):
+  rows = summary()
+  if not rows:
+    return
+  log.info(f"{'Paso':<32} {'Tipo':<5} {'Veces':>6} {'Total (s)':>10} {'Media (ms)':>11} {'Máx (ms)':>10}")
+  for name, category, count, total, longest in rows[:limit]:
+    log.info(f"{name[:32]:<32} {category:<5} {count:>6} {total:>10.3f} "
+             f"{1000 * total / count:>11.1f} {1000 * longest:>10.1f}")
+
+
+def export_chrome(path):
+  """
+  Guarda los spans en formato Chrome trace (chrome://tracing, Perfetto): un carril
+  por VM o tarea, con los pasos y comandos anidados dentro de cada uno.
+  """
+  lanes = {}
+  trace = []
+  for name, category, lane, start, duration, args in events():
+    if lane not in lanes:
+      lanes[lane] = len(lanes) + 1
+      trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": lanes[lane], "args": {"name": lane}})
+    trace.append({"name": name, "cat": category, "ph": "X", "pid": 1, "tid": lanes[lane],
+                  "ts": round((start - _origin) * 1e6, 1), "dur": round(duration * 1e6, 1), "args": args})
+  directory = os.path.dirname(path)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  with open(path, "w") as f:
+    json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+  return path
@@ -0,0 +1,74 @@
+import copy
+import logging
+import os
+import threading
+from lxml import etree
+
+log = logging.getLogger('manage-p2')
+
+TEMPLATE = "plantilla-vm-pc1.xml"
+
+
+class DomainTemplate:
+  """
+  Plantilla XML de dominio libvirt.
+  El fichero se analiza una sola vez (mientras no cambie en disco) y cada VM
+  se genera a partir de una copia en memoria del árbol.
+  """
+  _cache = {}
+  _lock = threading.Lock()
+
+  def __init__(self, root):
+    self.root = root
+
+  @classmethod
+  def load(cls, path=TEMPLATE):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with cls._lock:
+      template = cls._cache.get(key)
+      if template is None:
+        log.debug(f"Cargando plantilla XML: {path}")
+        template = cls(etree.parse(path).getroot())
+        cls._cache = {key: template}
+    return template
+
+  @classmethod
+  def from_string(cls, text):
+    return cls(etree.fromstring(text.encode() if isinstance(text, str) else text))
+
+  def render(self, node, image_path):
+    """
+    Devuelve el elemento <domain> de un nodo de la topología: nombre, disco
+    y una interfaz conectada a cada uno de sus bridges.
+    """
+    root = copy.deepcopy(self.root)
+
+    root.find("name").text = node.name
+    root.find("./devices/disk/source").set("file", image_path)
+
+    # La primera interfaz de la plantilla se conecta a la primera red del nodo
+    bridges = [net.bridge for net in node.networks]
+    interface = root.find("./devices/interface")
+    interface.find("source").set("bridge", bridges[0])
+    etree.SubElement(interface, "virtualport", type='openvswitch')
+
+    # Añadimos una interfaz más por cada red adicional (p.ej. el balanceador)
+    devices = root.find("devices")
+    for extra in bridges[1:]:
+      interface = etree.SubElement(devices, "interface", type="bridge")
+      etree.SubElement(interface, "source", bridge=extra)
+      etree.SubElement(interface, "model", type="virtio")
+      etree.SubElement(interface, "virtualport", type='openvswitch')
+
+    if log.isEnabledFor(logging.DEBUG):
+      log.debug(f"XML generado para {node.name} (bridges {bridges}):\n{to_string(root)}")
+    return root
+
+
+def to_string(root):
+  return etree.tostring(root, pretty_print=True, encoding="unicode")
+
+
+def write(root, path):
+  etree.ElementTree(root).write(path, pretty_print=True, xml_declaration=True, encoding="UTF-8")
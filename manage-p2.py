@@ -1,10 +1,18 @@
 #!/usr/bin/env python
 
-from lib_vm import VM, NET
+# Solo se importan aquí los módulos ligeros. Cada orden importa los subsistemas que usa
+# (lxml, asyncio, libvirt...), de modo que p.ej. 'status' no carga ninguno.
+from lib_config import Config, ConfigError, check_option, CONFIG_FILE as DEFAULT_CONFIG_FILE
+from lib_address import AddressError
+from lib_state import StateStore, atomic_write_json
+import lib_trace as trace
 import logging, sys
-import subprocess
+import argparse
+import glob
 import json
 import os
+import re
+import time
 
 def init_log():
     """
@@ -12,14 +20,10 @@ def init_log():
     Modo 'debug: false': Mensajes breves de información.
     Modo 'debug: true': Mensajes detallados de depuración.
     """
-    try:
-        # Leer configuración desde el archivo JSON
-        with open('manage-p2.json') as f:
-            config = json.load(f)
-            debug_mode = config.get("debug", False)
-    except FileNotFoundError:
-        print("Archivo 'manage-p2.json' no encontrado. Usando configuración por defecto.")
-        debug_mode = False
+    config = get_config()
+    if not config.found:
+        print(f"Archivo '{CONFIG_FILE}' no encontrado. Usando configuración por defecto.")
+    debug_mode = config.get("debug", False)
 
     # Configurar el nivel de logging
     log_level = logging.DEBUG if debug_mode else logging.INFO
@@ -36,48 +40,102 @@ def init_log():
 def pause():
     """
     Pausa la ejecución del programa para permitir al usuario revisar el estado.
+    En modo sin interacción no se detiene.
     """
+    if is_headless():
+        logging.debug("Modo sin interacción: no se espera a <ENTER>.")
+        return
     programPause = input("-- Press <ENTER> to continue...")
 
 
+def is_headless():
+    """
+    Indica si se ejecuta sin interacción: con --headless, con 'headless: true' en el archivo
+    JSON o cuando la entrada estándar no es un terminal (p. ej. en CI).
+    """
+    if HEADLESS is not None:
+        return HEADLESS
+    return bool(get_option("headless", False)) or not (sys.stdin and sys.stdin.isatty())
+
+
+def get_console_mode():
+    """
+    Forma de mostrar las consolas de las VMs (--consoles o 'consoles' en el archivo JSON):
+    'xterm', 'log' o 'none'. Por defecto 'xterm', salvo sin interacción, que es 'none'.
+    """
+    from lib_console import CONSOLE_MODES
+    mode = CONSOLES or get_option("consoles") or ("none" if is_headless() else "xterm")
+    if mode not in CONSOLE_MODES:
+        raise ValueError(f"Modo de consola no válido: {mode} (válidos: {', '.join(CONSOLE_MODES)})")
+    return mode
+
+
+def get_console_collector():
+    """
+    Devuelve el lector único de consolas, que guarda la de cada VM en 'console_dir',
+    rotando cada fichero al superar 'console_max_bytes' y conservando 'console_backups'.
+    """
+    from lib_console import ConsoleCollector, MAX_BYTES, BACKUPS, DEFAULT_DIR as CONSOLE_DIR
+    global console_collector
+    if console_collector is None:
+        console_collector = ConsoleCollector(get_hypervisor(), get_option("console_dir", CONSOLE_DIR),
+                                             max_bytes=get_option("console_max_bytes", MAX_BYTES),
+                                             backups=get_option("console_backups", BACKUPS))
+    return console_collector
+
+
+def close_consoles():
+    """
+    Cierra las consolas abiertas por el lector único al terminar la orden.
+    """
+    if console_collector is not None:
+        console_collector.close()
+
+
 def preconfig():
     """
     Configura el entorno inicial para el balanceador de tráfico.
     Modo 'debug: false': Informa sobre el progreso general de la configuración.
     Modo 'debug: true': Proporciona información detallada sobre cada paso y sus resultados.
     """
+    import subprocess
+    import lib_cmd as cmd
+    from lib_image import DEFAULT_PLACEMENT, ImageError, ensure_image
     try:
-        # Verificar si el archivo qcow2 ya está en el directorio actual
-        if not os.path.exists("cdps-vm-base-pc1.qcow2"):
-            subprocess.check_call(["cp", "/lab/cdps/pc1/cdps-vm-base-pc1.qcow2", "."])
-            print("Archivo cdps-vm-base-pc1.qcow2 copiado correctamente.")  
-            logging.debug("Archivo cdps-vm-base-pc1.qcow2 copiado desde /lab/cdps/pc1.")
+        # Imagen base: se coloca con reflink, enlace o copia y se comprueba que está al día e íntegra
+        placed = ensure_image(BASE_IMAGE_SOURCE, BASE_IMAGE, get_option("base_image_placement", DEFAULT_PLACEMENT))
+        if placed:
+            print(f"Archivo {BASE_IMAGE} colocado correctamente.")
         else:
-            print("Archivo cdps-vm-base-pc1.qcow2 ya existe, no se copia de nuevo.")
-            logging.debug("Archivo cdps-vm-base-pc1.qcow2 ya presente en el directorio de trabajo.")
+            print(f"Archivo {BASE_IMAGE} ya existe y está al día, no se copia de nuevo.")
 
         # Verificar si el archivo XML ya está en el directorio actual
         if not os.path.exists("plantilla-vm-pc1.xml"):
-            subprocess.check_call(["cp", "/lab/cdps/pc1/plantilla-vm-pc1.xml", "."])
+            cmd.run(["cp", "/lab/cdps/pc1/plantilla-vm-pc1.xml", "."])
             print("Archivo plantilla-vm-pc1.xml copiado correctamente.")
-            logging.debug("Archivo plantilla-vm-pc1.xml copiado desde /lab/cdps/pc1.")        
+            logging.debug("Archivo plantilla-vm-pc1.xml copiado desde /lab/cdps/pc1.")
         else:
             print("Archivo plantilla-vm-pc1.xml ya existe, no se copia de nuevo.")
-            logging.debug("Archivo plantilla-vm-pc1.xml copiado desde /lab/cdps/pc1.")
+            logging.debug("Archivo plantilla-vm-pc1.xml ya presente en el directorio de trabajo.")
 
         # Ejecutar prepare-vnx-debian solo si es necesario
         prepare_vnx_path = "/lab/cnvr/bin/prepare-vnx-debian"
         if os.path.exists(prepare_vnx_path) and os.access(prepare_vnx_path, os.X_OK):
-            subprocess.check_call([prepare_vnx_path])
+            cmd.run([prepare_vnx_path])
             print("prepare-vnx-debian ejecutado correctamente.")
             logging.debug("Comando prepare-vnx-debian ejecutado para preparar el entorno de virtualización.")
         else:
             print(f"No se puede ejecutar {prepare_vnx_path}. Verifica que exista y tenga permisos de ejecución.")
             logging.debug(f"Comando prepare-vnx-debian no encontrado o sin permisos de ejecución en {prepare_vnx_path}.")
+        return True
         
     except subprocess.CalledProcessError as e:
         print(f"Failed to execute: {e}")
         logging.error(f"Error al ejecutar comando: {e}")
+        return False
+    except (ImageError, OSError) as e:
+        logging.error(f"Error al preparar la imagen base: {e}")
+        return False
 
 
 # Leer el archivo manage-p2.json para obtener el número de servidores
@@ -87,282 +145,1496 @@ def get_number_of_servers():
     Modo 'debug: false': Indica el número leído.
     Modo 'debug: true': Incluye detalles de la estructura del archivo.
     """
-    with open('manage-p2.json') as f:
-        config = json.load(f)
+    config = get_config()
     logging.info(f"Número de servidores configurados: {config.get('number_of_servers', 0)}")
-    logging.debug(f"Configuración JSON completa: {config}")
+    logging.debug(f"Configuración JSON completa: {config.data}")
     return config.get("number_of_servers", 0)
 
 
+# Configuración del escenario, leída y comprobada una sola vez por orden
+def get_config():
+    """
+    Devuelve la configuración del archivo JSON (--config), leída la primera vez que se pide.
+    Lanza ConfigError si no es válida.
+    """
+    global config
+    if config is None:
+        config = Config.load(CONFIG_FILE)
+    return config
+
+
+# Leer una opción del archivo manage-p2.json
+def get_option(key, default=None):
+    """
+    Devuelve el valor de una opción del archivo JSON, o 'default' si no está definida.
+    """
+    return get_config().get(key, default)
+
+
+# Modificar una opción del archivo manage-p2.json
+def set_option(key, value):
+    """
+    Guarda una opción en el archivo JSON y descarta la topología construida con el valor anterior.
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica la opción modificada.
+    """
+    global topology
+    get_config().set(key, value)
+    topology = None
+    logging.debug(f"Opción {key} actualizada a {value} en {CONFIG_FILE}")
+
+
+# Cambiar una opción solo para la orden en curso
+def override_option(key, value):
+    """
+    Cambia una opción en memoria, sin guardarla en el archivo JSON, y descarta la topología
+    construida con el valor anterior. Lanza ConfigError si el valor no es válido.
+    """
+    global topology
+    get_config().override(key, value)
+    topology = None
+
+
+# Leer el número máximo de operaciones simultáneas
+def get_max_workers():
+    """
+    Lee el límite de concurrencia desde el archivo JSON.
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica el límite utilizado.
+    """
+    max_workers = max(1, int(get_option("max_workers", 4)))
+    logging.debug(f"Límite de operaciones simultáneas: {max_workers}")
+    return max_workers
+
+
+# Construir la topología del escenario una sola vez a partir del archivo JSON
+def get_topology():
+    """
+    Devuelve la topología del escenario (redes, nodos, interfaces y direcciones).
+    Las subredes se reparten desde el registro de direcciones del host ('address_registry'),
+    compartido por todos los escenarios, para que no se solapen con las de otro. Solo las
+    órdenes que crean o cambian el escenario (RESERVE_ADDRESSES) guardan la reserva; el
+    resto lee el registro sin bloquearlo ni modificarlo.
+    Lanza AddressError si las redes del escenario no caben o se solapan con las de otro.
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Lista los nodos y sus interfaces.
+    """
+    from lib_topology import Topology
+    from lib_address import Registry, DEFAULT_POOL
+    global topology
+    if topology is None:
+        registry = Registry(get_registry_path(), get_option("address_pool", DEFAULT_POOL))
+        if RESERVE_ADDRESSES:
+            with registry as allocator:
+                topology = Topology.from_config(get_config().data, allocator)
+        else:
+            topology = Topology.from_config(get_config().data, registry.read())
+        for node in topology.nodes.values():
+            logging.debug(f"Nodo {node.name} ({node.role}): {node.interfaces}")
+    return topology
+
+
+# Escenario activo ('scenario' en el archivo JSON) y nombres de sus ficheros
+def get_scenario():
+    """
+    Devuelve el nombre del escenario, que se usa como prefijo de VMs, bridges y ficheros
+    ("" para el escenario por defecto, sin prefijo).
+    """
+    return get_option("scenario", "")
+
+
+def scenario_file(name):
+    """
+    Nombre de un fichero propio del escenario ('t1-vm_state.json' para el escenario 't1').
+    """
+    scenario = get_scenario()
+    return f"{scenario}-{name}" if scenario else name
+
+
+def get_snapshots():
+    """
+    Almacén de instantáneas de los overlays ('snapshot_dir', por defecto snapshots/),
+    compartido por los escenarios del directorio; las etiquetas llevan el prefijo del escenario.
+    """
+    from lib_snapshot import SnapshotStore, SNAPSHOT_DIR
+    return SnapshotStore(get_option("snapshot_dir", SNAPSHOT_DIR), get_scenario())
+
+
+def get_registry_path():
+    """
+    Ruta del registro de bloques de direcciones compartido por los escenarios del host.
+    """
+    return os.path.expanduser(get_option("address_registry", ADDRESS_REGISTRY))
+
+
+# Backend de hipervisor compartido por todas las VMs
+def get_hypervisor():
+    """
+    Devuelve el backend de hipervisor configurado ('virsh', 'libvirt' o 'fake').
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica el backend utilizado.
+    """
+    from lib_hypervisor import get_backend
+    global hypervisor
+    if hypervisor is None:
+        kind = get_option("hypervisor", "virsh")
+        hypervisor = get_backend(kind, get_option("libvirt_uri", "qemu:///system"), FAKE_HYPERVISOR_FILE)
+        logging.debug(f"Backend de hipervisor: {kind}")
+    return hypervisor
+
+
+# Ejecución de los comandos externos (qemu-img, virsh, guestfish, ovs-vsctl, ip...)
+def configure_runner(mode="run", recording=None):
+    """
+    Configura el runner de comandos con las opciones del archivo JSON: command_timeouts
+    ({programa: segundos}), command_retries y dry_run_delay (duración simulada de cada comando).
+    Modo 'debug: false': Avisa si los comandos no se van a ejecutar.
+    Modo 'debug: true': Indica los tiempos máximos por programa.
+    """
+    import lib_cmd as cmd
+    runner = cmd.Runner(mode,
+                        timeouts=get_option("command_timeouts", {}),
+                        retries=get_option("command_retries", 2),
+                        recording=recording,
+                        delay=get_option("dry_run_delay", 0))
+    cmd.set_runner(runner)
+    if runner.simulated:
+        logging.warning(f"Modo '{mode}': los comandos externos no se ejecutan.")
+    logging.debug(f"Tiempos máximos por comando: {runner.timeouts}")
+    return runner
+
+
+def step(ok, message):
+    """
+    Convierte el resultado de una operación de lib_vm en una excepción para el ejecutor,
+    de modo que las tareas que dependen de ella no se lancen.
+    """
+    if not ok:
+        raise RuntimeError(message)
+
+
 
 vms = {} # Diccionario global para almacenar las VMs y redes.
-STATE_FILE = "vm_state.json"  # Archivo para guardar el estado de las VMs
+config = None # Configuración del escenario, leída por get_config()
+topology = None # Topología del escenario, construida por get_topology()
+hypervisor = None # Backend de hipervisor, creado por get_hypervisor()
+state = None # Estado persistente del escenario, cargado por get_state()
+console_collector = None # Lector único de consolas, creado por get_console_collector()
+HEADLESS = None  # --headless; si no se indica, se decide con is_headless()
+CONSOLES = None  # --consoles; si no se indica, se usa 'consoles' del archivo JSON
+RESERVE_ADDRESSES = False  # La orden crea o cambia el escenario y reserva sus redes en el registro
+SUMMARY_FILE = None  # --summary: fichero del resumen de 'up' y 'down'
+# Códigos de salida de 'up' y 'down'
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_NOT_READY = 2
+FAKE_HYPERVISOR_FILE = "fake-hypervisor.json"  # Estado del hipervisor simulado ('hypervisor: fake')
+STATE_FILE = "vm_state.json"  # Archivo para guardar el estado de las VMs (con el prefijo del escenario)
+CONFIG_FILE = DEFAULT_CONFIG_FILE  # Configuración del escenario (--config para usar otra)
+ADDRESS_REGISTRY = "~/.manage-p2/addresses.json"  # Bloques de direcciones de todos los escenarios del host
+BASE_IMAGE = "cdps-vm-base-pc1.qcow2"
+BASE_IMAGE_SOURCE = "/lab/cdps/pc1/cdps-vm-base-pc1.qcow2"
+ROLES = ("server", "lb", "client")
+
+# Estado persistente compartido por todas las órdenes
+def get_state():
+    """
+    Devuelve el almacén de estado del escenario (vm_state.json y su diario).
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica el contenido cargado.
+    """
+    global state
+    if state is None:
+        state = StateStore(scenario_file(STATE_FILE)).load()
+    return state
+
+
+def config_digest():
+    """
+    Hash de la configuración: una orden interrumpida solo se reanuda si no ha cambiado.
+    """
+    return get_config().digest()
+
+
+def vm_facts(vm):
+    """
+    Datos de una VM que se guardan en el estado: los que usa 'apply' para saber qué está
+    ya al día y, si está en la topología, su rol y sus direcciones.
+    """
+    facts = {"image": f"{vm.name}.qcow2", "xml": vm.xml_file, "backing": vm.backing, "xml_hash": vm.xml_hash,
+             "bundle_hash": vm.bundle_hash}
+    if vm.node is not None:
+        facts["role"] = vm.role
+        facts["addresses"] = [f"{i.address}/{i.network.subnet.prefixlen}" for i in vm.node.interfaces]
+    return facts
+
+
+def record_vm(vm, phase):
+    """
+    Registra en el estado los datos de una VM y la fase que acaba de alcanzar.
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica la fase registrada.
+    """
+    get_state().record("vms", vm.name, phase, **vm_facts(vm))
+    logging.debug(f"VM {vm.name} en fase '{phase}'")
+
+
+def image_step(vm, golden_paths):
+    """
+    Crea el overlay de una VM sobre la imagen dorada de su rol y lo registra.
+    Pasos comunes de 'create', 'up', 'apply' y 'scale'; lanzan una excepción si fallan.
+    """
+    step(vm.create_image(golden_paths[vm.role]), f"Error al crear la imagen de {vm.name}")
+    record_vm(vm, "image")
+
+
+def define_step(vm):
+    """
+    Define una VM en el hipervisor (con 'xml_files: false', sin guardar su XML) y lo registra.
+    """
+    step(vm.define_vm(write_file=get_option("xml_files", True)), f"Error al definir {vm.name}")
+    record_vm(vm, "defined")
+
+
+def start_step(vm, topo, bundle=None):
+    """
+    Aplica los ficheros propios de una VM sobre su imagen, la arranca y lo registra.
+    """
+    step(vm.start_vm(topo, bundle=bundle), f"Error al arrancar {vm.name}")
+    record_vm(vm, "running")
+
+
+def record_net(net, phase):
+    """
+    Registra en el estado los datos de una red de la topología y su fase.
+    """
+    get_state().record("networks", net.name, phase, bridge=net.bridge, subnet=str(net.subnet))
+
+
+def checkpoint(name, func, resume, valid=None):
+    """
+    Envuelve una tarea del ejecutor para que se registre al terminar y se omita al reanudar
+    una orden interrumpida si ya se completó ('valid' comprueba que su resultado sigue ahí).
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica los pasos omitidos.
+    """
+    def run():
+        if resume and get_state().done(name) and (valid is None or valid()):
+            logging.debug(f"Paso {name} ya completado en la ejecución anterior, se omite.")
+            return
+        func()
+        get_state().mark(name)
+    return run
+
+
+def known_domains():
+    """
+    Estado de todos los dominios del hipervisor ({} si no se puede consultar).
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica el error de la consulta.
+    """
+    from lib_hypervisor import HypervisorError
+    try:
+        return get_hypervisor().list_domains()
+    except HypervisorError as e:
+        logging.debug(f"No se pudo consultar la lista de dominios: {e}")
+        return {}
+
 
 # Guardar el estado de las VMs en un archivo JSON
 def save_state():
     """
-    Guarda el estado actual de las VMs en un archivo JSON.
+    Guarda el estado actual de las VMs y redes y lo compacta en el archivo JSON.
     Modo 'debug: false': Confirma el guardado del estado.
     Modo 'debug: true': Describe el contenido guardado en detalle.
     """
-    state = {name: {"name": vm.name} for name, vm in vms.items()}
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=4)
-    logging.info(f"Estado guardado en {STATE_FILE}")
-    logging.debug(f"Contenido del estado guardado: {state}")
+    from lib_vm import NET
+    store = get_state()
+    for name, vm in vms.items():
+        if isinstance(vm, NET):
+            continue
+        facts = vm_facts(vm)
+        current = store.vms.get(name, {})
+        if any(current.get(key) != value for key, value in facts.items()):
+            store.update("vms", name, **facts)
+    for name in [name for name in store.vms if name not in vms]:
+        store.delete("vms", name)
+    store.compact()
+    logging.info(f"Estado guardado en {store.path}")
+    logging.debug(f"Contenido del estado guardado: {store.data}")
 
 
 # Cargar el estado de las VMs desde un archivo JSON
 def load_state():
     """
-    Carga el estado de las VMs desde un archivo JSON si existe.
+    Carga el estado de las VMs y redes desde el archivo JSON (y su diario) si existe.
     Modo 'debug: false': Indica si el estado fue cargado o no.
     Modo 'debug: true': Proporciona detalles del estado cargado.
     """
-    global vms
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r") as f:
-            state = json.load(f)
-        for name, data in state.items():
-            vms[name] = VM(data["name"])
-        logging.info(f"Estado cargado desde {STATE_FILE}")
-        logging.debug(f"Estado cargado: {state}")
+    from lib_vm import VM, NET
+    store = get_state()
+    if store.exists():
+        topo = get_topology()
+        for name in store.networks:
+            vms[name] = NET(name)
+        for name, data in store.vms.items():
+            if name in topo.networks:
+                # Estado antiguo: las redes se guardaban junto a las VMs
+                vms[name] = NET(name)
+                continue
+            vm = VM(name, topo.nodes.get(name), hypervisor=get_hypervisor())
+            vm.backing = data.get("backing")
+            vm.xml_hash = data.get("xml_hash")
+            vm.xml_file = data.get("xml")
+            vm.bundle_hash = data.get("bundle_hash")
+            vms[name] = vm
+        logging.info(f"Estado cargado desde {store.path}")
+        logging.debug(f"Estado cargado: {store.data}")
     else:
-        logging.warning(f"No se encontró el archivo {STATE_FILE}. Ejecuta 'create' primero.")
+        logging.warning(f"No se encontró el archivo {store.path}. Ejecuta 'create' primero.")
 
 
 # Borrar el archivo de estado antes de guardar nuevas configuraciones
 def clear_state_file():
     """
-    Elimina el archivo de estado JSON si existe.
+    Elimina el archivo de estado JSON y su diario si existen.
     Modo 'debug: false': Indica si el archivo fue eliminado o no existe.
     Modo 'debug: true': Proporciona detalles adicionales del proceso.
     """
-    if os.path.exists(STATE_FILE):
-        os.remove(STATE_FILE)
-        logging.info(f"Archivo de estado {STATE_FILE} eliminado.")
-        logging.debug(f"Archivo {STATE_FILE} eliminado correctamente del sistema de archivos.")  
+    store = get_state()
+    if store.exists():
+        store.clear()
+        logging.info(f"Archivo de estado {store.path} eliminado.")
+        logging.debug(f"Archivos {store.path} y {store.journal_path} eliminados del sistema de archivos.")
     else:
-        logging.info(f"Archivo de estado {STATE_FILE} no existe, nada que borrar.")
-        logging.debug(f"Intento de eliminar {STATE_FILE} fallido: archivo no encontrado.")
+        logging.info(f"Archivo de estado {store.path} no existe, nada que borrar.")
+        logging.debug(f"Intento de eliminar {store.path} fallido: archivo no encontrado.")
 
 
 def create():
     """
     Crea las VMs y redes definidas en el escenario.
-    Modo 'debug: false': Informa de la creación general de cada elemento.
+    Las operaciones independientes se ejecutan en paralelo respetando el orden necesario:
+    la imagen base se copia antes de crear las imágenes de cada VM y los bridges
+    existen antes de definir las VMs conectadas a ellos.
+    Si una ejecución anterior con la misma configuración quedó a medias, se reanuda
+    omitiendo las imágenes y definiciones que ya se completaron.
+    Modo 'debug: false': Informa de la creación general de cada elemento y su duración.
     Modo 'debug: true': Describe cada paso, incluyendo direcciones de red asignadas y estado del proceso.
     """
-    clear_state_file()
+    from lib_parallel import Executor
+    store = get_state()
+    resume = begin_command("create")
     number_of_servers = get_number_of_servers()  # Leer el número de servidores del archivo JSON 
     logging.info(f"Creando {number_of_servers} servidores web.")
     logging.debug(f"Configuración inicial para {number_of_servers} servidores.")    
 
-    # Creamos tantas VM como aparezca en el archivo de configuración
-    for i in range(1, number_of_servers + 1):
-        vm_name = f's{i}'
-        server = VM(vm_name)
-        vms[vm_name] = server  # Crea la VM y la asigna a la variable global
-        ifs = []
-        ifs.append( { "addr": f"10.1.2.{i+10}", "mask": "255.255.255.0" } )
-        server.create_vm('cdps-vm-base-pc1.qcow2', ifs )
-        logging.info(f"VM creada: {vm_name}")
-        logging.debug(f"VM {vm_name} creada con dirección {ifs[0]['addr']} y máscara {ifs[0]['mask']}.")
-
-    lb = VM('lb')
-    vms['lb'] = lb
-    c1 = VM('c1')
-    vms['c1'] = c1
+    executor = Executor(get_max_workers())
+    topo = plan_create(executor, resume)
 
-    
-    lan1 = NET('lan1')
-    vms['lan1'] = lan1
-    lan2 = NET('lan2')
-    vms['lan2'] = lan2
-    lan1.create_net('lan1', "10.1.1.0", "24")
-    lan2.create_net('lan2', "10.1.2.0", "24")
-    logging.debug("Redes LAN1 (10.1.1.0/24) y LAN2 (10.1.2.0/24) creadas.")
-
-    ifs = []
-    ifs.append( { "addr": "10.1.1.1", "mask": "255.255.255.0" } )
-    ifs.append( { "addr": "10.1.2.1", "mask": "255.255.255.0" } )
-    lb.create_vm('cdps-vm-base-pc1.qcow2', ifs )
-    logging.info("Balanceador de tráfico 'lb' configurado.")
-    logging.debug(f"Balanceador 'lb' configurado con interfaces {ifs}.")
-    
-    
-    ifs = []
-    ifs.append( { "addr": "10.1.1.2", "mask": "255.255.255.0" } )
-    c1.create_vm('cdps-vm-base-pc1.qcow2', ifs )
-    logging.info("VM de cliente 'c1' configurada.")
-    logging.debug(f"Cliente 'c1' configurado con dirección {ifs[0]['addr']}.")
+    ok = executor.run()
+    if ok:
+        store.finish()
+        logging.info(f"Escenario creado: {len(topo.nodes)} VMs y {len(topo.networks)} redes.")
+    else:
+        logging.error("El escenario no se ha creado completamente, revisa los errores anteriores. "
+                      "Al repetir 'create' se reanudará desde el último paso completado.")
     
     save_state()  # Guardar el estado después de crear las VMs
     pause()
+    return ok
+
+
+def begin_command(command):
+    """
+    Registra el comienzo de una orden que crea el escenario. Devuelve True si reanuda una
+    ejecución anterior interrumpida con la misma configuración; si no, empieza desde cero.
+    """
+    store = get_state()
+    resume = store.begin(command, config_digest())
+    if not resume:
+        store.delete("vms")
+        store.delete("networks")
+    return resume
+
+
+def plan_create(executor, resume):
+    """
+    Añade al ejecutor las tareas que crean el escenario: preconfiguración, redes, imágenes
+    doradas y la imagen y la definición de cada VM ('image:<vm>' y 'define:<vm>').
+    Devuelve la topología.
+    Modo 'debug: false': No muestra mensajes.
+    Modo 'debug: true': Indica las direcciones de cada interfaz.
+    """
+    import subprocess
+    from lib_vm import VM, NET, role_batch
+    from lib_image import GoldenImages
+    from lib_netplan import scenario_plan
+    store = get_state()
+    topo = get_topology()
+    executor.add("preconfig", lambda: step(preconfig(), "Error en la preconfiguración"))
+
+    # Todos los bridges y sus direcciones en una sola transacción OVS y un solo lote de 'ip'
+    for net in topo.networks.values():
+        vms[net.name] = NET(net.name)
+
+    def create_nets():
+        try:
+            scenario_plan(topo).apply()
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Error al crear las redes: {e}")
+        for net in topo.networks.values():
+            record_net(net, "created")
+
+    executor.add("nets", create_nets)
+
+    # Una imagen dorada por rol, construida solo si no está ya en caché
+    golden = GoldenImages(BASE_IMAGE)
+    golden_paths = {}
+
+    def build_golden(role):
+        golden_paths[role] = golden.build(role, role_batch(role).ops)
+
+    for role in ROLES:
+        executor.add(f"golden:{role}", lambda role=role: build_golden(role), deps=["preconfig"])
+
+    # Al reanudar, una definición solo se da por buena si el dominio sigue existiendo
+    domains = known_domains() if resume else {}
+
+    # Creamos una VM por cada nodo de la topología
+    for node in topo.nodes.values():
+        vm = VM(node.name, node, hypervisor=get_hypervisor())
+        if resume:
+            # Datos de los pasos ya completados en la ejecución interrumpida
+            vm.backing = store.vms.get(vm.name, {}).get("backing")
+            vm.xml_hash = store.vms.get(vm.name, {}).get("xml_hash")
+            vm.bundle_hash = store.vms.get(vm.name, {}).get("bundle_hash")
+        vms[vm.name] = vm
+        for iface in node.interfaces:
+            logging.debug(f"VM {vm.name}: {iface.device} en {iface.network.name} con dirección {iface.address} y máscara {iface.mask}.")
+        image = executor.add(f"image:{vm.name}",
+                             checkpoint(f"image:{vm.name}", lambda vm=vm: image_step(vm, golden_paths), resume,
+                                        valid=lambda vm=vm: os.path.exists(f"{vm.name}.qcow2")),
+                             deps=[f"golden:{vm.role}"])
+        executor.add(f"define:{vm.name}",
+                     checkpoint(f"define:{vm.name}", lambda vm=vm: define_step(vm), resume,
+                                valid=lambda vm=vm: vm.name in domains),
+                     deps=[image, "nets"])
+    return topo
+
+
+def apply():
+    """
+    Lleva el escenario al estado definido en la configuración ejecutando solo los pasos
+    que faltan o han cambiado: redes, imágenes, definiciones y arranque de cada VM.
+    Si todo está al día no se ejecuta nada.
+    Modo 'debug: false': Informa de los cambios aplicados.
+    Modo 'debug: true': Indica el motivo de cada cambio.
+    """
+    from lib_vm import VM, NET, role_batch, xml_digest
+    from lib_xml import to_string as xml_to_string
+    from lib_parallel import Executor
+    from lib_image import GoldenImages
+    from lib_hypervisor import RUNNING
+    from lib_netplan import scenario_plan, host_plan
+    from lib_reconcile import observe, diff
+    if get_state().exists():
+        load_state()
+    topo = get_topology()
+    for node in topo.nodes.values():
+        if node.name not in vms or vms[node.name].node is None:
+            vm = VM(node.name, node, hypervisor=get_hypervisor())
+            if node.name in vms:
+                vm.backing, vm.xml_hash = vms[node.name].backing, vms[node.name].xml_hash
+                vm.xml_file, vm.bundle_hash = vms[node.name].xml_file, vms[node.name].bundle_hash
+            vms[node.name] = vm
+    for net in topo.networks.values():
+        vms.setdefault(net.name, NET(net.name))
+
+    # Estado real en bloque y diferencias con el deseado
+    actual = observe(get_hypervisor(), [f"{name}.qcow2" for name in topo.nodes])
+    golden = GoldenImages(BASE_IMAGE)
+    golden_cache = {}
+
+    def golden_for_role(role):
+        if role not in golden_cache:
+            golden_cache[role] = golden.path(role, role_batch(role).ops) if os.path.exists(BASE_IMAGE) else None
+        return golden_cache[role]
+
+    def xml_hash_for(node):
+        try:
+            return xml_digest(xml_to_string(vms[node.name].render_xml()))
+        except OSError:
+            return None
+
+    changes = diff(topo, {name: {"backing": vm.backing, "xml_hash": vm.xml_hash}
+                          for name, vm in vms.items() if isinstance(vm, VM)},
+                   actual, golden_for_role, xml_hash_for)
+    if not changes:
+        logging.info("El escenario ya está al día, no hay nada que aplicar.")
+        return True
+    logging.info(f"Aplicando {len(changes)} cambios.")
+    for change in changes:
+        logging.debug(f"  {change}")
+
+    executor = Executor(get_max_workers())
+    kinds = {(c.kind, c.name) for c in changes}
+    golden_paths = {}
+
+    if any(c.kind == "image" for c in changes):
+        executor.add("preconfig", lambda: step(preconfig(), "Error en la preconfiguración"))
+        for role in {vms[c.name].role for c in changes if c.kind == "image"}:
+            executor.add(f"golden:{role}",
+                         lambda role=role: golden_paths.update({role: golden.build(role, role_batch(role).ops)}),
+                         deps=["preconfig"])
+
+    def create_nets():
+        scenario_plan(topo).apply()
+        for net in topo.networks.values():
+            record_net(net, "created")
+
+    if any(c.kind == "nets" for c in changes):
+        executor.add("nets", create_nets)
+    if ("host", "host") in kinds:
+        executor.add("host", lambda: host_plan(topo).apply(), deps=[t for t in ["nets"] if t in executor.tasks])
+
+    for node in topo.nodes.values():
+        vm = vms[node.name]
+        deps = []
+        if ("image", node.name) in kinds:
+            def recreate(vm=vm):
+                # Un dominio arrancado no puede cambiar de imagen: se apaga antes
+                if actual.domains.get(vm.name) == RUNNING:
+                    vm.hypervisor.destroy(vm.name)
+                image_step(vm, golden_paths)
+            deps.append(executor.add(f"image:{vm.name}", recreate, deps=[f"golden:{vm.role}"]))
+        if ("define", node.name) in kinds:
+            deps.append(executor.add(f"define:{vm.name}", lambda vm=vm: define_step(vm),
+                                     deps=deps + [t for t in ["nets"] if t in executor.tasks]))
+        if ("start", node.name) in kinds:
+            executor.add(f"start:{vm.name}", lambda vm=vm: start_step(vm, topo), deps=deps)
+
+    ok = executor.run()
+    save_state()
+    return ok
+
+
+def scenario_vms():
+    """
+    Devuelve las VMs del estado cargado en el orden de la topología (servidores, 'lb', 'c1').
+    Modo 'debug: false': Informa de las VMs que faltan en el estado.
+    Modo 'debug: true': No añade información adicional.
+    """
+    found = []
+    for name in get_topology().nodes:
+        if name in vms:
+            found.append(vms[name])
+        else:
+            logging.error(f"VM {name} no encontrada en el diccionario de estado.")
+    return found
+
+
+def evict_golden():
+    """
+    Elimina las imágenes doradas obsoletas: las que no corresponden a la configuración
+    actual de ningún rol ni sirven de base a una VM existente de este u otro escenario.
+    Modo 'debug: false': Informa del número de imágenes eliminadas.
+    Modo 'debug: true': Indica las imágenes que se conservan.
+    """
+    import subprocess
+    from lib_vm import role_batch
+    from lib_image import GoldenImages, backing_file
+    load_state()
+    golden = GoldenImages(BASE_IMAGE)
+    keep = set()
+    if os.path.exists(BASE_IMAGE):
+        keep.update(golden.path(role, role_batch(role).ops) for role in ROLES)
+    # Los overlays de otros escenarios del mismo directorio también usan las imágenes doradas
+    overlays = set(f"{name}.qcow2" for name in vms) | set(glob.glob("*.qcow2")) - {BASE_IMAGE}
+    for image in sorted(overlays):
+        if os.path.exists(image):
+            try:
+                keep.add(backing_file(image))
+            except subprocess.CalledProcessError as e:
+                logging.error(f"No se pudo leer la imagen base de {image}: {e}")
+    # Y las que son base de algún overlay guardado en una instantánea
+    keep.update(get_snapshots().referenced()[1])
+    keep.discard(None)
+    logging.debug(f"Imágenes doradas en uso: {sorted(keep)}")
+    removed = golden.evict(keep)
+    logging.info(f"{len(removed)} imágenes doradas obsoletas eliminadas.")
 
 
 def start():
     """
-    Arranca todas las VMs del escenario.
-    Modo 'debug: false': Notifica el estado de cada VM al ser arrancada.
+    Arranca todas las VMs del escenario en paralelo.
+    Si un arranque anterior quedó a medias, solo se arrancan las VMs que faltaban.
+    Modo 'debug: false': Notifica el estado de cada VM al ser arrancada y su duración.
     Modo 'debug: true': Proporciona detalles sobre los comandos y configuraciones aplicadas.
     """
+    from lib_parallel import Executor
     load_state()  # Cargar el estado antes de iniciar las VMs
     number_of_servers = get_number_of_servers()
     logging.info(f"Iniciando {number_of_servers} servidores web y demás elementos del escenario.")
-    
-    for i in range(1, number_of_servers + 1):
-        vm_name = f's{i}'
-        if vm_name in vms:
-            server = vms[vm_name]
-            server.start_vm()
-            server.show_console_vm()
-            logging.info(f"VM {vm_name} arrancada.")
-            logging.debug(f"VM {vm_name} arrancada correctamente con consola activada.")
-        else:
-            logging.error(f"VM {vm_name} no encontrada en el diccionario de estado.")
-
-    if 'lb' in vms:
-        lb = vms['lb']
-        lb.start_vm()
-        lb.show_console_vm()
-        logging.info("Balanceador de tráfico 'lb' arrancado.")
-        logging.debug("Balanceador 'lb' iniciado correctamente y consola activada.")
-    else:
-        logging.error("Error: Balanceador 'lb' no encontrado en el diccionario de estado.")
-
-    if 'c1' in vms:
-        c1 = vms['c1']
-        c1.start_vm()
-        c1.show_console_vm()
-        logging.info("VM 'c1' arrancada.")
-        logging.debug("Cliente 'c1' arrancado con consola activada.")
+
+    resume = get_state().begin("start", config_digest())
+    executor = Executor(get_max_workers())
+    plan_start(executor, resume)
+    ok = executor.run()
+    if ok:
+        get_state().finish()
+    save_state()
+
+    # Esperar a que las VMs estén arrancadas y los servidores web respondan
+    if get_option("ready_timeout", 120) > 0:
+        ok = wait() and ok
+    return ok
+
+
+def plan_start(executor, resume, after=None):
+    """
+    Añade al ejecutor el arranque de cada VM ('start:<vm>') y la configuración del host.
+    'after(vm)' devuelve las tareas que deben terminar antes de arrancar esa VM (en 'up',
+    su definición), de modo que cada VM arranca en cuanto está lista sin esperar al resto.
+    Modo 'debug: false': Notifica el arranque de cada VM.
+    Modo 'debug: true': Indica la configuración del host.
+    """
+    import subprocess
+    from lib_hypervisor import RUNNING
+    from lib_netplan import host_plan
+    from lib_render import render_all
+    # Al reanudar, solo se omiten las VMs que siguen arrancadas
+    domains = known_domains() if resume else {}
+
+    # Ficheros propios de todas las VMs generados de una vez en memoria
+    bundles = render_all(get_topology(), [vm.name for vm in scenario_vms()])
+
+    def start_one(vm):
+        start_step(vm, get_topology(), bundles[vm.name])
+        open_console(vm)
+        logging.info(f"VM {vm.name} arrancada.")
+
+    for vm in scenario_vms():
+        executor.add(f"start:{vm.name}", checkpoint(f"start:{vm.name}", lambda vm=vm: start_one(vm), resume,
+                                                          valid=lambda vm=vm: domains.get(vm.name) == RUNNING),
+                     deps=after(vm) if after else [])
+
+    def configure_host():
+        topo = get_topology()
+        host = topo.host_interface
+        try:
+            host_plan(topo).apply()
+            logging.info(f"Host configurado para conectarse a {host.network.name}.")
+            logging.debug(f"Host conectado a {host.network.name} con IP {host.address} y rutas {topo.host_routes}.")
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error al configurar el host para {host.network.name}: {e}")
+
+    executor.add("host", configure_host, deps=[t for t in ["nets"] if t in executor.tasks])
+
+
+def open_console(vm):
+    """
+    Muestra la consola de una VM según 'consoles': un xterm por VM, el registro en
+    <console_dir>/<vm>.log desde el lector único de consolas, o nada.
+    """
+    mode = get_console_mode()
+    if mode == "xterm":
+        vm.show_console_vm()
+    elif mode == "log":
+        get_console_collector().attach(vm.name)
+
+
+def wait(results=None):
+    """
+    Espera a que el escenario esté operativo: dominios arrancados y puerto 80 abierto en
+    los servidores y en el frontend del balanceador, o hasta que venza 'ready_timeout'.
+    Con 'ready_check: console' y las consolas registradas por esta misma orden ('consoles: log'),
+    se espera en cambio a las marcas de arranque de cada consola (Apache, HAProxy y login),
+    sin sondear las VMs.
+    Modo 'debug: false': Informa del tiempo hasta estar listo de cada nodo.
+    Modo 'debug: true': Incluye los errores de las consultas al hipervisor.
+    """
+    from lib_console import ROLE_MARKERS
+    from lib_ready import wait_scenario, report as report_ready
+    timeout = get_option("ready_timeout", 120) or 120
+    logging.info(f"Esperando a que el escenario esté operativo (máximo {timeout} s).")
+    if get_option("ready_check", "probe") == "console":
+        if console_collector is not None and console_collector.consoles:
+            expected = {node.name: ROLE_MARKERS[node.role] for node in get_topology().nodes.values()}
+            measured = console_collector.wait_markers(expected, timeout)
+            if results is not None:
+                results.update(measured)
+            return report_ready(measured)
+        logging.warning("'ready_check: console' necesita las consolas registradas en esta orden "
+                        "('consoles: log'); se comprueban los puertos.")
+    return wait_scenario(get_topology(), get_hypervisor(), timeout, results)
+
+
+def bench():
+    """
+    Genera carga HTTP contra el frontend del balanceador y guarda los resultados en JSON.
+    Opciones en la sección 'bench' del archivo JSON: connections, duration, requests, path,
+    target ("host:puerto", por defecto el frontend de 'lb') y results_dir.
+    Modo 'debug: false': Muestra rendimiento, latencias y reparto entre servidores.
+    Modo 'debug: true': Incluye el resultado completo.
+    """
+    import asyncio
+    from lib_bench import run_load, report as report_bench, save_result as save_bench
+    options = get_option("bench", {})
+    target = options.get("target")
+    if target:
+        host, _, port = target.rpartition(":")
+        port = int(port)
     else:
-        logging.error("Error: VM 'c1' no encontrada en el diccionario de estado.")
-    
+        host, port = str(get_topology().balancers[0].address), 80
+
+    logging.info(f"Generando carga contra {host}:{port} con {options.get('connections', 16)} conexiones.")
+    result = asyncio.run(run_load(host, port,
+                                  path=options.get("path", "/"),
+                                  connections=int(options.get("connections", 16)),
+                                  duration=float(options.get("duration", 10)),
+                                  requests=int(options.get("requests", 0))))
+    report_bench(result)
+    path = save_bench(result, options.get("results_dir", scenario_file("bench-results")))
+    logging.info(f"Resultados guardados en {path}")
+    logging.debug(f"Resultado completo: {result}")
+    return result["requests"] > 0
+
+
+def haproxy_config():
+    """
+    Genera y valida sin conexión la configuración de HAProxy del balanceador.
+    Modo 'debug: false': Muestra la configuración y el resultado de la validación.
+    Modo 'debug: true': Incluye la salida completa de 'haproxy -c'.
+    """
+    from lib_topology import render_haproxy
+    from lib_haproxy import check_with_haproxy
     try:
-        subprocess.check_call(["sudo", "ip", "link", "set", "lan1", "up"])
-        subprocess.check_call(["sudo", "ip", "addr", "add", "10.1.1.3/24", "dev", "lan1"])
-        subprocess.check_call(["sudo", "ip", "route", "add", "10.1.0.0/16", "via", "10.1.1.1"])
-        subprocess.check_call(["sudo", "ip", "link", "set", "lan2", "up"])
-        logging.info("Host configurado para conectarse a LAN1.")
-        logging.debug("Host conectado a LAN1 con IP 10.1.1.3 y ruta predeterminada 10.1.1.1.")    
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error al configurar el host para LAN1: {e}")
+        text = render_haproxy(get_topology())
+    except ValueError as e:
+        logging.error(f"Configuración de HAProxy no válida: {e}")
+        return False
+    print(text)
+    checked = check_with_haproxy(text)
+    if checked is None:
+        logging.info("Configuración de HAProxy generada (haproxy no instalado: solo validación interna).")
+        return True
+    ok, messages = checked
+    if ok:
+        logging.info("Configuración de HAProxy válida según 'haproxy -c'.")
+        logging.debug(messages)
+    else:
+        logging.error(f"'haproxy -c' rechaza la configuración:\n{messages}")
+    return ok
 
 
-def stop():
+# Nombre de un servidor, con o sin el prefijo del escenario ('s3', 't1-s3')
+SERVER_RE = re.compile(r"(?:[a-z][a-z0-9]*-)?s(\d+)")
+
+def scale(number_of_servers):
     """
-    Detiene todas las VMs en el escenario.
-    Modo 'debug: false': Informa sobre las VMs detenidas y errores si no se encuentran.
-    Modo 'debug: true': Proporciona detalles sobre cada operación de parada.
+    Cambia el número de servidores del escenario en marcha sin recrearlo: crea y arranca
+    solo los servidores nuevos, elimina los sobrantes y actualiza los backends de HAProxy
+    en cada balanceador a través de su API de administración, sin reiniciarlo. Si la API no
+    responde, sustituye haproxy.cfg por ssh y recarga HAProxy. Un servidor solo se destruye
+    cuando ningún balanceador lo usa, y el nuevo número de servidores solo se guarda en el
+    archivo JSON si todo ha ido bien.
+    Modo 'debug: false': Informa de los servidores añadidos y eliminados.
+    Modo 'debug: true': Incluye las órdenes enviadas a HAProxy.
     """
+    import threading
+    import lib_cmd as cmd
+    from lib_vm import VM, role_batch
+    from lib_parallel import Executor
+    from lib_image import GoldenImages
+    from lib_haproxy import RuntimeAPI, reload as reload_haproxy
+    from lib_topology import render_haproxy
+    try:
+        check_option("number_of_servers", number_of_servers)
+    except ConfigError as e:
+        logging.error(f"Número de servidores no válido: {e}")
+        return False
+
     load_state()
-    number_of_servers = get_number_of_servers()
-    logging.info("Deteniendo las VMs del escenario.")
-    
-    for i in range(1, number_of_servers + 1):
-        vm_name = f's{i}'
-        if vm_name in vms:
-            server = vms[vm_name]
-            server.stop_vm()
-            logging.info(f"VM {vm_name} parada.")
-            logging.debug(f"La máquina virtual {vm_name} se detuvo correctamente.")
-        else:
-            logging.error(f"VM {vm_name} no encontrada en el diccionario 'vms'.")
-    
-    if 'lb' in vms:
-        lb = vms['lb']
-        lb.stop_vm()
-        logging.info("Balanceador 'lb' parado.")
-        logging.debug("Balanceador de tráfico 'lb' detenido correctamente.")
-    else:
-        logging.error("Balanceador 'lb' no encontrado en el diccionario 'vms'.")
+    override_option("number_of_servers", number_of_servers)
+    topo = get_topology()
+    added = [node for node in topo.servers if node.name not in vms]
+    removed = sorted((name for name in vms if SERVER_RE.fullmatch(name) and name not in topo.nodes),
+                     key=lambda name: int(SERVER_RE.fullmatch(name).group(1)))
+    if not added and not removed:
+        logging.info(f"El escenario ya tiene {number_of_servers} servidores.")
+        set_option("number_of_servers", number_of_servers)
+        return True
+    logging.info(f"Escalando a {number_of_servers} servidores: "
+                 f"añadir {[node.name for node in added]}, eliminar {removed}.")
+
+    # Todos los balanceadores reciben los mismos cambios. En modo simulado no se abre la
+    # conexión con HAProxy: la orden solo se registra
+    port = topo.haproxy["runtime_api_port"]
+    simulated = cmd.get_runner().simulated
+    reloaded = {}
+    reload_lock = threading.Lock()
+
+    def reload_lb(lb):
+        # Alternativa a la API: haproxy.cfg con los servidores finales y recarga ordenada.
+        # Se hace una sola vez por balanceador aunque fallen varias órdenes
+        with reload_lock:
+            if lb.name not in reloaded:
+                try:
+                    reload_haproxy(lb.address, render_haproxy(topo, lb), topo.haproxy["ssh_user"])
+                    reloaded[lb.name] = True
+                    logging.info(f"HAProxy recargado en {lb.name} con la nueva configuración.")
+                except (OSError, cmd.CommandError) as e:
+                    reloaded[lb.name] = False
+                    logging.error(f"No se pudo recargar HAProxy en {lb.name}: {e}")
+            return reloaded[lb.name]
+
+    def update_lb(description, action):
+        # True si todos los balanceadores quedan actualizados
+        ok = True
+        for lb in topo.balancers:
+            if simulated:
+                logging.info(f"[dry-run] HAProxy en {lb.name}: {description}")
+                continue
+            if port and not reloaded.get(lb.name):
+                try:
+                    action(RuntimeAPI(str(lb.address), port))
+                    continue
+                except (OSError, RuntimeError) as e:
+                    logging.error(f"No se pudo actualizar HAProxy en caliente en {lb.name}: {e}")
+            ok = reload_lb(lb) and ok
+        return ok
+
+    executor = Executor(get_max_workers())
+
+    # Servidores nuevos: imagen sobre la imagen dorada, definición, arranque y alta en HAProxy
+    golden = GoldenImages(BASE_IMAGE)
+    golden_paths = {}
+    if added:
+        executor.add("golden:server",
+                     lambda: golden_paths.update(server=golden.build("server", role_batch("server").ops)))
+    for node in added:
+        vm = VM(node.name, node, hypervisor=get_hypervisor())
+        vms[vm.name] = vm
+        image = executor.add(f"image:{vm.name}", lambda vm=vm: image_step(vm, golden_paths), deps=["golden:server"])
+        defined = executor.add(f"define:{vm.name}", lambda vm=vm: define_step(vm), deps=[image])
+        started = executor.add(f"start:{vm.name}", lambda vm=vm: start_step(vm, topo), deps=[defined])
+        executor.add(f"lb-add:{vm.name}",
+                     lambda node=node: step(update_lb(f"alta de {node.name}",
+                                                      lambda api: api.add_server(node.name, node.address, 80, topo.haproxy)),
+                                            f"No se pudo dar de alta {node.name} en HAProxy"),
+                     deps=[started])
+
+    # Servidores sobrantes: primero se retiran de HAProxy y solo después se destruyen
+    # Sale del estado solo al destruirse: si sigue en HAProxy, se conserva
+    def retire(vm):
+        vm.destroy_vm()
+        vms.pop(vm.name)
+        get_state().delete("vms", vm.name)
+
+    for name in removed:
+        vm = vms[name]
+        drained = executor.add(f"lb-del:{name}",
+                               lambda name=name: step(update_lb(f"baja de {name}", lambda api: api.remove_server(name)),
+                                                      f"No se pudo retirar {name} de HAProxy; no se destruye"))
+        executor.add(f"destroy:{name}", lambda vm=vm: retire(vm), deps=[drained])
 
-    if 'c1' in vms:
-        c1 = vms['c1']
-        c1.stop_vm()
-        logging.info("Cliente 'c1' parado.")
-        logging.debug("La máquina virtual cliente 'c1' se detuvo correctamente.")
+    ok = executor.run()
+    save_state()
+
+    if ok:
+        set_option("number_of_servers", number_of_servers)
     else:
-        logging.error("Cliente 'c1' no encontrado en el diccionario 'vms'.")
-    
+        logging.error(f"El escalado a {number_of_servers} servidores no se ha completado; "
+                      f"{CONFIG_FILE} conserva el número de servidores anterior.")
+    return ok
+
+
+def stop(pause_after=True):
+    """
+    Detiene todas las VMs del escenario: envía el apagado a todas a la vez, espera a que
+    estén apagadas y fuerza con 'destroy' las que sigan encendidas tras 'stop_grace' segundos.
+    El tiempo total lo marca la VM más lenta. Devuelve True si todas quedan apagadas.
+    Modo 'debug: false': Informa del tiempo de apagado de cada VM y de las forzadas.
+    Modo 'debug: true': Incluye los errores de las consultas al hipervisor.
+    """
+    import asyncio
+    from lib_shutdown import shutdown_all, report as report_shutdown
+    load_state()
+    grace = get_option("stop_grace", 60)
+    logging.info(f"Deteniendo las VMs del escenario (máximo {grace} s antes de forzar el apagado).")
+
+    scenario = scenario_vms()
+    results = asyncio.run(shutdown_all(get_hypervisor(), [vm.name for vm in scenario],
+                                       grace=grace, limit=get_max_workers()))
+    ok = report_shutdown(results)
+    for vm in scenario:
+        if results[vm.name].off:
+            record_vm(vm, "stopped")
+
     save_state()
-    pause()
+    if pause_after:
+        pause()
+    return ok
     
     
-def destroy():
+def destroy(pause_after=True):
     """
-    Libera y elimina todas las VMs y recursos del escenario, incluidas las redes.
+    Libera y elimina todas las VMs y recursos del escenario, incluidas las redes y su
+    bloque de direcciones en el registro del host.
+    Los dominios se eliminan a la vez y después se borran, una sola vez, solo los ficheros
+    que pertenecen al escenario (overlays y XML de cada VM). La imagen base, la plantilla
+    y las imágenes doradas se conservan para el siguiente 'create'. Devuelve True si se
+    eliminaron todos los dominios.
     Modo 'debug: false': Notifica la eliminación de cada recurso.
     Modo 'debug: true': Detalla los procesos de liberación y eliminación.
     """
+    from lib_vm import VM
+    from lib_image import GOLDEN_DIR
+    from lib_address import Registry, DEFAULT_POOL, DEFAULT_SCENARIO
+    from lib_netplan import teardown_plan
+    from lib_teardown import owned_files, remove_files, remove_scenario_domains
     load_state()
-    number_of_servers = get_number_of_servers()
     logging.info("Eliminando las VMs y recursos del escenario.")
-    
-    for i in range(1, number_of_servers + 1):
-        vm_name = f's{i}'
-        if vm_name in vms:
-            server = vms[vm_name]
-            server.destroy_vm()
-            logging.info(f"VM {vm_name} eliminada.")
-            logging.debug(f"La máquina virtual {vm_name} fue liberada y eliminada correctamente.")
-        else:
-            logging.error(f"VM {vm_name} no encontrada en el diccionario 'vms'.")
 
-    if 'lb' in vms:
-        lb = vms['lb']
-        lb.destroy_vm()
-        logging.info("Balanceador 'lb' eliminado.")
-        logging.debug("El balanceador de tráfico 'lb' fue liberado y eliminado correctamente.")
-    else:
-        logging.error("Balanceador 'lb' no encontrado en el diccionario 'vms'.")
-    
-    if 'c1' in vms:
-        c1 = vms['c1']
-        c1.destroy_vm()
-        logging.info("Cliente 'c1' eliminado.")
-        logging.debug("La máquina virtual cliente 'c1' fue liberada y eliminada correctamente.")
-    else:
-        logging.error("Cliente 'c1' no encontrado en el diccionario 'vms'.")    
-    
+    # VMs del escenario y las que queden en el estado de una configuración anterior
+    names = list(dict.fromkeys(list(get_topology().nodes) + [name for name, vm in vms.items() if isinstance(vm, VM)]))
+    failed = remove_scenario_domains(get_hypervisor(), names, get_max_workers())
+
+    files = owned_files(names, get_state().vms)
+    removed = remove_files(files, protected=[BASE_IMAGE, "plantilla-vm-pc1.xml"])
+    logging.info(f"{len(removed)} archivos del escenario eliminados; se conservan {BASE_IMAGE} y {GOLDEN_DIR}/.")
+
     try:
-        lan1 = NET('lan1')
-        lan2 = NET('lan2')
-        lan1.destroy_net()
-        lan2.destroy_net()
+        teardown_plan(get_topology()).apply()
     except Exception as e:
         logging.error(f"Error al eliminar las redes: {e}")
 
+    # El bloque de direcciones del escenario queda libre para otros escenarios
+    scenario = get_scenario() or DEFAULT_SCENARIO
+    with Registry(get_registry_path(), get_option("address_pool", DEFAULT_POOL)) as allocator:
+        released = allocator.release(scenario)
+    logging.debug(f"Bloques de direcciones liberados por {scenario}: {[str(n) for n in released]}")
+
     clear_state_file()
-    pause()
+    if pause_after:
+        pause()
+    return not failed
     
 
-if __name__ == "__main__":
+def up():
     """
-    Punto de entrada principal del script. Verifica los comandos pasados y ejecuta la acción correspondiente.
+    Levanta el escenario completo en un solo flujo, sin pausas: preconfiguración, redes,
+    imágenes, definición y arranque de cada VM en cuanto su definición está lista (sin
+    esperar al resto), y espera a que esté operativo. Se reanuda como 'create' si quedó a medias.
+    Devuelve el código de salida: EXIT_OK, EXIT_FAILED o EXIT_NOT_READY.
+    Modo 'debug: false': Informa de la duración de cada fase y del resultado.
+    Modo 'debug: true': Incluye la duración de cada tarea.
     """
-    if len(sys.argv) != 2:
-        print("Usage: python3 manage-p2.py <command>")
-        print("Commands: create, start, stop, destroy")
-        sys.exit(1)
+    from lib_parallel import Executor
+    started = time.perf_counter()
+    store = get_state()
+    resume = begin_command("up")
+    executor = Executor(get_max_workers())
+    plan_create(executor, resume)
+    plan_start(executor, resume, after=lambda vm: [f"define:{vm.name}"])
 
-    init_log()
-    command = sys.argv[1]
-    
-    if command == "create":
-        preconfig()
-        create()
-    elif command == "start":
-        start()
-    elif command == "stop":
-        stop()
-    elif command == "destroy":
-        destroy()
+    ok = executor.run()
+    if ok:
+        store.finish()
+    save_state()
+
+    ready = {}
+    code = EXIT_OK if ok else EXIT_FAILED
+    if ok and get_option("ready_timeout", 120) > 0:
+        ready_started = time.perf_counter()
+        if not wait(ready):
+            code = EXIT_NOT_READY
+        phases = {"ready": {"start": round(ready_started - started, 3),
+                            "elapsed": round(time.perf_counter() - ready_started, 3)}}
     else:
-        logging.error(f"Comando desconocido: {command}")
-        sys.exit(1)
-    
+        phases = {}
+    boot = console_collector.boot_times() if console_collector is not None else {}
+    write_summary("up", code, started, dict(executor_phases(executor), **phases), executor.timings(), ready, boot)
+    return code
+
+
+def down():
+    """
+    Detiene y elimina el escenario en un solo paso, sin pausas: apagado de todas las VMs
+    (forzado tras 'stop_grace') y eliminación de dominios, ficheros y redes.
+    Devuelve el código de salida: EXIT_OK o EXIT_FAILED.
+    Modo 'debug: false': Informa de la duración de cada fase y del resultado.
+    Modo 'debug: true': No añade información adicional.
+    """
+    started = time.perf_counter()
+    phases = {}
+
+    def phase(name, func):
+        phase_started = time.perf_counter()
+        ok = func()
+        phases[name] = {"start": round(phase_started - started, 3),
+                        "elapsed": round(time.perf_counter() - phase_started, 3), "ok": ok}
+        return ok
+
+    # Aunque alguna VM no se apague, 'destroy' la fuerza y elimina
+    stopped = phase("stop", lambda: stop(pause_after=False))
+    destroyed = phase("destroy", lambda: destroy(pause_after=False))
+    code = EXIT_OK if stopped and destroyed else EXIT_FAILED
+    write_summary("down", code, started, phases)
+    return code
+
+
+def executor_phases(executor):
+    """
+    Agrupa las tareas del ejecutor por tipo ('image:s1' -> 'image'): inicio de la primera,
+    duración hasta el final de la última, número de tareas y de fallidas.
+    """
+    phases = {}
+    for name, timing in executor.timings().items():
+        if timing["start"] is None:
+            continue
+        kind = name.partition(":")[0]
+        end = timing["start"] + timing["elapsed"]
+        phase = phases.setdefault(kind, {"start": timing["start"], "end": end, "tasks": 0, "failed": 0})
+        phase["start"] = min(phase["start"], timing["start"])
+        phase["end"] = max(phase["end"], end)
+        phase["tasks"] += 1
+        phase["failed"] += timing["status"] != "done"
+    for phase in phases.values():
+        phase["elapsed"] = round(phase.pop("end") - phase["start"], 3)
+    return phases
+
+
+def write_summary(command, code, started, phases, tasks=None, ready=None, boot=None):
+    """
+    Guarda el resultado de 'up' o 'down' en JSON (código de salida, duración total, de cada
+    fase y de cada tarea, tiempo hasta estar listo de cada nodo y, si se registran las consolas,
+    de cada marca de arranque) en el fichero de --summary
+    ('-' para la salida estándar), por defecto <escenario>-<orden>-summary.json.
+    Modo 'debug: false': Muestra la duración de cada fase.
+    Modo 'debug: true': No añade información adicional.
+    """
+    summary = {"command": command, "scenario": get_scenario(), "ok": code == EXIT_OK, "exit_code": code,
+               "elapsed": round(time.perf_counter() - started, 3), "phases": phases,
+               "tasks": tasks or {}, "ready": ready or {},
+               "boot": {name: {marker: round(t, 3) for marker, t in markers.items()} for name, markers in (boot or {}).items()}}
+    for name, phase in phases.items():
+        logging.info(f"Fase {name}: {phase['elapsed']:.2f} s")
+    logging.info(f"'{command}' terminado en {summary['elapsed']:.2f} s con código {code}.")
+
+    path = SUMMARY_FILE or scenario_file(f"{command}-summary.json")
+    if path == "-":
+        print(json.dumps(summary, indent=4))
+    else:
+        atomic_write_json(path, summary)
+        logging.info(f"Resumen guardado en {path}")
+    return summary
+
+
+def logs(name, follow=False, lines=50):
+    """
+    Muestra las últimas líneas guardadas de la consola de una VM (también las de los ficheros
+    rotados). Con 'follow' se conecta a su consola y muestra cada nueva línea hasta Ctrl+C.
+    Acepta el nombre con o sin el prefijo del escenario.
+    Modo 'debug: false': Muestra las líneas de la consola.
+    Modo 'debug: true': Indica el fichero leído.
+    """
+    from lib_console import BACKUPS, DEFAULT_DIR as CONSOLE_DIR, read_tail
+    topo = get_topology()
+    if name not in topo.nodes and topo.prefixed(name) in topo.nodes:
+        name = topo.prefixed(name)
+    if name not in topo.nodes:
+        logging.error(f"VM {name} no pertenece al escenario.")
+        return False
+
+    directory = get_option("console_dir", CONSOLE_DIR)
+    logging.debug(f"Consola de {name} guardada en {directory}")
+    for line in read_tail(directory, name, lines, get_option("console_backups", BACKUPS)):
+        print(line)
+    if not follow:
+        return True
+
+    new_lines = get_console_collector().follow(name)
+    try:
+        while True:
+            print(new_lines.get(), flush=True)
+    except KeyboardInterrupt:
+        pass
+    return True
+
+
+def metrics(once=False):
+    """
+    Exporta las métricas del escenario en formato Prometheus: estadísticas de HAProxy de
+    cada balanceador, CPU, memoria y tráfico de cada dominio y contadores de los puertos de
+    los bridges. Sirve http://<metrics_address>:<metrics_port>/metrics y renueva los valores
+    cada 'metrics_interval' segundos; con 'once' los muestra una vez y termina.
+    Modo 'debug: false': Informa de la dirección de escucha y de las fuentes que fallan.
+    Modo 'debug: true': No añade información adicional.
+    """
+    import asyncio
+    from lib_metrics import Exporter, DEFAULT_PORT as METRICS_PORT, DEFAULT_INTERVAL as METRICS_INTERVAL, DEFAULT_TIMEOUT as METRICS_TIMEOUT
+    exporter = Exporter(get_topology(), get_hypervisor(),
+                        interval=float(get_option("metrics_interval", METRICS_INTERVAL)),
+                        timeout=float(get_option("metrics_timeout", METRICS_TIMEOUT)))
+    if once:
+        print(asyncio.run(exporter.collect()), end="")
+        return True
+    try:
+        asyncio.run(exporter.serve(get_option("metrics_address", "127.0.0.1"),
+                                   int(get_option("metrics_port", METRICS_PORT))))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logging.error(f"No se pudo abrir el puerto de métricas: {e}")
+        return False
+    return True
+
+
+def powered_on(scenario):
+    """
+    Nombres de las VMs del escenario que están encendidas o en pausa.
+    """
+    from lib_hypervisor import RUNNING, PAUSED
+    domains = known_domains()
+    return [vm.name for vm in scenario if domains.get(vm.name) in (RUNNING, PAUSED)]
+
+
+def snapshot(tag):
+    """
+    Guarda con la etiqueta 'tag' el overlay de cada VM del escenario, que debe estar apagado
+    (p.ej. justo después de 'create', o tras 'stop'). Cada overlay se guarda una sola vez
+    por su hash de contenido; al terminar se eliminan los objetos que ya no usa ninguna etiqueta.
+    Modo 'debug: false': Informa del tiempo, los objetos nuevos y el espacio liberado.
+    Modo 'debug: true': Indica cada objeto guardado o eliminado.
+    """
+    from lib_image import ImageError
+    from lib_snapshot import SnapshotError
+    load_state()
+    scenario = scenario_vms()
+    if not scenario:
+        logging.error("No hay VMs en el escenario: ejecuta 'create' primero.")
+        return False
+    running = powered_on(scenario)
+    if running:
+        logging.error(f"VMs encendidas: {', '.join(running)}. Apágalas con 'stop' antes de la instantánea.")
+        return False
+    missing = [vm.name for vm in scenario if not os.path.exists(f"{vm.name}.qcow2")]
+    if missing:
+        logging.error(f"Faltan los overlays de {', '.join(missing)}.")
+        return False
+
+    facts = {vm.name: {"image": f"{vm.name}.qcow2", "backing": vm.backing, "xml_hash": vm.xml_hash,
+                       "bundle_hash": vm.bundle_hash} for vm in scenario}
+    try:
+        with get_snapshots() as store:
+            store.capture(tag, facts, get_max_workers())
+            removed, freed = store.gc()
+    except (SnapshotError, ImageError, OSError) as e:
+        logging.error(f"No se pudo guardar la instantánea '{tag}': {e}")
+        return False
+    if removed:
+        logging.info(f"{len(removed)} objetos sin usar eliminados ({freed / 2**20:.1f} MiB).")
+    return True
+
+
+def reset(tag):
+    """
+    Devuelve todas las VMs del escenario al contenido de la instantánea 'tag': fuerza el
+    apagado de las encendidas (su disco se descarta), restaura todos los overlays en
+    paralelo y vuelve a arrancar el escenario si estaba encendido. La configuración de cada
+    VM guardada con la instantánea no se vuelve a aplicar al arrancar.
+    Modo 'debug: false': Informa del tiempo de restauración y del arranque.
+    Modo 'debug: true': Indica el método con que se restaura cada overlay.
+    """
+    import asyncio
+    from lib_image import ImageError
+    from lib_shutdown import call_all
+    from lib_snapshot import SnapshotError
+    load_state()
+    scenario = scenario_vms()
+    store = get_snapshots()
+    try:
+        manifest = store.load(tag)
+    except SnapshotError as e:
+        logging.error(str(e))
+        return False
+    extra = sorted(set(manifest["vms"]) - {vm.name for vm in scenario})
+    if extra:
+        logging.warning(f"La instantánea '{tag}' incluye VMs que ya no están en el escenario: {', '.join(extra)}")
+
+    running = powered_on(scenario)
+    if running:
+        errors = asyncio.run(call_all(get_hypervisor().destroy, running, get_max_workers()))
+        failed = [name for name, error in errors.items() if error is not None]
+        if failed:
+            logging.error(f"No se pudieron apagar {', '.join(failed)}: {[str(errors[n]) for n in failed]}")
+            return False
+        logging.info(f"{len(running)} VMs apagadas sin esperar: su disco se restaura.")
+
+    try:
+        with store:
+            manifest = store.restore(tag, {vm.name: f"{vm.name}.qcow2" for vm in scenario}, get_max_workers())
+    except (SnapshotError, ImageError, OSError) as e:
+        logging.error(f"No se pudo restaurar la instantánea '{tag}': {e}")
+        return False
+
+    for vm in scenario:
+        entry = manifest["vms"][vm.name]
+        if entry.get("xml_hash") != vm.xml_hash:
+            logging.warning(f"La definición de {vm.name} ha cambiado desde la instantánea '{tag}'.")
+        vm.backing = entry.get("backing")
+        vm.bundle_hash = entry.get("bundle_hash")
+        record_vm(vm, "restored")
+    save_state()
+
+    if running:
+        return start()
+    return True
+
+
+def snapshots():
+    """
+    Muestra las instantáneas del escenario con su fecha, sus VMs y el espacio que ocupan.
+    Modo 'debug: false': Una línea por instantánea.
+    Modo 'debug: true': Incluye el objeto de cada VM.
+    """
+    tags = get_snapshots().tags()
+    if not tags:
+        print("No hay instantáneas del escenario.")
+    for tag, manifest in tags.items():
+        objects = {facts["object"]: facts["size"] for facts in manifest["vms"].values()}
+        print(f"{tag:20s} {manifest['created']}  {len(manifest['vms'])} VMs, {len(objects)} objetos, "
+              f"{sum(objects.values()) / 2**20:.1f} MiB")
+        for name, facts in manifest["vms"].items():
+            logging.debug(f"  {name}: {facts['object']}")
+    return True
+
+
+def snapshot_rm(tag):
+    """
+    Elimina la instantánea 'tag' y los objetos que ya no usa ninguna otra.
+    Modo 'debug: false': Informa del espacio liberado.
+    Modo 'debug: true': Indica cada objeto eliminado.
+    """
+    from lib_snapshot import SnapshotError
+    try:
+        with get_snapshots() as store:
+            store.delete(tag)
+            removed, freed = store.gc()
+    except SnapshotError as e:
+        logging.error(str(e))
+        return False
+    logging.info(f"{len(removed)} objetos sin usar eliminados ({freed / 2**20:.1f} MiB).")
+    return True
+
+
+def save_profile(command):
+    """
+    Guarda la traza de la orden en formato Chrome trace y muestra los pasos más costosos.
+    Modo 'debug: false': Muestra el resumen por paso ordenado por tiempo acumulado.
+    Modo 'debug: true': No añade información adicional.
+    """
+    path = os.path.join(get_option("trace_dir", "traces"), scenario_file(f"{command}-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    trace.export_chrome(path)
+    trace.report()
+    logging.info(f"Traza guardada en {path} (se puede abrir en chrome://tracing o en ui.perfetto.dev)")
+
+
+def status(as_json=False):
+    """
+    Muestra el estado del escenario guardado por las órdenes anteriores (fase de cada VM y
+    red, última orden y resultado del último 'up'), sin consultar al hipervisor ni construir
+    la topología, de modo que responde en milisegundos.
+    Modo 'debug: false': Una línea por VM y por red.
+    Modo 'debug: true': Incluye la fecha de cada paso de cada VM.
+    """
+    from lib_address import DEFAULT_SCENARIO
+    store = get_state()
+    run = store.run
+    summary_path = scenario_file("up-summary.json")
+    last_up = None
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            last_up = json.load(f)
+    info = {"scenario": get_scenario(), "state_file": store.path, "exists": store.exists(),
+            "command": run.get("command"), "started": run.get("started"), "finished": run.get("finished"),
+            "config_changed": bool(run.get("config")) and run.get("config") != config_digest(),
+            "vms": store.vms, "networks": store.networks,
+            "last_up": {key: last_up.get(key) for key in ("exit_code", "elapsed")} if last_up else None}
+    if as_json:
+        print(json.dumps(info, indent=4))
+        return True
+
+    if not info["exists"]:
+        print(f"Escenario '{info['scenario'] or DEFAULT_SCENARIO}' sin crear ({store.path} no existe).")
+        return True
+    print(f"Escenario '{info['scenario'] or DEFAULT_SCENARIO}' ({store.path})")
+    if info["command"]:
+        result = f"terminada el {info['finished']}" if info["finished"] else "sin terminar"
+        print(f"Última orden: {info['command']}, iniciada el {info['started']}, {result}")
+    if info["config_changed"]:
+        print(f"La configuración ha cambiado desde '{info['command']}'.")
+    if info["last_up"]:
+        print(f"Último 'up': código {info['last_up']['exit_code']} en {info['last_up']['elapsed']:.2f} s")
+    for name, facts in info["networks"].items():
+        print(f"  red {name:10s} {facts.get('phase', '-'):10s} {facts.get('bridge', '')} {facts.get('subnet', '')}")
+    for name, facts in info["vms"].items():
+        since = facts.get("steps", {}).get(facts.get("phase"), "")
+        print(f"  VM  {name:10s} {facts.get('phase', '-'):10s} {facts.get('role', ''):7s} "
+              f"{' '.join(facts.get('addresses', []))}  {since}")
+        logging.debug(f"  {name}: {facts.get('steps', {})}")
+    return True
+
+
+class Parser(argparse.ArgumentParser):
+    """
+    Analizador de la línea de órdenes. Un error de uso termina con EXIT_FAILED, como
+    cualquier otro fallo (el código 2 indica que 'up' no dejó el escenario operativo).
+    """
+    def error(self, message):
+        self.print_usage(sys.stderr)
+        print(f"{self.prog}: error: {message}", file=sys.stderr)
+        sys.exit(EXIT_FAILED)
+
+
+def global_options():
+    """
+    Opciones globales, que se admiten antes o después de la orden. Sin valor por defecto
+    propio, para que las de la suborden no oculten las indicadas antes de ella.
+    """
+    common = Parser(add_help=False)
+    common.add_argument("--config", metavar="<fichero>", default=argparse.SUPPRESS,
+                        help="configuración del escenario (por defecto manage-p2.json)")
+    common.add_argument("--headless", action="store_true", default=argparse.SUPPRESS,
+                        help="sin pausas ni terminales (también si la entrada no es un terminal)")
+    common.add_argument("--consoles", metavar="<xterm|log|none>", default=argparse.SUPPRESS,
+                        help="forma de mostrar las consolas de las VMs")
+    common.add_argument("--summary", metavar="<fichero>", default=argparse.SUPPRESS,
+                        help="resumen JSON de 'up' y 'down' ('-' para la salida estándar)")
+    common.add_argument("--profile", action="store_true", default=argparse.SUPPRESS,
+                        help="mide cada paso y comando externo y guarda la traza al terminar")
+    modes = common.add_mutually_exclusive_group()
+    modes.add_argument("--dry-run", action="store_true", default=argparse.SUPPRESS,
+                       help="muestra los comandos externos sin ejecutarlos")
+    modes.add_argument("--record", metavar="<fichero>", default=argparse.SUPPRESS,
+                       help="graba los comandos externos y sus resultados")
+    modes.add_argument("--replay", metavar="<fichero>", default=argparse.SUPPRESS,
+                       help="reproduce los resultados grabados en lugar de ejecutar los comandos")
+    return common
+
+
+def build_parser():
+    """
+    Construye el analizador: opciones globales y una suborden por comando, con la función
+    que la ejecuta en 'func'.
+    """
+    # Cada analizador recibe sus propias opciones globales: argparse comparte las acciones con
+    # el padre y los valores por defecto de uno cambiarían los del otro
+    parser = Parser(prog="manage-p2.py", parents=[global_options()],
+                    description="Gestión del escenario de balanceo de tráfico con VMs.")
+    parser.set_defaults(config=None, headless=None, consoles=None, summary=None, profile=False,
+                        dry_run=False, record=None, replay=None)
+    commands = parser.add_subparsers(dest="command", metavar="<orden>", required=True, parser_class=Parser)
+
+    def command(name, func, help, runner=True, reserve=False):
+        # 'runner': la orden ejecuta comandos externos y necesita configurar lib_cmd
+        # 'reserve': la orden crea o cambia las redes y reserva sus direcciones en el registro
+        sub = commands.add_parser(name, parents=[global_options()], help=help, description=help)
+        sub.set_defaults(func=func, runner=runner, reserve=reserve)
+        return sub
+
+    command("up", lambda args: up(), "crea, arranca y espera al escenario en un solo flujo", reserve=True)
+    command("down", lambda args: down(), "apaga y elimina el escenario")
+    command("create", lambda args: create(), "crea las redes, imágenes y definiciones de las VMs", reserve=True)
+    command("start", lambda args: start(), "arranca las VMs y espera a que estén operativas")
+    command("stop", lambda args: stop(), "apaga las VMs")
+    command("destroy", lambda args: destroy(), "elimina las VMs, sus ficheros y las redes")
+    command("apply", lambda args: apply(), "aplica solo lo que falta o ha cambiado", reserve=True)
+    command("wait", lambda args: wait(), "espera a que el escenario esté operativo")
+    command("bench", lambda args: bench(), "genera carga HTTP contra el balanceador")
+    command("haproxy-config", lambda args: haproxy_config(), "muestra y valida la configuración de HAProxy")
+    command("evict-golden", lambda args: evict_golden(), "elimina las imágenes doradas obsoletas")
+    command("scale", lambda args: scale(args.number_of_servers),
+            "cambia el número de servidores en caliente", reserve=True).add_argument("number_of_servers", type=int, metavar="<n>")
+    command("add-server", lambda args: scale(get_number_of_servers() + 1), "añade un servidor", reserve=True)
+    command("remove-server", lambda args: scale(get_number_of_servers() - 1), "elimina el último servidor",
+            reserve=True)
+    logs_parser = command("logs", lambda args: logs(args.vm, follow=args.follow, lines=args.lines),
+                          "muestra la consola guardada de una VM", runner=False)
+    logs_parser.add_argument("vm", metavar="<vm>")
+    logs_parser.add_argument("--follow", action="store_true", help="muestra las nuevas líneas hasta Ctrl+C")
+    logs_parser.add_argument("--lines", type=int, default=50, metavar="<n>", help="líneas guardadas a mostrar (50)")
+    command("metrics", lambda args: metrics(once=args.once),
+            "exporta las métricas del escenario para Prometheus").add_argument(
+                "--once", action="store_true", help="muestra las métricas una vez y termina")
+    command("snapshot", lambda args: snapshot(args.tag),
+            "guarda los overlays de las VMs apagadas").add_argument("tag", metavar="<etiqueta>")
+    command("reset", lambda args: reset(args.tag),
+            "restaura los overlays de una instantánea").add_argument("tag", metavar="<etiqueta>")
+    command("snapshots", lambda args: snapshots(), "lista las instantáneas del escenario", runner=False)
+    command("snapshot-rm", lambda args: snapshot_rm(args.tag), "elimina una instantánea",
+            runner=False).add_argument("tag", metavar="<etiqueta>")
+    command("status", lambda args: status(as_json=args.json), "estado guardado del escenario, sin consultar las VMs",
+            runner=False).add_argument("--json", action="store_true", help="en JSON")
+    return parser
+
+
+def run_command(args):
+    """
+    Ejecuta la orden y devuelve su código de salida: las que devuelven True/False se
+    convierten en EXIT_OK/EXIT_FAILED; 'up' y 'down' devuelven ya el código.
+    """
+    result = args.func(args)
+    if result is None or result is True:
+        return EXIT_OK
+    if result is False:
+        return EXIT_FAILED
+    return result
+
+
+if __name__ == "__main__":
+    """
+    Punto de entrada principal del script. Analiza la orden y sus opciones y ejecuta la acción correspondiente.
+    """
+    args = build_parser().parse_args()
+    CONFIG_FILE = args.config or CONFIG_FILE
+    HEADLESS = args.headless
+    CONSOLES = args.consoles
+    SUMMARY_FILE = args.summary
+    RESERVE_ADDRESSES = args.reserve
+    mode, recording = "run", None
+    if args.dry_run:
+        mode = "dry-run"
+    elif args.record or args.replay:
+        mode, recording = ("record", args.record) if args.record else ("replay", args.replay)
+
+    try:
+        init_log()
+    except ConfigError as e:
+        print(f"Configuración no válida: {e}", file=sys.stderr)
+        sys.exit(EXIT_FAILED)
+    for key in get_config().unknown():
+        logging.warning(f"Opción desconocida en {CONFIG_FILE}: {key}")
+
+    command = args.command
+    if args.runner:
+        configure_runner(mode, recording)
+    if args.profile:
+        trace.enable()
+
+    try:
+        with trace.span(command, lane="manage-p2"):
+            code = run_command(args)
+    except AddressError as e:
+        logging.error(f"Direcciones del escenario no válidas: {e}")
+        code = EXIT_FAILED
+    finally:
+        close_consoles()
+        if args.profile:
+            save_profile(command)
+
+    if code != EXIT_OK:
+        sys.exit(code)
     logging.info("CDPS - Programa ejecutado correctamente.")
-    
\ No newline at end of file
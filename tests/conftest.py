@@ -0,0 +1,20 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# Los módulos del proyecto están en la raíz del repositorio
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def manage(tmp_path, monkeypatch):
+  # manage-p2.py no se puede importar por su nombre: se carga de nuevo en cada prueba (con
+  # su estado global limpio) y se ejecuta en un directorio de trabajo vacío
+  monkeypatch.chdir(tmp_path)
+  spec = importlib.util.spec_from_file_location("manage_p2", os.path.join(ROOT, "manage-p2.py"))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
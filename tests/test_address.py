@@ -0,0 +1,37 @@
+import ipaddress
+
+import pytest
+
+from lib_address import AddressError, BlockAllocator, Registry
+from lib_topology import Topology
+
+
+def test_default_scenario_outside_pool():
+  # Las redes fijas del escenario sin nombre (10.1.x) no están en el rango configurado
+  allocator = BlockAllocator("172.16.0.0/12")
+  topology = Topology.from_config({"number_of_servers": 2, "address_pool": "172.16.0.0/12"}, allocator)
+  assert str(topology.networks["lan1"].subnet) == "10.1.1.0/24"
+  assert allocator.owner_of("10.1.2.11") == "default"
+
+  # Los escenarios con nombre siguen recibiendo su bloque del rango
+  named = Topology.from_config({"scenario": "t1", "number_of_servers": 2}, allocator)
+  assert named.networks["lan1"].subnet.subnet_of(ipaddress.ip_network("172.16.0.0/12"))
+
+
+def test_networks_outside_pool_still_checked_for_overlap():
+  allocator = BlockAllocator("172.16.0.0/12")
+  allocator.reserve("default", "10.1.0.0/22")
+  with pytest.raises(AddressError):
+    allocator.reserve("t1", "10.1.2.0/24")
+
+
+def test_registry_read_does_not_reserve(tmp_path):
+  path = str(tmp_path / "addresses.json")
+  Topology.from_config({"scenario": "t1", "number_of_servers": 2}, Registry(path).read())
+  assert not (tmp_path / "addresses.json").exists()
+
+  with Registry(path) as allocator:
+    t1 = Topology.from_config({"scenario": "t1", "number_of_servers": 2}, allocator)
+  # Las órdenes de consulta ven el bloque ya reservado
+  again = Topology.from_config({"scenario": "t1", "number_of_servers": 2}, Registry(path).read())
+  assert again.networks["lan1"].subnet == t1.networks["lan1"].subnet
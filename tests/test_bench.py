@@ -0,0 +1,69 @@
+import asyncio
+
+from lib_bench import Stats, run_load
+from lib_guest import FakeGuestBackend
+from lib_render import render_all
+from lib_topology import Topology
+
+
+def pages(config):
+  # index.html de cada servidor tal como se escribe en su imagen
+  backend = FakeGuestBackend()
+  for name, bundle in render_all(Topology.from_config(config)).items():
+    bundle.batch(name).apply(backend)
+  return {name: fs["/var/www/html/index.html"].encode()
+          for name, fs in backend.files.items() if "/var/www/html/index.html" in fs}
+
+
+def test_backends_default_scenario():
+  stats = Stats()
+  for body in pages({"number_of_servers": 3}).values():
+    stats.record(0.001, 200, body)
+  assert stats.backends == {"s1": 1, "s2": 1, "s3": 1}
+
+
+def test_backends_prefixed_scenario():
+  stats = Stats()
+  for name, body in pages({"scenario": "t1", "number_of_servers": 2}).items():
+    stats.record(0.001, 200, body)
+    stats.record(0.001, 200, body)
+  assert stats.backends == {"t1-s1": 2, "t1-s2": 2}
+
+
+def test_unknown_backend():
+  stats = Stats()
+  stats.record(0.001, 503, b"<html><body>No server is available</body></html>")
+  assert stats.backends == {"desconocido": 1}
+
+
+async def balancer(bodies):
+  # Servidor HTTP/1.1 keep-alive en 127.0.0.1 que reparte las respuestas por turnos, como HAProxy
+  served = [0]
+
+  async def handle(reader, writer):
+    while await reader.readline():
+      while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+      body = bodies[served[0] % len(bodies)]
+      served[0] += 1
+      writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+      await writer.drain()
+    writer.close()
+
+  return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_run_load_loopback():
+  async def main():
+    server = await balancer([b"<h1>Server s1</h1>", b"<h1>Server s2</h1>"])
+    async with server:
+      return await run_load("127.0.0.1", server.sockets[0].getsockname()[1], connections=4,
+                            duration=10, requests=40)
+
+  result = asyncio.run(main())
+  assert result["requests"] == 40 and result["errors"] == 0
+  assert result["status"] == {"200": 40}
+  assert result["backends"] == {"s1": 20, "s2": 20}
+  latency = result["latency_ms"]
+  assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+  assert result["throughput_rps"] > 0
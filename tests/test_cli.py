@@ -0,0 +1,142 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def configure(manage, **options):
+  with open(manage.CONFIG_FILE, "w") as f:
+    json.dump(options, f)
+
+
+class Terminal:
+  # Entrada estándar interactiva
+  def isatty(self):
+    return True
+
+
+def test_headless_precedence(manage, monkeypatch):
+  monkeypatch.setattr("sys.stdin", Terminal())
+  configure(manage)
+  assert not manage.is_headless()
+
+  # 'headless' del archivo JSON, y por encima --headless
+  manage.config = None
+  configure(manage, headless=True)
+  assert manage.is_headless()
+  manage.HEADLESS = False
+  assert not manage.is_headless()
+
+
+def test_headless_without_terminal(manage, monkeypatch):
+  monkeypatch.setattr("sys.stdin", None)
+  assert manage.is_headless()
+
+
+def test_console_mode_precedence(manage, monkeypatch):
+  monkeypatch.setattr("sys.stdin", Terminal())
+  assert manage.get_console_mode() == "xterm"
+  manage.HEADLESS = True
+  assert manage.get_console_mode() == "none"
+
+  # 'consoles' del archivo JSON, y por encima --consoles
+  manage.config = None
+  configure(manage, consoles="log")
+  assert manage.get_console_mode() == "log"
+  manage.CONSOLES = "xterm"
+  assert manage.get_console_mode() == "xterm"
+
+  manage.CONSOLES = "ventana"
+  with pytest.raises(ValueError):
+    manage.get_console_mode()
+
+
+@pytest.mark.parametrize("argv, call, runner, reserve", [
+  (["up"], ("up",), True, True),
+  (["down"], ("down",), True, False),
+  (["create"], ("create",), True, True),
+  (["start"], ("start",), True, False),
+  (["stop"], ("stop",), True, False),
+  (["destroy"], ("destroy",), True, False),
+  (["apply"], ("apply",), True, True),
+  (["wait"], ("wait",), True, False),
+  (["bench"], ("bench",), True, False),
+  (["haproxy-config"], ("haproxy_config",), True, False),
+  (["evict-golden"], ("evict_golden",), True, False),
+  (["scale", "5"], ("scale", 5), True, True),
+  (["add-server"], ("scale", 4), True, True),
+  (["remove-server"], ("scale", 2), True, True),
+  (["logs", "s1"], ("logs", "s1", False, 50), False, False),
+  (["logs", "s1", "--follow", "--lines", "10"], ("logs", "s1", True, 10), False, False),
+  (["metrics"], ("metrics", False), True, False),
+  (["metrics", "--once"], ("metrics", True), True, False),
+  (["snapshot", "base"], ("snapshot", "base"), True, False),
+  (["reset", "base"], ("reset", "base"), True, False),
+  (["snapshots"], ("snapshots",), False, False),
+  (["snapshot-rm", "base"], ("snapshot_rm", "base"), False, False),
+  (["status"], ("status", False), False, False),
+  (["status", "--json"], ("status", True), False, False),
+])
+def test_subcommands(manage, monkeypatch, argv, call, runner, reserve):
+  calls = []
+  for name in ("up", "down", "create", "start", "stop", "destroy", "apply", "wait", "bench", "haproxy_config",
+               "evict_golden", "scale", "snapshot", "reset", "snapshots", "snapshot_rm"):
+    monkeypatch.setattr(manage, name, lambda *args, name=name: calls.append((name,) + args))
+  monkeypatch.setattr(manage, "logs", lambda vm, follow, lines: calls.append(("logs", vm, follow, lines)))
+  monkeypatch.setattr(manage, "metrics", lambda once: calls.append(("metrics", once)))
+  monkeypatch.setattr(manage, "status", lambda as_json: calls.append(("status", as_json)))
+  monkeypatch.setattr(manage, "get_number_of_servers", lambda: 3)
+
+  args = manage.build_parser().parse_args(argv)
+  assert args.command == argv[0]
+  assert (args.runner, args.reserve) == (runner, reserve)
+  assert manage.run_command(args) == manage.EXIT_OK
+  assert calls == [call]
+
+
+def test_global_options_before_or_after_command(manage):
+  parser = manage.build_parser()
+  before = parser.parse_args(["--config", "otro.json", "--headless", "--consoles", "log", "--dry-run", "stop"])
+  after = parser.parse_args(["stop", "--config", "otro.json", "--headless", "--consoles", "log", "--dry-run"])
+  for args in (before, after):
+    assert (args.config, args.headless, args.consoles, args.dry_run) == ("otro.json", True, "log", True)
+  defaults = parser.parse_args(["stop"])
+  assert (defaults.config, defaults.headless, defaults.consoles, defaults.dry_run) == (None, None, None, False)
+
+
+@pytest.mark.parametrize("argv", [
+  [],
+  ["deploy"],
+  ["scale"],
+  ["scale", "muchos"],
+  ["logs"],
+  ["--dry-run", "--record", "cmds.jsonl", "stop"],
+])
+def test_usage_errors(manage, argv, capsys):
+  with pytest.raises(SystemExit) as exit:
+    manage.build_parser().parse_args(argv)
+  assert exit.value.code == manage.EXIT_FAILED
+  assert "error:" in capsys.readouterr().err
+
+
+def test_exit_codes(manage):
+  args = manage.build_parser().parse_args(["stop"])
+  for result, code in [(True, manage.EXIT_OK), (None, manage.EXIT_OK), (False, manage.EXIT_FAILED),
+                       (manage.EXIT_NOT_READY, manage.EXIT_NOT_READY)]:
+    args.func = lambda args, result=result: result
+    assert manage.run_command(args) == code
+
+
+def test_config_option(manage, tmp_path):
+  # --config sustituye a manage-p2.json, que aquí no es válido
+  configure(manage, number_of_servers=-1)
+  (tmp_path / "otro.json").write_text(json.dumps({"number_of_servers": 2, "address_registry": "addr.json"}))
+  script = os.path.join(os.path.dirname(manage.__file__), "manage-p2.py")
+  run = lambda *argv: subprocess.run([sys.executable, script, *argv], cwd=tmp_path, capture_output=True, text=True)
+
+  invalid = run("status")
+  assert invalid.returncode == manage.EXIT_FAILED and "Configuración no válida" in invalid.stderr
+  assert run("--config", "otro.json", "status").returncode == manage.EXIT_OK
+  assert run("status", "--config", "otro.json").returncode == manage.EXIT_OK
@@ -0,0 +1,104 @@
+import sys
+import time
+
+import pytest
+
+import lib_cmd as cmd
+from lib_cmd import CommandError, CommandTimeout, Runner
+
+
+def python(code):
+  return [sys.executable, "-c", code]
+
+
+def flaky(tmp_path, failures, message="Resource temporarily unavailable"):
+  # Comando que falla 'failures' veces con 'message' y después termina bien
+  counter = tmp_path / "attempts"
+  counter.write_text("0")
+  return python(f"import sys, pathlib\n"
+                f"p = pathlib.Path({str(counter)!r}); n = int(p.read_text()) + 1; p.write_text(str(n))\n"
+                f"if n <= {failures}:\n"
+                f"  sys.exit({message!r})\n"
+                f"print('ok', n)\n")
+
+
+def test_run_captures_output():
+  result = Runner().run(python("import sys; print(sys.stdin.read().upper()); sys.stderr.write('aviso')"),
+                        input="hola")
+  assert (result.returncode, result.stdout, result.stderr, result.attempts) == (0, "HOLA\n", "aviso", 1)
+
+
+def test_error():
+  with pytest.raises(CommandError) as error:
+    Runner().run(python("import sys; sys.exit('sin permiso')"))
+  assert error.value.returncode == 1 and "sin permiso" in str(error.value)
+  assert Runner().run(python("import sys; sys.exit(3)"), check=False).returncode == 3
+
+
+def test_retry_transient(tmp_path):
+  result = Runner(retries=2, backoff=0.01).run(flaky(tmp_path, 2))
+  assert result.stdout == "ok 3\n" and result.attempts == 3
+
+
+def test_retries_exhausted(tmp_path):
+  with pytest.raises(CommandError):
+    Runner(retries=1, backoff=0.01).run(flaky(tmp_path, 2))
+  assert (tmp_path / "attempts").read_text() == "2"
+
+
+def test_no_retry_on_other_errors(tmp_path):
+  with pytest.raises(CommandError):
+    Runner(retries=2, backoff=0.01).run(flaky(tmp_path, 1, "Permission denied"))
+  assert (tmp_path / "attempts").read_text() == "1"
+
+
+def test_timeout():
+  start = time.perf_counter()
+  with pytest.raises(CommandTimeout) as error:
+    Runner().run(python("import time; time.sleep(30)"), timeout=0.3)
+  assert error.value.timeout == 0.3
+  assert time.perf_counter() - start < 5
+
+
+def test_timeout_per_program():
+  runner = Runner(timeouts={"virsh": 5, "default": 7})
+  assert runner.timeout_for(["sudo", "virsh", "start", "s1"]) == 5
+  assert runner.timeout_for(["/usr/bin/qemu-img", "create"]) == cmd.TIMEOUTS["qemu-img"]
+  assert runner.timeout_for(["true"]) == 7
+
+
+def test_dry_run(tmp_path):
+  target = tmp_path / "creado"
+  runner = Runner("dry-run")
+  result = runner.run(python(f"open({str(target)!r}, 'w')"))
+  assert runner.simulated and result.returncode == 0 and result.stdout == ""
+  assert not target.exists()
+
+
+def test_record_replay(tmp_path):
+  recording = str(tmp_path / "recording.jsonl")
+  recorder = Runner("record", recording=recording)
+  first = recorder.run(python("import sys; print(sys.stdin.read()[::-1])"), input="abc")
+  failed = recorder.run(python("import sys; sys.exit('roto')"), check=False)
+
+  replay = Runner("replay", recording=recording)
+  assert replay.simulated
+  again = replay.run(python("import sys; print(sys.stdin.read()[::-1])"), input="abc")
+  assert (again.returncode, again.stdout) == (first.returncode, first.stdout) == (0, "cba\n")
+  assert replay.run(python("import sys; sys.exit('roto')"), check=False).stderr == failed.stderr
+  # Cada resultado grabado se devuelve una sola vez; la entrada forma parte de la clave
+  assert replay.run(python("import sys; print(sys.stdin.read()[::-1])"), input="abc", check=False).returncode == 127
+  assert replay.run(python("import sys; print(sys.stdin.read()[::-1])"), input="xyz", check=False).returncode == 127
+
+
+def test_invalid_mode():
+  with pytest.raises(ValueError):
+    Runner("simulate")
+  with pytest.raises(ValueError):
+    Runner("replay")
+
+
+def test_run_many_keeps_order():
+  results = Runner().run_many([python(f"import time; time.sleep({0.2 - i * 0.05}); print({i})") for i in range(4)],
+                              limit=4)
+  assert [r.stdout for r in results] == ["0\n", "1\n", "2\n", "3\n"]
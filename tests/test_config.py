@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import lib_haproxy as haproxy
+from lib_config import Config, ConfigError, check_option
+
+
+def write(tmp_path, data):
+  path = tmp_path / "manage-p2.json"
+  path.write_text(data if isinstance(data, str) else json.dumps(data))
+  return str(path)
+
+
+def test_load(tmp_path):
+  config = Config.load(write(tmp_path, {"number_of_servers": 3, "debug": True, "numbre_of_servers": 4}))
+  assert config.found
+  assert config.get("number_of_servers") == 3 and config.get("max_workers", 4) == 4
+  # Las opciones desconocidas se conservan para avisar de ellas
+  assert config.unknown() == ["numbre_of_servers"]
+
+
+def test_load_missing_file(tmp_path):
+  config = Config.load(str(tmp_path / "no-existe.json"))
+  assert not config.found and config.data == {}
+
+
+@pytest.mark.parametrize("text", ["{", "[1, 2]", '{"number_of_servers": -1}', '{"number_of_servers": "3"}',
+                                  '{"number_of_servers": true}', '{"ready_timeout": -0.5}', '{"debug": 1}'])
+def test_load_invalid(tmp_path, text):
+  with pytest.raises(ConfigError):
+    Config.load(write(tmp_path, text))
+
+
+def test_check_option():
+  check_option("ready_timeout", 0.5)
+  check_option("headless", False)
+  check_option("desconocida", object())
+  # None equivale a no indicar la opción
+  check_option("number_of_servers", None)
+  with pytest.raises(ConfigError, match="al menos 1"):
+    check_option("max_workers", 0)
+
+
+def test_set_saves_and_override_does_not(tmp_path):
+  path = write(tmp_path, {"number_of_servers": 3})
+  config = Config.load(path)
+  digest = config.digest()
+
+  # Una opción cambiada para la orden en curso tiene prioridad sobre el fichero, pero no se guarda
+  config.override("number_of_servers", 5)
+  assert config.get("number_of_servers") == 5 and config.digest() != digest
+  assert Config.load(path).get("number_of_servers") == 3
+  with pytest.raises(ConfigError):
+    config.override("number_of_servers", -1)
+
+  config.set("number_of_servers", 4)
+  assert Config.load(path).get("number_of_servers") == 4
+  with pytest.raises(ConfigError):
+    config.set("max_workers", "muchos")
+  assert Config.load(path).data == {"number_of_servers": 4}
+
+
+def test_digest_ignores_key_order():
+  assert Config({"a": 1, "b": 2}).digest() == Config({"b": 2, "a": 1}).digest()
+
+
+def test_haproxy_options_precedence():
+  # Lo indicado en 'haproxy' sustituye a los valores por defecto, también dentro de 'timeouts'
+  options = haproxy.options_from_config({"balance": "leastconn", "timeouts": {"client": "1m"}})
+  assert options["balance"] == "leastconn" and options["maxconn"] == haproxy.DEFAULTS["maxconn"]
+  assert options["timeouts"] == dict(haproxy.DEFAULTS["timeouts"], client="1m")
+  assert haproxy.DEFAULTS["timeouts"]["client"] == "30s"
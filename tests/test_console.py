@@ -0,0 +1,70 @@
+from lib_console import MAX_LINE, Console, ConsoleCollector, RotatingLog, log_path, read_tail
+from lib_hypervisor import FakeBackend
+
+
+class Lines:
+  # Destino de una consola en memoria, en lugar de RotatingLog
+  def __init__(self):
+    self.text = ""
+    self.closed = False
+
+  def write(self, text):
+    self.text += text
+
+  def close(self):
+    self.closed = True
+
+
+def test_console_lines_and_markers():
+  writer = Lines()
+  console = Console("lb", writer)
+  # Una línea partida entre dos lecturas, escapes de terminal y un carácter UTF-8 partido
+  console.feed(b"Booting l")
+  console.feed(b"b\r\n\x1b[1;32mStarting HAProxy: haproxy.\x1b[0m\nCami\xc3")
+  console.feed(b"\xb3n\nlb login: ")
+  assert [line.split(" ", 1)[1] for line in console.lines] == ["Booting lb", "Starting HAProxy: haproxy.", "Camión"]
+  # El prompt de login se detecta aunque la línea no haya terminado
+  assert set(console.markers) == {"haproxy", "login"}
+  assert console.events["login"].is_set() and not console.events["apache"].is_set()
+
+  console.close()
+  assert writer.text.splitlines()[-1].endswith(" lb login: ")
+
+
+def test_console_long_line():
+  console = Console("s1", Lines())
+  console.feed(b"x" * (MAX_LINE + 10))
+  assert len(console.lines) == 1 and console.lines[0].endswith(" " + "x" * MAX_LINE)
+  assert console.partial == ""
+
+
+def test_rotation_and_tail(tmp_path):
+  path = log_path(str(tmp_path), "s1")
+  writer = RotatingLog(path, max_bytes=40, backups=2)
+  for i in range(10):
+    writer.write(f"línea {i:02d} de la consola\n")
+  writer.close()
+  # Cada fichero guarda una línea; solo se conservan dos antiguos
+  assert sorted(p.name for p in tmp_path.iterdir()) == ["s1.log", "s1.log.1", "s1.log.2"]
+  assert read_tail(str(tmp_path), "s1", lines=50, backups=2) == [f"línea {i:02d} de la consola" for i in (7, 8, 9)]
+  assert read_tail(str(tmp_path), "s1", lines=2, backups=2) == ["línea 08 de la consola", "línea 09 de la consola"]
+  assert read_tail(str(tmp_path), "s9") == []
+
+
+def test_collector_waits_for_markers(tmp_path):
+  # La consola simulada del backend 'fake' muestra las marcas de todos los roles y el login
+  collector = ConsoleCollector(FakeBackend(), str(tmp_path))
+  try:
+    collector.attach("lb")
+    collector.attach("s1")
+    lines = collector.follow("s1")
+    times = collector.wait_markers({"lb": ["haproxy", "login"], "s1": ["apache", "login"], "c1": ["login"]}, 10)
+    assert times["lb"] is not None and times["s1"] is not None
+    # 'c1' no tiene consola abierta
+    assert times["c1"] is None
+    assert lines.get(timeout=5).endswith("Booting s1")
+    assert set(collector.boot_times()["lb"]) == {"haproxy", "apache", "login"}
+  finally:
+    collector.close()
+  assert read_tail(str(tmp_path), "lb")[0].endswith("Booting lb")
+  assert read_tail(str(tmp_path), "lb")[-1].endswith("lb login: ")
@@ -0,0 +1,44 @@
+import pytest
+
+from lib_guest import FakeGuestBackend, GuestBatch, GuestfishBackend
+from lib_render import render_all
+from lib_topology import Topology
+
+
+def test_guestfish_script():
+  batch = (GuestBatch("lb.qcow2")
+           .write("/etc/hostname", "lb")
+           .write("/etc/motd", 'Línea "1"\n\tcon \\ barra\n')
+           .edit("/etc/rc.local", "s|^exit 0|sudo service haproxy restart\\nexit 0|")
+           .cat("/etc/hostname"))
+  assert GuestfishBackend().script(batch) == (
+    'write /etc/hostname "lb"\n'
+    'write /etc/motd "Línea \\"1\\"\\n\\tcon \\\\ barra\\n"\n'
+    'sh "sed -i -e \'s|^exit 0|sudo service haproxy restart\\\\nexit 0|\' /etc/rc.local"\n'
+    'cat /etc/hostname\n')
+
+
+def test_guestfish_unknown_op():
+  batch = GuestBatch("lb.qcow2")
+  batch.ops.append(("rm", "/etc/hostname"))
+  with pytest.raises(ValueError):
+    GuestfishBackend().script(batch)
+
+
+def test_one_session_per_image():
+  bundles = render_all(Topology.from_config({"number_of_servers": 2}))
+  backend = FakeGuestBackend({"lb.qcow2": {"/etc/rc.local": "#!/bin/sh\nexit 0"}})
+  for name, bundle in bundles.items():
+    batch = bundle.batch(f"{name}.qcow2")
+    batch.edit("/etc/rc.local", "s|^exit 0|sudo service haproxy restart\\nexit 0|").cat("/etc/rc.local")
+    output = batch.apply(backend)
+
+  # Una sola sesión por imagen, con todas sus operaciones en el orden en que se añadieron
+  assert [image for image, _ in backend.sessions] == [f"{name}.qcow2" for name in bundles]
+  for (image, ops), bundle in zip(backend.sessions, bundles.values()):
+    assert ops[:len(bundle.ops)] == bundle.ops
+    assert [op[0] for op in ops[len(bundle.ops):]] == ["edit", "cat"]
+
+  assert backend.files["lb.qcow2"]["/etc/rc.local"] == "#!/bin/sh\nsudo service haproxy restart\nexit 0"
+  assert output == backend.files[f"{name}.qcow2"]["/etc/rc.local"]
+  assert backend.files["s1.qcow2"]["/etc/hostname"] == "s1"
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+import lib_haproxy as haproxy
+from lib_render import render_all
+from lib_topology import Topology, render_haproxy
+
+SNAPSHOTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata", "haproxy")
+
+MULTI_LB = {
+  "scenario": "t1",
+  "number_of_servers": 4,
+  "number_of_balancers": 2,
+  "networks": {"lan1": "10.2.1.0/24", "lan2": "10.2.2.0/24", "lan3": "10.2.3.0/24"},
+  "server_networks": ["lan2", "lan3"],
+  "haproxy": {"balance": "leastconn", "weights": {"t1-s1": 3}, "server_maxconn": 100,
+              "keep_alive": False, "nbthread": 2, "stats_port": None},
+}
+
+
+def snapshot(name):
+  with open(os.path.join(SNAPSHOTS, name)) as f:
+    return f.read()
+
+
+def test_default_topology():
+  topology = Topology.from_config({"number_of_servers": 3})
+  assert render_haproxy(topology) == snapshot("default.cfg")
+
+
+@pytest.mark.parametrize("lb", ["t1-lb1", "t1-lb2"])
+def test_multiple_balancers_prefixed(lb):
+  topology = Topology.from_config(MULTI_LB)
+  assert render_haproxy(topology, topology.nodes[lb]) == snapshot(f"{lb}.cfg")
+
+
+def test_render_all_one_config_per_balancer():
+  topology = Topology.from_config(MULTI_LB)
+  bundles = render_all(topology)
+  configs = {name: dict((op[1], op[2]) for op in bundle.ops if op[0] == "write").get("/etc/haproxy/haproxy.cfg")
+             for name, bundle in bundles.items()}
+  assert configs["t1-lb1"] == snapshot("t1-lb1.cfg")
+  assert configs["t1-lb2"] == snapshot("t1-lb2.cfg")
+  assert configs["t1-s1"] is None and configs["t1-c1"] is None
+
+
+def test_runtime_api_only_for_host():
+  topology = Topology.from_config({"number_of_servers": 1})
+  text = render_haproxy(topology)
+  assert "ipv4@*" not in text
+  assert f"    bind {topology.balancers[0].address}:9999\n" in text
+  assert f"reject unless {{ src {topology.host_interface.address} }}" in text
+
+
+def test_stats_only_for_host():
+  topology = Topology.from_config({"number_of_servers": 1})
+  text = render_haproxy(topology)
+  assert "*:8404" not in text
+  assert (f"frontend stats\n    bind {topology.balancers[0].address}:8404\n    mode http\n"
+          f"    tcp-request connection reject unless {{ src {topology.host_interface.address} }}\n") in text
+
+
+def test_runtime_api_disabled():
+  options = haproxy.options_from_config({"runtime_api_port": None, "stats_port": None})
+  text = haproxy.render([("s1", "10.1.2.11", 80)], options)
+  assert "stats socket" not in text and "runtime_api" not in text
+  assert haproxy.backend_servers(text) == ["s1"]
+
+
+def test_runtime_api_needs_address():
+  options = haproxy.options_from_config({})
+  with pytest.raises(ValueError):
+    haproxy.render([("s1", "10.1.2.11", 80)], options)
+
+
+def test_no_servers():
+  topology = Topology.from_config({"number_of_servers": 0})
+  text = render_haproxy(topology)
+  assert haproxy.backend_servers(text) == []
+  assert "backend webservers" in text
+
+
+def test_hash_type_and_reuse():
+  options = haproxy.options_from_config({"balance": "uri", "hash_type": "consistent", "http_reuse": "always",
+                                         "runtime_api_port": None, "stats_port": None})
+  text = haproxy.render([("s1", "10.1.2.11", 80)], options)
+  assert "    balance uri\n    hash-type consistent\n    http-reuse always\n" in text
+
+
+@pytest.mark.parametrize("config", [
+  {"balance": "random"},
+  {"hash_type": "md5"},
+  {"http_reuse": "sometimes"},
+  {"maxconn": 0},
+  {"nbthread": "2"},
+  {"check_inter": "2 s"},
+  {"timeouts": {"client": "soon"}},
+  {"weights": {"s1": 300}},
+  {"unknown": 1},
+])
+def test_invalid_options(config):
+  with pytest.raises(ValueError):
+    haproxy.options_from_config(config)
+
+
+def test_weights_for_missing_servers():
+  options = haproxy.options_from_config({"weights": {"s9": 2}, "runtime_api_port": None, "stats_port": None})
+  with pytest.raises(ValueError):
+    haproxy.render([("s1", "10.1.2.11", 80)], options)
+
+
+def test_backend_servers_ignores_other_sections():
+  text = snapshot("default.cfg")
+  assert haproxy.backend_servers(text) == ["s1", "s2", "s3"]
+  assert haproxy.backend_servers(text, "runtime_api") == ["admin"]
+  haproxy.check_backends(text, ["s1", "s2", "s3"])
+  with pytest.raises(ValueError):
+    haproxy.check_backends(text, ["s1", "s2"])
@@ -0,0 +1,77 @@
+import pytest
+
+from lib_hypervisor import (FakeBackend, HypervisorError, RUNNING, SHUTOFF, VirshBackend, get_backend, not_found,
+                            normalize_state)
+
+
+def test_fake_lifecycle():
+  hypervisor = FakeBackend()
+  hypervisor.define("s1", "<domain>s1</domain>")
+  assert hypervisor.list_domains() == {"s1": SHUTOFF}
+
+  hypervisor.start("s1")
+  assert hypervisor.state("s1") == RUNNING
+  hypervisor.shutdown("s1")
+  assert hypervisor.state("s1") == SHUTOFF
+  hypervisor.start("s1")
+  hypervisor.destroy("s1")
+  assert hypervisor.state("s1") == SHUTOFF
+
+  hypervisor.undefine("s1")
+  assert hypervisor.list_domains() == {}
+  assert hypervisor.state("s1") is None
+  assert hypervisor.calls == [("define", "s1"), ("start", "s1"), ("shutdown", "s1"), ("start", "s1"),
+                              ("destroy", "s1"), ("undefine", "s1")]
+
+
+def test_fake_redefine_keeps_state():
+  hypervisor = FakeBackend()
+  hypervisor.define("lb", "<domain>1</domain>")
+  hypervisor.start("lb")
+  hypervisor.define("lb", "<domain>2</domain>")
+  assert hypervisor.domains["lb"] == {"state": RUNNING, "xml": "<domain>2</domain>"}
+
+
+def test_fake_errors():
+  hypervisor = FakeBackend()
+  hypervisor.define("s1", "<domain/>")
+  # Mismos errores que virsh: no se puede apagar lo apagado ni arrancar lo arrancado
+  with pytest.raises(HypervisorError):
+    hypervisor.shutdown("s1")
+  with pytest.raises(HypervisorError):
+    hypervisor.destroy("s1")
+  hypervisor.start("s1")
+  with pytest.raises(HypervisorError):
+    hypervisor.start("s1")
+  with pytest.raises(HypervisorError) as error:
+    hypervisor.undefine("s2")
+  assert not_found(error.value)
+
+
+def test_fake_shared_between_runs(tmp_path):
+  path = str(tmp_path / "fake.json")
+  first = get_backend("fake", fake_path=path)
+  first.define("lb", "<domain/>")
+  first.start("lb")
+  assert get_backend("fake", fake_path=path).list_domains() == {"lb": RUNNING}
+
+
+def test_get_backend():
+  assert isinstance(get_backend("virsh"), VirshBackend)
+  with pytest.raises(ValueError):
+    get_backend("xen")
+
+
+@pytest.mark.parametrize("message", [
+  "error: failed to get domain 's9'",
+  "undefine de s9 ha fallado: Domain not found: no domain with matching name 's9'",
+  "Dominio no encontrado: s9",
+])
+def test_not_found(message):
+  assert not_found(HypervisorError(message))
+  assert not not_found(HypervisorError("Requested operation is not valid: domain is already running"))
+
+
+def test_normalize_state():
+  assert [normalize_state(s) for s in ("running", "paused", "shut off", "shutoff", "crashed")] == \
+    ["running", "paused", "shut off", "shut off", "other"]
@@ -0,0 +1,151 @@
+import json
+
+import pytest
+
+from lib_hypervisor import parse_domstats
+from lib_metrics import (parse_haproxy_csv, haproxy_samples, domain_samples, parse_ovs_tables, ovs_samples,
+                         render)
+
+# Salida real de /stats;csv, recortada a las columnas que se usan y a unas pocas filas
+HAPROXY_CSV = """\
+# pxname,svname,qcur,scur,stot,bin,bout,status,act,lbtot,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,req_tot,
+stats,FRONTEND,,1,12,1800,52000,OPEN,,,0,11,0,1,0,0,12,
+lb,FRONTEND,,3,5000,400000,9000000,OPEN,,,0,4990,0,0,10,0,5000,
+webservers,s1,0,2,2600,200000,4600000,UP,1,2600,0,2595,0,0,5,0,,
+webservers,s2,0,1,2400,200000,4400000,DOWN,1,2400,0,2395,0,0,5,0,,
+webservers,BACKEND,0,3,5000,400000,9000000,UP,1,5000,0,4990,0,0,10,0,5000,
+"""
+
+DOMSTATS = """\
+Domain: 's1'
+  state.state=1
+  state.reason=1
+  cpu.time=2500000000
+  balloon.current=524288
+  balloon.rss=310000
+  net.count=1
+  net.0.name=vnet0
+  net.0.rx.bytes=1000
+  net.0.rx.pkts=10
+  net.0.tx.bytes=2000
+  net.0.tx.pkts=20
+
+Domain: 'c1'
+  state.state=5
+  state.reason=0
+
+"""
+
+OVS_TABLES = "\n".join(json.dumps(table) for table in [
+  {"headings": ["name", "ports"],
+   "data": [["lan1", ["set", [["uuid", "p1"], ["uuid", "p2"]]]], ["lan2", ["uuid", "p3"]]]},
+  {"headings": ["_uuid", "interfaces"],
+   "data": [[["uuid", "p1"], ["uuid", "i1"]], [["uuid", "p2"], ["uuid", "i2"]], [["uuid", "p3"], ["uuid", "i3"]]]},
+  {"headings": ["_uuid", "name", "statistics"],
+   "data": [[["uuid", "i1"], "vnet0", ["map", [["rx_bytes", 100], ["tx_bytes", 200], ["rx_dropped", 0]]]],
+            [["uuid", "i2"], "lan1", ["map", []]],
+            [["uuid", "i3"], "vnet1", ["map", [["rx_packets", 7]]]]]},
+]) + "\n"
+
+
+def by_name(samples):
+  return {(metric, tuple(sorted(labels.items()))): value for metric, labels, value in samples}
+
+
+def test_haproxy_csv():
+  samples = by_name(haproxy_samples(parse_haproxy_csv(HAPROXY_CSV), "lb"))
+  assert samples[("haproxy_frontend_requests_total", (("frontend", "lb"), ("lb", "lb")))] == 5000
+  assert samples[("haproxy_server_up", (("backend", "webservers"), ("lb", "lb"), ("server", "s1")))] == 1
+  assert samples[("haproxy_server_up", (("backend", "webservers"), ("lb", "lb"), ("server", "s2")))] == 0
+  assert samples[("haproxy_server_http_responses_total",
+                  (("backend", "webservers"), ("code", "5xx"), ("lb", "lb"), ("server", "s1")))] == 5
+  assert samples[("haproxy_backend_active_servers", (("backend", "webservers"), ("lb", "lb")))] == 1
+
+
+@pytest.mark.parametrize("text", ["", "\n", "# pxname,svname,scur\n", "<html><body>503</body></html>\n"])
+def test_haproxy_csv_empty(text):
+  assert haproxy_samples(parse_haproxy_csv(text), "lb") == []
+
+
+def test_haproxy_csv_malformed_rows():
+  # Fila cortada a mitad y valores no numéricos: se exporta lo que se puede leer
+  text = "# pxname,svname,scur,stot,status\nwebservers,s1,x,12\nwebservers,s2,1\n"
+  samples = by_name(haproxy_samples(parse_haproxy_csv(text), "lb"))
+  assert samples[("haproxy_server_sessions_total", (("backend", "webservers"), ("lb", "lb"), ("server", "s1")))] == 12
+  assert ("haproxy_server_current_sessions", (("backend", "webservers"), ("lb", "lb"), ("server", "s1"))) not in samples
+  assert samples[("haproxy_server_up", (("backend", "webservers"), ("lb", "lb"), ("server", "s2")))] == 0
+
+
+def test_domstats():
+  stats = parse_domstats(DOMSTATS)
+  assert stats["s1"]["cpu.time"] == 2500000000 and stats["s1"]["net.0.name"] == "vnet0"
+  samples = by_name(domain_samples(stats, {"s1", "c1"}))
+  assert samples[("libvirt_domain_up", (("domain", "s1"),))] == 1
+  assert samples[("libvirt_domain_up", (("domain", "c1"),))] == 0
+  assert samples[("libvirt_domain_cpu_seconds_total", (("domain", "s1"),))] == 2.5
+  assert samples[("libvirt_domain_memory_bytes", (("domain", "s1"),))] == 524288 * 1024
+  assert samples[("libvirt_domain_interface_transmit_bytes_total", (("domain", "s1"), ("interface", "vnet0")))] == 2000
+
+
+def test_domstats_filters_domains():
+  samples = domain_samples(parse_domstats(DOMSTATS), {"c1"})
+  assert {labels["domain"] for _, labels, _ in samples} == {"c1"}
+
+
+@pytest.mark.parametrize("text", ["", "\n\n", "error: failed to connect to the hypervisor\n"])
+def test_domstats_empty(text):
+  assert parse_domstats(text) == {}
+  assert domain_samples(parse_domstats(text)) == []
+
+
+def test_domstats_malformed():
+  # Claves sin valor numérico, líneas sin '=' y contadores de interfaz ausentes
+  text = "  cpu.time=1\nDomain: 's1'\n  state.state=1\n  cpu.time=n/a\n  garbage\n  net.count=2\n  net.0.rx.bytes=5\n"
+  stats = parse_domstats(text)
+  assert list(stats) == ["s1"]
+  samples = by_name(domain_samples(stats))
+  assert samples[("libvirt_domain_up", (("domain", "s1"),))] == 1
+  assert ("libvirt_domain_cpu_seconds_total", (("domain", "s1"),)) not in samples
+  assert samples[("libvirt_domain_interface_receive_bytes_total", (("domain", "s1"), ("interface", "0")))] == 5
+
+  assert domain_samples({"s1": {"net.count": "dos"}}) == [("libvirt_domain_up", {"domain": "s1"}, 0)]
+
+
+def test_ovs_tables():
+  stats = parse_ovs_tables(OVS_TABLES)
+  assert stats == {"lan1": {"vnet0": {"rx_bytes": 100, "tx_bytes": 200, "rx_dropped": 0}, "lan1": {}},
+                   "lan2": {"vnet1": {"rx_packets": 7}}}
+  samples = by_name(ovs_samples(stats, {"lan1"}))
+  assert samples == {("ovs_interface_receive_bytes_total", (("bridge", "lan1"), ("interface", "vnet0"))): 100,
+                     ("ovs_interface_transmit_bytes_total", (("bridge", "lan1"), ("interface", "vnet0"))): 200,
+                     ("ovs_interface_receive_dropped_total", (("bridge", "lan1"), ("interface", "vnet0"))): 0}
+
+
+def test_ovs_tables_no_bridges():
+  empty = "\n".join(json.dumps({"headings": headings, "data": []})
+                    for headings in (["name", "ports"], ["_uuid", "interfaces"], ["_uuid", "name", "statistics"]))
+  assert parse_ovs_tables(empty) == {}
+
+
+@pytest.mark.parametrize("text", [
+  "",
+  "ovs-vsctl: unix:/var/run/openvswitch/db.sock: database connection failed\n",
+  OVS_TABLES.split("\n", 1)[1],
+  OVS_TABLES[:-40],
+  "[1, 2]\n{}\n{}\n",
+  '{"headings": ["name"], "data": [["lan1"]]}\n' * 3,
+])
+def test_ovs_tables_malformed(text):
+  with pytest.raises(ValueError):
+    parse_ovs_tables(text)
+
+
+def test_render():
+  samples = [("haproxy_server_up", {"lb": "lb", "server": 's"1'}, 1), ("manage_p2_scrape_success", {}, 0)]
+  assert render(samples) == (
+    "# HELP haproxy_server_up 1 si el servidor está UP según las comprobaciones de salud\n"
+    "# TYPE haproxy_server_up gauge\n"
+    'haproxy_server_up{lb="lb",server="s\\"1"} 1\n'
+    "# HELP manage_p2_scrape_success 1 si la última lectura de la fuente fue correcta\n"
+    "# TYPE manage_p2_scrape_success gauge\n"
+    "manage_p2_scrape_success 0\n")
@@ -0,0 +1,48 @@
+from lib_netplan import FakeRunner, NetPlan, host_plan, scenario_plan, teardown_plan
+from lib_topology import Topology
+
+
+def topology():
+  return Topology.from_config({"number_of_servers": 2})
+
+
+def test_scenario_plan():
+  runner = FakeRunner()
+  scenario_plan(topology(), runner).apply()
+  # Una sola transacción de OVS y un solo lote de 'ip', en ese orden
+  assert runner.commands == [
+    (["sudo", "ovs-vsctl", "--may-exist", "add-br", "lan1", "--", "--may-exist", "add-br", "lan2"], None),
+    (["sudo", "ip", "-batch", "-"],
+     "addr replace 10.1.1.0/24 dev lan1\n"
+     "link set dev lan1 up\n"
+     "addr replace 10.1.2.0/24 dev lan2\n"
+     "link set dev lan2 up\n"),
+  ]
+
+
+def test_host_plan():
+  runner = FakeRunner()
+  host_plan(topology(), runner).apply()
+  # Sin cambios en OVS: solo direcciones y rutas
+  assert runner.commands == [
+    (["sudo", "ip", "-batch", "-"],
+     "link set dev lan1 up\n"
+     "link set dev lan2 up\n"
+     "addr replace 10.1.1.3/24 dev lan1\n"
+     "route replace 10.1.0.0/22 via 10.1.1.1\n"),
+  ]
+
+
+def test_teardown_plan_prefixed():
+  runner = FakeRunner()
+  config = {"scenario": "t1", "number_of_servers": 1, "networks": {"lan1": "10.2.1.0/24", "lan2": "10.2.2.0/24"}}
+  teardown_plan(Topology.from_config(config), runner).apply()
+  assert runner.commands == [
+    (["sudo", "ovs-vsctl", "--if-exists", "del-br", "t1-lan1", "--", "--if-exists", "del-br", "t1-lan2"], None),
+  ]
+
+
+def test_empty_plan():
+  runner = FakeRunner()
+  NetPlan(runner).apply()
+  assert runner.commands == []
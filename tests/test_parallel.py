@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from lib_parallel import Executor
+
+
+def recorder():
+  # Orden en que terminan las tareas, desde varios hilos
+  order, lock = [], threading.Lock()
+
+  def task(name, delay=0.0):
+    def run():
+      time.sleep(delay)
+      with lock:
+        order.append(name)
+    return run
+  return order, task
+
+
+def test_dependencies_run_first():
+  order, task = recorder()
+  executor = Executor(4)
+  # 'golden' tarda más que las tareas independientes, pero las que dependen de ella esperan
+  executor.add("golden", task("golden", 0.05))
+  executor.add("net", task("net"))
+  for name in ("s1", "s2"):
+    executor.add(f"image:{name}", task(f"image:{name}"), deps=["golden"])
+    executor.add(f"start:{name}", task(f"start:{name}"), deps=[f"image:{name}", "net"])
+  assert executor.run()
+
+  assert sorted(order) == sorted(executor.tasks)
+  for name in ("s1", "s2"):
+    assert order.index("golden") < order.index(f"image:{name}") < order.index(f"start:{name}")
+    assert order.index("net") < order.index(f"start:{name}")
+  assert all(t["status"] == "done" for t in executor.timings().values())
+
+
+def test_independent_tasks_run_in_parallel():
+  executor = Executor(4)
+  for i in range(4):
+    executor.add(f"sleep:{i}", lambda: time.sleep(0.1))
+  start = time.perf_counter()
+  assert executor.run()
+  assert time.perf_counter() - start < 0.3
+
+
+def test_failure_skips_dependents():
+  order, task = recorder()
+
+  def fail():
+    raise RuntimeError("imagen no creada")
+
+  executor = Executor(2)
+  executor.add("image:s1", fail)
+  executor.add("define:s1", task("define:s1"), deps=["image:s1"])
+  executor.add("start:s1", task("start:s1"), deps=["define:s1"])
+  executor.add("image:s2", task("image:s2"))
+  assert not executor.run()
+
+  # Las tareas que no dependen de la fallida terminan igualmente
+  assert order == ["image:s2"]
+  statuses = {name: t["status"] for name, t in executor.timings().items()}
+  assert statuses == {"image:s1": "failed", "define:s1": "skipped", "start:s1": "skipped", "image:s2": "done"}
+  assert executor.timings()["define:s1"]["start"] is None
+
+
+def test_unknown_dependency():
+  executor = Executor()
+  executor.add("start:s1", lambda: None, deps=["define:s1"])
+  with pytest.raises(ValueError, match="desconocida"):
+    executor.run()
+
+
+def test_cycle():
+  executor = Executor()
+  executor.add("a", lambda: None, deps=["c"])
+  executor.add("b", lambda: None, deps=["a"])
+  executor.add("c", lambda: None, deps=["b"])
+  executor.add("d", lambda: None)
+  with pytest.raises(ValueError, match="cíclicas"):
+    executor.run()
+  assert executor.tasks["d"].status == "pending"
+
+
+def test_duplicate_task():
+  executor = Executor()
+  executor.add("a", lambda: None)
+  with pytest.raises(ValueError):
+    executor.add("a", lambda: None)
@@ -0,0 +1,81 @@
+import asyncio
+import socket
+import time
+
+import lib_ready as ready
+from lib_hypervisor import FakeBackend
+
+
+async def listening():
+  # Servidor en un puerto libre de 127.0.0.1 que cierra cada conexión al aceptarla
+  async def accept(reader, writer):
+    writer.close()
+  return await asyncio.start_server(accept, "127.0.0.1", 0)
+
+
+def free_port():
+  # Puerto sin nadie escuchando: la conexión se rechaza al momento
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+def test_wait_tcp():
+  async def main():
+    server = await listening()
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+      return await ready.wait_tcp("127.0.0.1", port, time.monotonic() + 5)
+
+  start = time.monotonic()
+  accepted = asyncio.run(main())
+  assert accepted is not None and start <= accepted < start + 5
+
+
+def test_wait_tcp_timeout():
+  start = time.monotonic()
+  assert asyncio.run(ready.wait_tcp("127.0.0.1", free_port(), time.monotonic() + 0.5)) is None
+  assert time.monotonic() - start < 2
+
+
+def test_wait_domains():
+  hypervisor = FakeBackend()
+  for name in ("lb", "s1"):
+    hypervisor.define(name, "<domain/>")
+  hypervisor.start("lb")
+  result = asyncio.run(ready.wait_domains(hypervisor, ["lb", "s1"], time.monotonic() + 0.3))
+  assert result["lb"] is not None and result["s1"] is None
+
+
+def test_wait_domains_started_later():
+  hypervisor = FakeBackend()
+  hypervisor.define("s1", "<domain/>")
+
+  async def main():
+    waiting = asyncio.create_task(ready.wait_domains(hypervisor, ["s1"], time.monotonic() + 5))
+    await asyncio.sleep(0.1)
+    hypervisor.start("s1")
+    return await waiting
+
+  assert asyncio.run(main())["s1"] is not None
+
+
+def test_wait_ready():
+  hypervisor = FakeBackend()
+  for name in ("lb", "s1", "c1"):
+    hypervisor.define(name, "<domain/>")
+    hypervisor.start(name)
+  closed = free_port()
+
+  async def main():
+    server = await listening()
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+      probes = {"lb": [("127.0.0.1", port)], "s1": [("127.0.0.1", closed)], "c1": []}
+      return await ready.wait_ready(probes, 0.5, hypervisor)
+
+  results = asyncio.run(main())
+  # 'c1' solo necesita estar arrancado; 's1' no acepta conexiones
+  assert results["lb"] is not None and results["c1"] is not None
+  assert results["s1"] is None
+  assert not ready.report(results)
@@ -0,0 +1,39 @@
+import hashlib
+import json
+
+from lib_guest import FakeGuestBackend, GuestBatch, GuestfishBackend
+from lib_render import Bundle, render_all
+from lib_topology import Topology
+
+
+def test_bundle_is_a_guest_batch():
+  bundle = Bundle("s1").write("/etc/hostname", "s1").edit("/etc/hosts", "s/a/b/")
+  batch = GuestBatch("s1.qcow2").write("/etc/hostname", "s1").edit("/etc/hosts", "s/a/b/")
+  assert bundle.ops == batch.ops
+  assert bundle.digest == batch.digest
+  assert GuestfishBackend().script(bundle) == GuestfishBackend().script(batch)
+
+
+def test_digest_matches_saved_state():
+  # Los bundle_hash ya guardados en vm_state.json se calcularon así: no deben cambiar
+  bundle = Bundle("s1").write("/etc/hostname", "s1")
+  expected = hashlib.sha256(json.dumps([("write", "/etc/hostname", "s1")], separators=(",", ":")).encode())
+  assert bundle.digest == expected.hexdigest()
+
+
+def test_batch_copies_ops():
+  bundle = render_all(Topology.from_config({"number_of_servers": 1}))["s1"]
+  batch = bundle.batch(extra_ops=[("cat", "/etc/network/interfaces")])
+  assert batch.image == "s1.qcow2"
+  assert batch.ops[:-1] == bundle.ops and len(batch.ops) == len(bundle.ops) + 1
+  backend = FakeGuestBackend()
+  batch.apply(backend)
+  assert backend.files["s1.qcow2"]["/etc/hostname"] == "s1"
+
+
+def test_unchanged_nodes_keep_their_digest():
+  before = {name: b.digest for name, b in render_all(Topology.from_config({"number_of_servers": 2})).items()}
+  after = {name: b.digest for name, b in render_all(Topology.from_config({"number_of_servers": 3})).items()}
+  # Solo cambia el balanceador (nuevo backend) y aparece s3
+  assert [name for name in before if before[name] != after[name]] == ["lb"]
+  assert "s3" in after
@@ -0,0 +1,62 @@
+import asyncio
+
+from lib_hypervisor import FakeBackend, PAUSED, RUNNING, SHUTOFF
+from lib_shutdown import ACPI, ALREADY_OFF, FAILED, FORCED, MISSING, report, shutdown_all
+
+
+class Ignoring(FakeBackend):
+  # Los dominios de 'ignored' no atienden el apagado ACPI; los de 'stuck' tampoco a 'destroy'
+  def __init__(self, ignored=(), stuck=()):
+    super().__init__()
+    self.ignored = set(ignored) | set(stuck)
+    self.stuck = set(stuck)
+
+  def shutdown(self, name):
+    if name in self.ignored:
+      self._record("shutdown", name)
+    else:
+      super().shutdown(name)
+
+  def destroy(self, name):
+    if name in self.stuck:
+      self._record("destroy", name)
+    else:
+      super().destroy(name)
+
+
+def scenario(hypervisor, running=("lb", "s1", "s2"), off=("c1",)):
+  for name in running + off:
+    hypervisor.define(name, "<domain/>")
+  for name in running:
+    hypervisor.start(name)
+  return hypervisor
+
+
+def test_shutdown_all():
+  hypervisor = scenario(FakeBackend())
+  results = asyncio.run(shutdown_all(hypervisor, ["lb", "s1", "s2", "c1", "s9"], grace=5))
+  assert {name: r.method for name, r in results.items()} == \
+    {"lb": ACPI, "s1": ACPI, "s2": ACPI, "c1": ALREADY_OFF, "s9": MISSING}
+  assert set(hypervisor.list_domains().values()) == {SHUTOFF}
+  assert ("destroy", "lb") not in hypervisor.calls
+  assert report(results)
+
+
+def test_forced_after_grace():
+  hypervisor = scenario(Ignoring(ignored=["s2"]))
+  hypervisor.domains["s1"]["state"] = PAUSED
+  results = asyncio.run(shutdown_all(hypervisor, ["lb", "s1", "s2"], grace=0.3, poll=0.05))
+  # Un dominio en pausa se fuerza sin esperar; el que no atiende el apagado, al vencer el plazo
+  assert {name: r.method for name, r in results.items()} == {"lb": ACPI, "s1": FORCED, "s2": FORCED}
+  assert ("shutdown", "s1") not in hypervisor.calls
+  assert results["s1"].elapsed < results["s2"].elapsed
+  assert results["s2"].elapsed >= 0.3
+  assert set(hypervisor.list_domains().values()) == {SHUTOFF}
+
+
+def test_still_running_is_failure():
+  hypervisor = scenario(Ignoring(stuck=["s1"]))
+  results = asyncio.run(shutdown_all(hypervisor, ["lb", "s1"], grace=0.1, poll=0.05))
+  assert results["lb"].off
+  assert results["s1"].method == FAILED and RUNNING in results["s1"].error
+  assert not report(results)
@@ -0,0 +1,28 @@
+from lib_snapshot import SnapshotStore
+
+
+def overlay(tmp_path, name, data):
+  path = tmp_path / f"{name}.qcow2"
+  path.write_bytes(data)
+  return {"image": str(path)}
+
+
+def test_scenario_tags_do_not_collide(tmp_path):
+  directory = str(tmp_path / "snapshots")
+  default, t1 = SnapshotStore(directory), SnapshotStore(directory, "t1")
+  # 't1-base' del escenario por defecto y 'base' del escenario 't1'
+  with default:
+    default.capture("t1-base", {"s1": overlay(tmp_path, "s1", b"por defecto")})
+  with t1:
+    t1.capture("base", {"t1-s1": overlay(tmp_path, "t1-s1", b"t1")})
+
+  assert list(default.tags()) == ["t1-base"]
+  assert list(t1.tags()) == ["base"]
+  assert list(default.load("t1-base")["vms"]) == ["s1"]
+  assert list(t1.load("base")["vms"]) == ["t1-s1"]
+
+  # La limpieza conserva los objetos de todos los escenarios
+  assert len(default.referenced()[0]) == 2
+  with t1:
+    t1.delete("base")
+    assert t1.gc()[0] and list(default.tags()) == ["t1-base"]
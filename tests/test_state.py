@@ -0,0 +1,65 @@
+import json
+
+from lib_state import StateStore
+
+
+def interrupted(tmp_path):
+  # Orden 'create' que se interrumpe a mitad de escribir un cambio en el diario
+  store = StateStore(str(tmp_path / "vm_state.json")).load()
+  store.begin("create", "config-1")
+  store.record("vms", "s1", "image", image="s1.qcow2")
+  store.mark("image:s1")
+  store.journal.write('{"op":"update","section":"vms","name":"s2","fie')
+  store.journal.flush()
+  store.journal.close()
+  return store.path
+
+
+def test_truncated_line_is_discarded(tmp_path):
+  store = StateStore(interrupted(tmp_path)).load()
+  assert list(store.vms) == ["s1"]
+  assert store.pending == 5
+  with open(store.journal_path) as f:
+    assert all(json.loads(line) for line in f)
+
+
+def test_crash_resume_reload(tmp_path):
+  path = interrupted(tmp_path)
+
+  # La orden se repite con la misma configuración: se reanuda y añade los cambios que faltaban
+  store = StateStore(path).load()
+  assert store.begin("create", "config-1")
+  assert store.done("image:s1")
+  for name in ("s2", "s3"):
+    store.record("vms", name, "image", image=f"{name}.qcow2")
+    store.mark(f"image:{name}")
+  store.finish()
+  store.journal.close()
+
+  reloaded = StateStore(path).load()
+  assert sorted(reloaded.vms) == ["s1", "s2", "s3"]
+  assert reloaded.vms["s3"]["image"] == "s3.qcow2"
+  assert reloaded.done("image:s3")
+  assert reloaded.run["finished"]
+
+
+def test_line_without_newline_is_discarded(tmp_path):
+  store = StateStore(str(tmp_path / "vm_state.json")).load()
+  store.record("vms", "s1", "image")
+  store.journal.write('{"op":"update","section":"vms","name":"s2","fields":{}}')
+  store.journal.close()
+
+  store = StateStore(store.path).load()
+  store.record("vms", "s3", "image")
+  store.journal.close()
+  assert sorted(StateStore(store.path).load().vms) == ["s1", "s3"]
+
+
+def test_compact_after_reload(tmp_path):
+  path = interrupted(tmp_path)
+  store = StateStore(path).load()
+  store.record("vms", "s2", "image")
+  store.compact()
+  reloaded = StateStore(path).load()
+  assert sorted(reloaded.vms) == ["s1", "s2"]
+  assert reloaded.pending == 0
@@ -0,0 +1,39 @@
+import asyncio
+
+from lib_hypervisor import FakeBackend, HypervisorError, RUNNING
+from lib_teardown import remove_domains
+
+
+class Unlisted(FakeBackend):
+  # No se puede consultar la lista de dominios, y 'locked' no se deja eliminar
+  def list_domains(self):
+    raise HypervisorError("failed to connect to the hypervisor")
+
+  def undefine(self, name):
+    if name == "locked":
+      raise HypervisorError("undefine de locked ha fallado: Requested operation is not valid")
+    super().undefine(name)
+
+
+def test_remove_domains():
+  hypervisor = FakeBackend()
+  for name in ("lb", "s1"):
+    hypervisor.define(name, "<domain/>")
+  hypervisor.start("lb")
+  assert asyncio.run(remove_domains(hypervisor, ["lb", "s1", "s2"])) == {}
+  assert hypervisor.list_domains() == {}
+  # Solo se destruye el que estaba encendido y no se toca el que no existe
+  assert ("destroy", "s1") not in hypervisor.calls
+  assert ("undefine", "s2") not in hypervisor.calls
+
+
+def test_remove_domains_without_states():
+  hypervisor = Unlisted()
+  for name in ("lb", "locked"):
+    hypervisor.define(name, "<domain/>")
+  hypervisor.domains["lb"]["state"] = RUNNING
+
+  # Los errores de destroy y los dominios que no existen se perdonan; el resto no
+  failed = asyncio.run(remove_domains(hypervisor, ["lb", "locked", "s2"]))
+  assert list(failed) == ["locked"]
+  assert "lb" not in hypervisor.domains